@@ -1,91 +1,120 @@
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for
+from flask import Flask, Request, render_template, request, send_file, flash, redirect, url_for
 import pandas as pd
+import numpy as np
 import os
 from datetime import datetime
 import tempfile
 from werkzeug.utils import secure_filename
 import io
+import json
 import chardet
+import codecs
+import hashlib
+import importlib.util
+import mmap
 import re
 import logging
+import logging.handlers
+import queue
+import sqlite3
+import atexit
 import traceback
 import sys
+import time
+import contextlib
+import contextvars
+import tracemalloc
+import threading
+import uuid
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import copy
+from collections import OrderedDict
+try:
+    import resource  # Mesure du pic de mémoire (absent sous Windows)
+except ImportError:
+    resource = None
 
-# Configuration du logging avec sortie console forcée
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Configuration du logging: niveau réglable par LOG_LEVEL (INFO par défaut en
+# production, DEBUG en développement). Les messages ligne par ligne sont au
+# niveau DEBUG et ne sont donc ni formatés ni écrits en production.
+LOG_LEVEL = os.environ.get(
+    'LOG_LEVEL', 'DEBUG' if os.environ.get('FLASK_ENV') == 'development' else 'INFO'
+).upper()
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def configure_logging(log_queue, level=LOG_LEVEL):
+    """
+    Branche le logger racine sur une file: les appels de log ne font que
+    déposer l'enregistrement, l'écriture fichier/console est faite ailleurs
+    """
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(level)
+
+def start_log_listener(log_queue, handlers):
+    """Démarre le thread qui vide une file de logs vers les handlers (app.log et console)"""
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_handlers = [logging.FileHandler('app.log'), logging.StreamHandler(sys.stdout)]
+for _handler in log_handlers:
+    _handler.setFormatter(logging.Formatter(LOG_FORMAT))
+log_queue = queue.Queue(-1)
+configure_logging(log_queue)
+log_listener = start_log_listener(log_queue, log_handlers)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Taille maximale d'une requête, en octets (16MB par défaut). Les fichiers plus gros passent
+# par l'envoi par morceaux (/uploads), chaque morceau restant sous cette limite.
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
 # Middleware pour logger TOUTES les requêtes
 @app.before_request
 def log_request_info():
-    print(f"\n{'='*60}")
-    print(f"NOUVELLE REQUÊTE REÇUE:")
-    print(f"Method: {request.method}")
-    print(f"URL: {request.url}")
-    print(f"Path: {request.path}")
-    print(f"Endpoint: {request.endpoint}")
-    print(f"Headers: {dict(request.headers)}")
-    print(f"Form data: {dict(request.form) if request.form else 'Aucune'}")
-    print(f"Files: {list(request.files.keys()) if request.files else 'Aucun'}")
-    print(f"Args: {dict(request.args) if request.args else 'Aucun'}")
-    print(f"{'='*60}\n")
-    
-    logger.info(f"REQUEST: {request.method} {request.path}")
-    logger.debug(f"Headers: {dict(request.headers)}")
-    logger.debug(f"Form: {dict(request.form) if request.form else 'Empty'}")
-    logger.debug(f"Files: {list(request.files.keys()) if request.files else 'Empty'}")
+    logger.info("REQUEST: %s %s", request.method, request.path)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("URL: %s (endpoint: %s)", request.url, request.endpoint)
+        logger.debug("Headers: %s", dict(request.headers))
+        logger.debug("Form: %s", dict(request.form) if request.form else 'Empty')
+        logger.debug("Files: %s", list(request.files.keys()) if request.files else 'Empty')
+        logger.debug("Args: %s", dict(request.args) if request.args else 'Empty')
 
 @app.after_request
 def log_response_info(response):
-    print(f"\n{'='*60}")
-    print(f"RÉPONSE ENVOYÉE:")
-    print(f"Status: {response.status_code}")
-    print(f"Headers: {dict(response.headers)}")
-    print(f"{'='*60}\n")
-    
-    logger.info(f"RESPONSE: {response.status_code}")
+    logger.info("RESPONSE: %s", response.status_code)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Response headers: %s", dict(response.headers))
     return response
 
 # Gestionnaire d'erreurs global
 @app.errorhandler(Exception)
 def handle_exception(e):
-    logger.error(f"Exception non gérée: {str(e)}")
-    logger.error(f"Traceback complet: {traceback.format_exc()}")
+    logger.error("Exception non gérée: %s", e)
+    logger.error("Traceback complet: %s", traceback.format_exc())
     flash(f"Erreur inattendue: {str(e)}", 'error')
     return render_template('index.html'), 500
 
 @app.errorhandler(405)
 def method_not_allowed(e):
-    print(f"\n{'!'*80}")
-    print(f"ERREUR 405 METHOD NOT ALLOWED DÉTECTÉE!")
-    print(f"Method: {request.method}")
-    print(f"URL: {request.url}")
-    print(f"Path: {request.path}")
-    print(f"Endpoint: {request.endpoint}")
-    print(f"User-Agent: {request.headers.get('User-Agent', 'Unknown')}")
-    print(f"Referer: {request.headers.get('Referer', 'Unknown')}")
-    print(f"Content-Type: {request.headers.get('Content-Type', 'Unknown')}")
-    print(f"Headers complets: {dict(request.headers)}")
-    print(f"Form data: {dict(request.form) if request.form else 'Aucune'}")
-    print(f"Files: {list(request.files.keys()) if request.files else 'Aucun'}")
-    print(f"Args: {dict(request.args) if request.args else 'Aucun'}")
-    print(f"{'!'*80}\n")
-    
-    logger.error(f"Erreur 405 Method Not Allowed: {request.method} {request.url}")
-    logger.error(f"Headers: {dict(request.headers)}")
-    logger.error(f"Form data: {request.form}")
-    logger.error(f"Files: {request.files}")
+    logger.error("Erreur 405 Method Not Allowed: %s %s (endpoint: %s)", request.method, request.url, request.endpoint)
+    logger.error("User-Agent: %s, Referer: %s, Content-Type: %s",
+                 request.headers.get('User-Agent', 'Unknown'),
+                 request.headers.get('Referer', 'Unknown'),
+                 request.headers.get('Content-Type', 'Unknown'))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Headers: %s", dict(request.headers))
+        logger.debug("Form data: %s", dict(request.form) if request.form else 'Aucune')
+        logger.debug("Files: %s", list(request.files.keys()) if request.files else 'Aucun')
+        logger.debug("Args: %s", dict(request.args) if request.args else 'Aucun')
     
     # Retourner une réponse JSON pour les requêtes AJAX
     if request.headers.get('Content-Type') == 'application/json' or 'application/json' in request.headers.get('Accept', ''):
@@ -94,12 +123,6 @@ def method_not_allowed(e):
     flash("Méthode HTTP non autorisée pour cette route", 'error')
     return render_template('index.html'), 405
 
-@app.errorhandler(413)
-def too_large(e):
-    logger.error(f"Fichier trop volumineux: {request.url}")
-    flash("Le fichier est trop volumineux (max 16MB)", 'error')
-    return render_template('index.html'), 413
-
 # Configuration des dossiers
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'output'
@@ -114,189 +137,634 @@ def allowed_file(filename):
     """Vérifie si l'extension du fichier est autorisée"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Détection d'encodage: taille de l'échantillon passé au détecteur statistique,
+# taille des blocs de validation et nombre de fichiers gardés en cache
+ENCODING_SAMPLE_SIZE = 64 * 1024
+ENCODING_CHUNK_SIZE = 1024 * 1024
+ENCODING_CACHE_SIZE = 128
+
+# Encodage détecté par empreinte du contenu (blake2b), du plus ancien au plus récent.
+# Les caches sont partagés par les fils de chargement en parallèle: accès sous verrou
+_encoding_cache = OrderedDict()
+_encoding_cache_lock = threading.Lock()
+
+# Empreintes calculées à la réception des fichiers: (chemin, taille, date de modification) -> empreinte
+_file_hash_cache = OrderedDict()
+_file_hash_cache_lock = threading.Lock()
+
+# Détecteur optionnel plus rapide (faust-cchardet, même API que chardet)
+try:
+    import cchardet as fast_chardet
+except ImportError:
+    fast_chardet = None
+
+def file_content_hash(data):
+    """Empreinte blake2b du contenu d'un fichier (bytes ou mmap), calculée par blocs"""
+    hasher = hashlib.blake2b(digest_size=16)
+    view = memoryview(data)
+    for offset in range(0, len(view), ENCODING_CHUNK_SIZE):
+        hasher.update(view[offset:offset + ENCODING_CHUNK_SIZE])
+    return hasher.hexdigest()
+
+def known_file_hash(file_path):
+    """Empreinte déjà calculée à la réception du fichier (None si inconnue ou fichier modifié)"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    with _file_hash_cache_lock:
+        return _file_hash_cache.get((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns))
+
+def remember_file_digest(file_path, content_hash, encoding=None):
+    """
+    Enregistre l'empreinte d'un fichier calculée pendant sa réception (UploadSpool) et,
+    si elle est connue, son encodage: hash_file et detect_encoding ne relisent pas le fichier
+    """
+    stat = os.stat(file_path)
+    with _file_hash_cache_lock:
+        _file_hash_cache[(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)] = content_hash
+        if len(_file_hash_cache) > ENCODING_CACHE_SIZE:
+            _file_hash_cache.popitem(last=False)
+    if encoding:
+        with _encoding_cache_lock:
+            if content_hash not in _encoding_cache:
+                _encoding_cache[content_hash] = encoding
+                if len(_encoding_cache) > ENCODING_CACHE_SIZE:
+                    _encoding_cache.popitem(last=False)
+
+def hash_file(file_path):
+    """Empreinte du contenu d'un fichier sur disque (lu via mmap, sans copie en mémoire)"""
+    content_hash = known_file_hash(file_path)
+    if content_hash is not None:
+        return content_hash
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return file_content_hash(b'')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return file_content_hash(data)
+
+def decodes_entirely(data, encoding):
+    """Vérifie, par blocs et sans copier le fichier, que tout le contenu se décode strictement"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='strict')
+    view = memoryview(data)
+    try:
+        for offset in range(0, len(view), ENCODING_CHUNK_SIZE):
+            decoder.decode(view[offset:offset + ENCODING_CHUNK_SIZE])
+        decoder.decode(b'', final=True)
+        return True
+    except (UnicodeDecodeError, UnicodeError, LookupError):
+        return False
+
+def guess_encoding(data):
+    """
+    Détermine l'encodage d'un contenu en un seul passage de validation:
+    1. BOM (UTF-8 / UTF-16)
+    2. validation UTF-8 stricte de tout le contenu
+    3. détecteur statistique (cchardet si installé, sinon chardet) sur un échantillon borné,
+       retenu seulement s'il décode tout le fichier, puis windows-1252 et latin-1 en secours
+    """
+    if data[:3] == codecs.BOM_UTF8:
+        return 'utf-8-sig'
+    if data[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return 'utf-16'
+
+    if decodes_entirely(data, 'utf-8'):
+        return 'utf-8'
+
+    detector = fast_chardet or chardet
+    result = detector.detect(bytes(data[:ENCODING_SAMPLE_SIZE]))
+    encoding = result.get('encoding')
+    confidence = result.get('confidence') or 0.0
+    logger.info("Encodage détecté sur l'échantillon: %s (confiance: %.2f)", encoding, confidence)
+
+    candidates = []
+    if encoding and confidence >= 0.7:
+        candidates.append(encoding.lower())
+    candidates.append('windows-1252')
+    for candidate in candidates:
+        if decodes_entirely(data, candidate):
+            return candidate
+
+    # latin-1 peut lire n'importe quel octet
+    return 'latin-1'
+
+def cached_encoding(content_hash):
+    """Encodage déjà connu pour cette empreinte (marqué comme récent), sinon None"""
+    with _encoding_cache_lock:
+        if content_hash in _encoding_cache:
+            _encoding_cache.move_to_end(content_hash)
+            return _encoding_cache[content_hash]
+    return None
+
 def detect_encoding(file_path):
-    """Détecte automatiquement l'encodage d'un fichier"""
+    """
+    Détecte automatiquement l'encodage d'un fichier.
+    Le fichier est lu via une vue mmap (pas de copie en mémoire) et le résultat est mis en
+    cache par empreinte du contenu: un même fichier re-téléversé n'est pas ré-analysé.
+    L'encodage renvoyé décode tout le fichier, qui peut donc être parsé en une seule fois.
+    """
     try:
-        # Lire les premiers bytes du fichier pour détecter l'encodage
+        # Fichier reçu par UploadSpool: empreinte (et souvent encodage) déjà connue
+        content_hash = known_file_hash(file_path)
+        encoding = cached_encoding(content_hash)
+        if encoding:
+            logger.debug("Encodage connu dès la réception pour %s: %s", file_path, encoding)
+            return encoding
+
         with open(file_path, 'rb') as f:
-            raw_data = f.read(10000)  # Lire les premiers 10KB
-        
-        # Utiliser chardet pour détecter l'encodage
-        result = chardet.detect(raw_data)
-        encoding = result['encoding']
-        confidence = result['confidence']
-        
-        print(f"Encodage détecté pour {file_path}: {encoding} (confiance: {confidence:.2f})")
-        
-        # Liste des encodages fallback en ordre de préférence
-        fallback_encodings = ['utf-8', 'utf-8-sig', 'windows-1252', 'iso-8859-1', 'cp1252', 'latin-1']
-        
-        # Si la confiance est faible ou l'encodage n'est pas détecté, essayer les fallbacks
-        if not encoding or confidence < 0.7:
-            print(f"Confiance faible ({confidence:.2f}), essai des encodages fallback...")
-            for fallback in fallback_encodings:
-                try:
-                    with open(file_path, 'r', encoding=fallback) as f:
-                        f.read(1000)  # Essayer de lire le début du fichier
-                    print(f"Encodage fallback réussi: {fallback}")
-                    return fallback
-                except (UnicodeDecodeError, UnicodeError):
-                    continue
-            
-            # Si tous les fallbacks échouent, utiliser latin-1 (qui peut lire n'importe quoi)
-            print("Tous les encodages ont échoué, utilisation de latin-1")
-            return 'latin-1'
-        
+            if os.fstat(f.fileno()).st_size == 0:
+                return 'utf-8'
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                content_hash = content_hash or file_content_hash(data)
+                encoding = cached_encoding(content_hash)
+                if encoding:
+                    logger.debug("Encodage en cache pour %s: %s", file_path, encoding)
+                    return encoding
+
+                encoding = guess_encoding(data)
+
+        with _encoding_cache_lock:
+            _encoding_cache[content_hash] = encoding
+            if len(_encoding_cache) > ENCODING_CACHE_SIZE:
+                _encoding_cache.popitem(last=False)
+        logger.info("Encodage détecté pour %s: %s", file_path, encoding)
         return encoding
-        
-    except Exception as e:
-        print(f"Erreur lors de la détection d'encodage: {e}")
-        # En cas d'erreur, essayer les encodages les plus courants
-        for encoding in ['utf-8', 'windows-1252', 'iso-8859-1', 'latin-1']:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    f.read(1000)
-                print(f"Encodage de secours utilisé: {encoding}")
-                return encoding
-            except (UnicodeDecodeError, UnicodeError):
-                continue
-        
-        # Dernier recours
+
+    except (OSError, ValueError) as e:
+        logger.error("Erreur lors de la détection d'encodage: %s", e)
+        # latin-1 peut lire n'importe quel fichier
         return 'latin-1'
 
-def safe_read_csv(file_path, separator=','):
-    """Lit un fichier CSV avec détection automatique de l'encodage"""
-    encoding = detect_encoding(file_path)
-    
-    # Essayer de lire le fichier avec l'encodage détecté
-    try:
-        df = pd.read_csv(file_path, sep=separator, encoding=encoding)
-        print(f"Fichier lu avec succès avec l'encodage {encoding}")
-        return df
-    except (UnicodeDecodeError, UnicodeError) as e:
-        print(f"Erreur avec l'encodage {encoding}: {e}")
-        
-        # Essayer d'autres encodages en cas d'échec
-        fallback_encodings = ['utf-8', 'utf-8-sig', 'windows-1252', 'iso-8859-1', 'cp1252', 'latin-1']
-        
-        for fallback in fallback_encodings:
-            if fallback == encoding:  # Skip l’encodage déjà essayé
-                continue
+def safe_read_csv(file_path, separator=',', encoding=None, **read_options):
+    """
+    Lit un fichier CSV avec détection automatique de l'encodage.
+    detect_encoding valide l'encodage sur tout le fichier: le CSV est parsé une seule fois.
+    read_options: options supplémentaires de pd.read_csv (usecols, dtype, engine...)
+    """
+    encoding = encoding or detect_encoding(file_path)
+    df = pd.read_csv(file_path, sep=separator, encoding=encoding, **read_options)
+    logger.info("Fichier lu avec succès avec l'encodage %s", encoding)
+    return df
+
+# Fichiers envoyés: taille gardée en mémoire pendant la réception, au-delà de laquelle
+# le contenu est écrit directement dans uploads/
+UPLOAD_SPOOL_MAX_BYTES = int(os.environ.get('UPLOAD_SPOOL_MAX_MB', 8)) * 1024 * 1024
+
+class ContentDigest:
+    """
+    Empreinte blake2b (identique à hash_file) et validation UTF-8 stricte d'un contenu reçu
+    par blocs successifs. L'encodage est déduit des premiers octets (BOM) ou de cette validation;
+    sha256 en plus sur demande (contrôle d'intégrité des envois par morceaux).
+    """
+
+    def __init__(self, sha256=False):
+        self.size = 0
+        self.head = b''
+        self.hasher = hashlib.blake2b(digest_size=16)
+        self.sha256 = hashlib.sha256() if sha256 else None
+        self.utf8_decoder = codecs.getincrementaldecoder('utf-8')(errors='strict')
+        self.utf8_valid = True
+
+    def update(self, data):
+        if len(self.head) < 4:
+            self.head += bytes(data[:4 - len(self.head)])
+        self.hasher.update(data)
+        if self.sha256 is not None:
+            self.sha256.update(data)
+        if self.utf8_valid:
             try:
-                df = pd.read_csv(file_path, sep=separator, encoding=fallback)
-                print(f"Fichier lu avec succès avec l'encodage fallback {fallback}")
-                return df
-            except (UnicodeDecodeError, UnicodeError):
-                continue
-        
-        # Si tout échoue, lever l'erreur originale
-        raise e
+                self.utf8_decoder.decode(data)
+            except UnicodeDecodeError:
+                self.utf8_valid = False
+        self.size += len(data)
+
+    def content_hash(self):
+        return self.hasher.hexdigest()
+
+    def sniffed_encoding(self):
+        """Encodage déterminé pendant la lecture (BOM ou UTF-8 valide), sinon None"""
+        if self.head[:3] == codecs.BOM_UTF8:
+            return 'utf-8-sig'
+        if self.head[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+            return 'utf-16'
+        if self.utf8_valid:
+            try:
+                self.utf8_decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                self.utf8_valid = False
+        return 'utf-8' if self.utf8_valid else None
+
+class UploadSpool:
+    """
+    Réception d'un fichier envoyé, alimentée par le parseur multipart de Werkzeug:
+    le contenu reste en mémoire jusqu'à UPLOAD_SPOOL_MAX_BYTES, puis est écrit au fil de l'eau
+    dans uploads/ sous un nom unique. L'empreinte et l'encodage (ContentDigest) sont calculés
+    pendant la réception: le fichier n'est pas relu pour le cache des résultats ni pour
+    detect_encoding.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = UPLOAD_SPOOL_MAX_BYTES if max_size is None else max_size
+        self.file = io.BytesIO()
+        self.path = None
+        self.digest = ContentDigest()
+
+    def write(self, data):
+        self.digest.update(data)
+        if self.path is None and self.digest.size > self.max_size:
+            self._rollover()
+        return self.file.write(data)
+
+    def _rollover(self):
+        """Passage sur disque: le contenu déjà reçu est écrit dans uploads/, la suite y est ajoutée"""
+        fd, path = tempfile.mkstemp(prefix='upload_', suffix='.part', dir=UPLOAD_FOLDER)
+        disk_file = os.fdopen(fd, 'w+b')
+        disk_file.write(self.file.getbuffer())
+        self.file = disk_file
+        self.path = path
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell... du fichier en mémoire ou sur disque
+        return getattr(self.file, name)
+
+    def save_to(self, target_path):
+        """
+        Place le fichier reçu à target_path: simple renommage s'il est déjà sur disque, sinon
+        une seule écriture. Renvoie (empreinte, encodage ou None), à transmettre au traitement.
+        """
+        if self.path is not None:
+            self.file.close()
+            os.replace(self.path, target_path)
+            self.path = None
+        else:
+            with open(target_path, 'wb') as f:
+                f.write(self.file.getbuffer())
+        content_hash, encoding = self.digest.content_hash(), self.digest.sniffed_encoding()
+        remember_file_digest(target_path, content_hash, encoding)
+        return content_hash, encoding
+
+    def close(self):
+        self.file.close()
+        # Fichier reçu mais non utilisé (requête refusée): supprimé de uploads/
+        if self.path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(self.path)
+            self.path = None
+
+class UploadRequest(Request):
+    """Requête Flask dont les fichiers envoyés sont reçus dans un UploadSpool"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool()
+
+app.request_class = UploadRequest
+
+# Envoi par morceaux des fichiers plus gros que MAX_CONTENT_LENGTH, reprenable après une coupure:
+# taille des morceaux (bornée par MAX_CONTENT_LENGTH), dossier des envois en cours et
+# durée de conservation des envois abandonnés
+UPLOAD_CHUNK_BYTES = min(int(os.environ.get('UPLOAD_CHUNK_MB', 8)) * 1024 * 1024, MAX_CONTENT_LENGTH)
+CHUNKED_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'chunked')
+CHUNKED_UPLOAD_EXPIRY_SECONDS = int(os.environ.get('CHUNKED_UPLOAD_EXPIRY_HOURS', 24)) * 3600
+# Taille maximale d'un fichier envoyé par morceaux
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_MB', 2048)) * 1024 * 1024
+
+# Fichiers du formulaire acceptés par l'envoi par morceaux, avec leurs extensions autorisées
+CHUNKED_UPLOAD_EXTENSIONS = {
+    'orders_file': {'csv'},
+    'transactions_file': {'csv'},
+    'journal_file': {'csv'},
+    'old_file': {'csv', 'xlsx'},
+}
+
+class ChunkedUploadStore:
+    """
+    Envois de fichiers par morceaux (init, PUT de chaque morceau, fin), reprenables.
+    Chaque envoi a un manifeste JSON (nom, taille, sha256 attendu, sha256 des morceaux reçus)
+    et un fichier .part où chaque morceau est écrit à sa position: un morceau peut être renvoyé
+    sans effet, et après une coupure le client relit l'état de l'envoi pour n'envoyer que les
+    morceaux manquants. À la fin, le fichier assemblé est vérifié (taille, sha256) en un seul
+    passage qui calcule aussi son empreinte et son encodage (ContentDigest), puis placé dans uploads/.
+    """
+
+    def __init__(self, folder, chunk_size, expiry_seconds):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.expiry_seconds = expiry_seconds
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _manifest_path(self, upload_id):
+        return os.path.join(self.folder, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.folder, f"{upload_id}.part")
+
+    def _save(self, manifest):
+        manifest['updated_at'] = time.time()
+        path = self._manifest_path(manifest['id'])
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, path)
+
+    def get(self, upload_id):
+        """Manifeste d'un envoi, ou None (identifiant inconnu ou invalide)"""
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+            return None
+        try:
+            with open(self._manifest_path(upload_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, upload_id, **changes):
+        """Met à jour le manifeste d'un envoi; renvoie le manifeste, ou None s'il n'existe plus"""
+        with self.lock:
+            manifest = self.get(upload_id)
+            if manifest is None:
+                return None
+            manifest.update(changes)
+            self._save(manifest)
+            return manifest
+
+    def create(self, file_key, filename, size, sha256=None):
+        """Nouvel envoi: fichier .part de la taille finale et manifeste sans morceau reçu"""
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        manifest = {
+            'id': upload_id,
+            'file_key': file_key,
+            'filename': secure_filename(filename) or 'fichier',
+            'size': size,
+            'sha256': sha256.lower() if sha256 else None,
+            'chunk_size': self.chunk_size,
+            'chunk_count': max(1, -(-size // self.chunk_size)),
+            'chunks': {},
+            'status': 'uploading',
+            'created_at': time.time(),
+        }
+        part_path = self._part_path(upload_id)
+        try:
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+            with self.lock:
+                self._save(manifest)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(part_path)
+            raise
+        return manifest
+
+    def write_chunk(self, upload_id, index, data, sha256=None):
+        """
+        Écrit un morceau à sa position et l'enregistre dans le manifeste.
+        Lève ValueError si le morceau est refusé (envoi terminé, index hors limites,
+        taille ou sha256 incorrects); renvoie None si l'envoi n'existe pas.
+        """
+        manifest = self.get(upload_id)
+        if manifest is None:
+            return None
+        if manifest['status'] != 'uploading':
+            raise ValueError("Cet envoi est déjà terminé.")
+        if not 0 <= index < manifest['chunk_count']:
+            raise ValueError(f"Morceau {index} hors limites (0 à {manifest['chunk_count'] - 1}).")
+        expected_length = min(manifest['chunk_size'], manifest['size'] - index * manifest['chunk_size'])
+        if len(data) != expected_length:
+            raise ValueError(f"Morceau {index}: {len(data)} octets reçus, {expected_length} attendus.")
+        chunk_sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 and sha256.lower() != chunk_sha256:
+            raise ValueError(f"Morceau {index}: empreinte sha256 incorrecte, renvoyez-le.")
+
+        # Morceaux d'un même envoi écrits en parallèle: chacun à sa position, sans recouvrement
+        with open(self._part_path(upload_id), 'r+b') as f:
+            f.seek(index * manifest['chunk_size'])
+            f.write(data)
+
+        with self.lock:
+            manifest = self.get(upload_id)
+            if manifest is None:
+                return None
+            manifest['chunks'][str(index)] = chunk_sha256
+            self._save(manifest)
+        return manifest
+
+    def complete(self, upload_id):
+        """
+        Termine un envoi: vérifie que tous les morceaux sont reçus puis le fichier assemblé
+        (taille, sha256 attendu), et le place dans uploads/. Lève ValueError si l'envoi est
+        incomplet ou corrompu; renvoie None si l'envoi n'existe pas.
+        """
+        with self.lock:
+            manifest = self.get(upload_id)
+            if manifest is None or manifest['status'] == 'complete':
+                return manifest
+            if manifest['status'] != 'uploading':
+                raise ValueError("Cet envoi est déjà en cours de vérification.")
+            missing = [index for index in range(manifest['chunk_count']) if str(index) not in manifest['chunks']]
+            if missing:
+                raise ValueError(f"{len(missing)} morceau(x) manquant(s), à partir du morceau {missing[0]}.")
+            manifest['status'] = 'assembling'
+            self._save(manifest)
+
+        # Vérification hors du verrou: les autres envois continuent pendant la relecture
+        part_path = self._part_path(upload_id)
+        digest = ContentDigest(sha256=True)
+        try:
+            with open(part_path, 'rb') as f:
+                for block in iter(functools.partial(f.read, ENCODING_CHUNK_SIZE), b''):
+                    digest.update(block)
+        except OSError:
+            self.update(upload_id, status='uploading')
+            raise
+        file_sha256 = digest.sha256.hexdigest()
+        if digest.size != manifest['size'] or (manifest['sha256'] and manifest['sha256'] != file_sha256):
+            # Fichier corrompu: tous les morceaux sont à renvoyer
+            self.update(upload_id, status='uploading', chunks={})
+            raise ValueError("Le fichier assemblé ne correspond pas à l'empreinte sha256 attendue.")
+
+        path = os.path.join(UPLOAD_FOLDER, f"{upload_id}_{manifest['filename']}")
+        os.replace(part_path, path)
+        content_hash, encoding = digest.content_hash(), digest.sniffed_encoding()
+        remember_file_digest(path, content_hash, encoding)
+        logger.info("Envoi %s terminé: %s (%s octets)", upload_id, manifest['filename'], digest.size)
+        return self.update(upload_id, status='complete', path=path, sha256=file_sha256,
+                           content_hash=content_hash, encoding=encoding)
+
+    def purge_expired(self):
+        """Supprime les envois (manifeste et fichier .part) inactifs depuis expiry_seconds"""
+        limit = time.time() - self.expiry_seconds
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.stat().st_mtime < limit:
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+
+chunked_uploads = ChunkedUploadStore(CHUNKED_UPLOAD_FOLDER, UPLOAD_CHUNK_BYTES, CHUNKED_UPLOAD_EXPIRY_SECONDS)
+
+# Variantes reconnues pour chaque nom de colonne standardisé, par ordre de priorité
+COLUMN_VARIANTS = {
+    # Fichier des commandes
+    'Name': ['Name', 'name', 'ORDER', 'Order', 'order', 'Nom', 'nom', 'Commande', 'commande', 'Id', 'ID', 'id', '#', 'Order ID', 'Order Id'],
+    'Fulfilled at': ['Fulfilled at', 'fulfilled at', 'Date', 'date', 'Date commande', 'Date_commande'],
+    'Billing name': ['Billing name', 'billing name', 'Client', 'client', 'Nom client', 'Nom_client', 'Billing Name', 'billing Name'],
+    'Financial Status': ['Financial Status', 'financial status', 'Status', 'status', 'Statut', 'statut'],
+    'Tax 1 Value': ['Tax 1 Value', 'tax 1 value', 'TVA', 'tva', 'Tax', 'tax', 'Taxe'],
+    'Outstanding Balance': ['Outstanding Balance', 'outstanding balance', 'Balance', 'balance', 'Solde', 'solde'],
+    'Payment Method': ['Payment Method', 'payment method', 'Method', 'method', 'Méthode', 'méthode'],
+    # IMPORTANT: Colonnes pour le nouveau calcul HT/TVA/TTC
+    'Total': ['Total', 'total'],  # TTC - UNIQUEMENT la vraie colonne Total !
+    'Taxes': ['Taxes', 'taxes'],  # TVA - UNIQUEMENT la vraie colonne Taxes !
+
+    # Fichier des transactions
+    'Order': ['Order', 'order', 'Name', 'name', 'Commande', 'commande', 'Id', 'ID', 'id', 'Order ID', 'Order Id'],
+    'Presentment Amount': ['Presentment Amount', 'presentment amount', 'Amount', 'amount', 'Montant', 'montant'],
+    'Fee': ['Fee', 'fee', 'Frais', 'frais', 'Commission', 'commission'],
+    'Net': ['Net', 'net', 'Net Amount', 'net amount', 'Montant net', 'montant net'],
+    'Payment Method Name': ['Payment Method Name', 'payment method name'],
+    # Fichier journal
+    'Piece': ['Piece', 'piece', 'Pièce', 'pièce', 'Reference', 'reference', 'Ref', 'ref', 'Order', 'order', 'Commande', 'Id', 'ID', 'id', 'Référence externe', 'référence externe', 'Reference externe', 'reference externe', 'Externe', 'externe'],
+    'Référence LMB': ['Référence LMB', 'référence lmb', 'Reference LMB', 'reference lmb', 'LMB', 'lmb', 'Ref LMB', 'ref lmb']
+}
+
+# Mots-clés de la correspondance approximative (colonnes sans variante exacte dans le fichier)
+COLUMN_KEYWORDS = {
+    'Name': ['id', 'order', 'commande', 'numero', 'number'],
+    'Fulfilled at': ['date', 'created', 'fulfill', 'livr'],
+    'Billing name': ['billing', 'client', 'nom', 'name'],
+    'Financial Status': ['status', 'statut', 'financial', 'etat'],
+    'Tax 1 Value': ['tax', 'tva', 'taxe', 'impot'],
+    'Outstanding Balance': ['balance', 'solde', 'outstanding', 'restant'],
+    'Payment Method': ['payment', 'method', 'paiement', 'methode'],
+    'Order': ['order', 'id', 'commande', 'numero', 'name'],
+    'Presentment Amount': ['amount', 'montant', 'presentment'],
+    'Fee': ['fee', 'frais', 'commission'],
+    'Net': ['net', 'montant', 'amount'],
+    # IMPORTANT: Pas de mapping approximatif pour Total et Taxes !
+    # 'Total': sera géré par mapping exact uniquement
+    # 'Taxes': sera géré par mapping exact uniquement
+    'Piece': ['piece', 'reference', 'ref', 'order', 'id', 'commande', 'externe', 'external'],
+    'Référence LMB': ['lmb', 'reference', 'ref']
+}
+
+def build_column_variant_lookup(column_variants):
+    """Table inverse {variante: ((nom standardisé, priorité), ...)} construite une fois à l'import"""
+    lookup = {}
+    for expected_col, variants in column_variants.items():
+        for rank, variant in enumerate(variants):
+            lookup.setdefault(variant, []).append((expected_col, rank))
+    return {variant: tuple(targets) for variant, targets in lookup.items()}
+
+COLUMN_VARIANT_LOOKUP = build_column_variant_lookup(COLUMN_VARIANTS)
+
+# Correspondances déjà résolues par empreinte d'en-tête (noms de colonnes, colonnes attendues),
+# de la plus ancienne à la plus récente
+COLUMN_MAPPING_CACHE_SIZE = 64
+_column_mapping_cache = OrderedDict()
+_column_mapping_cache_lock = threading.Lock()
+
+def match_column_variants(columns, expected_columns):
+    """
+    Correspondance exacte en un passage sur l'en-tête: pour chaque colonne attendue,
+    la variante présente de meilleure priorité. Renvoie (correspondance, colonnes manquantes).
+    """
+    expected = set(expected_columns)
+    best = {}
+    for col in columns:
+        for expected_col, rank in COLUMN_VARIANT_LOOKUP.get(col, ()):
+            if expected_col in expected and (expected_col not in best or rank < best[expected_col][0]):
+                best[expected_col] = (rank, col)
 
-def normalize_column_names(df, expected_columns, file_type=""):
-    """Normalise les noms de colonnes en cherchant des correspondances approximatives"""
-    print(f"Colonnes disponibles dans {file_type}: {list(df.columns)}")    # Dictionnaire de mapping pour les variantes de noms de colonnes
-    column_mappings = {
-        # Fichier des commandes
-        'Name': ['Name', 'name', 'ORDER', 'Order', 'order', 'Nom', 'nom', 'Commande', 'commande', 'Id', 'ID', 'id', '#', 'Order ID', 'Order Id'],
-        'Fulfilled at': ['Fulfilled at', 'fulfilled at', 'Date', 'date', 'Date commande', 'Date_commande'],
-        'Billing name': ['Billing name', 'billing name', 'Client', 'client', 'Nom client', 'Nom_client', 'Billing Name', 'billing Name'],
-        'Financial Status': ['Financial Status', 'financial status', 'Status', 'status', 'Statut', 'statut'],
-        'Tax 1 Value': ['Tax 1 Value', 'tax 1 value', 'TVA', 'tva', 'Tax', 'tax', 'Taxe'],
-        'Outstanding Balance': ['Outstanding Balance', 'outstanding balance', 'Balance', 'balance', 'Solde', 'solde'],
-        'Payment Method': ['Payment Method', 'payment method', 'Method', 'method', 'Méthode', 'méthode'],
-        # IMPORTANT: Colonnes pour le nouveau calcul HT/TVA/TTC
-        'Total': ['Total', 'total'],  # TTC - UNIQUEMENT la vraie colonne Total !
-        'Taxes': ['Taxes', 'taxes'],  # TVA - UNIQUEMENT la vraie colonne Taxes !
-        
-        # Fichier des transactions
-        'Order': ['Order', 'order', 'Name', 'name', 'Commande', 'commande', 'Id', 'ID', 'id', 'Order ID', 'Order Id'],
-        'Presentment Amount': ['Presentment Amount', 'presentment amount', 'Amount', 'amount', 'Montant', 'montant'],
-        'Fee': ['Fee', 'fee', 'Frais', 'frais', 'Commission', 'commission'],
-        'Net': ['Net', 'net', 'Net Amount', 'net amount', 'Montant net', 'montant net'],
-          # Fichier journal
-        'Piece': ['Piece', 'piece', 'Pièce', 'pièce', 'Reference', 'reference', 'Ref', 'ref', 'Order', 'order', 'Commande', 'Id', 'ID', 'id', 'Référence externe', 'référence externe', 'Reference externe', 'reference externe', 'Externe', 'externe'],
-        'Référence LMB': ['Référence LMB', 'référence lmb', 'Reference LMB', 'reference lmb', 'LMB', 'lmb', 'Ref LMB', 'ref lmb']
-    }
-    
-    # Créer un mapping des colonnes actuelles vers les noms standardisés
     column_mapping = {}
     missing_columns = []
-    
     for expected_col in expected_columns:
-        found = False
-        if expected_col in column_mappings:
-            for variant in column_mappings[expected_col]:
-                if variant in df.columns:
-                    column_mapping[variant] = expected_col
-                    print(f"✓ Colonne trouvée: '{variant}' -> '{expected_col}'")
-                    found = True
-                    break
-        
-        if not found:
+        if expected_col in best:
+            column_mapping[best[expected_col][1]] = expected_col
+        else:
             missing_columns.append(expected_col)
-      # Afficher les colonnes manquantes
-    if missing_columns:
-        print(f"⚠️ Colonnes manquantes dans {file_type}: {missing_columns}")
-        print("Colonnes disponibles:", list(df.columns))
-        
-        # Essayer une correspondance approximative pour les colonnes manquantes
-        for missing_col in missing_columns:
-            found_match = False
-            
-            # Vérification exacte des mots-clés
-            keywords_mapping = {
-                'Name': ['id', 'order', 'commande', 'numero', 'number'],
-                'Fulfilled at': ['date', 'created', 'fulfill', 'livr'],
-                'Billing name': ['billing', 'client', 'nom', 'name'],
-                'Financial Status': ['status', 'statut', 'financial', 'etat'],
-                'Tax 1 Value': ['tax', 'tva', 'taxe', 'impot'],                'Outstanding Balance': ['balance', 'solde', 'outstanding', 'restant'],
-                'Payment Method': ['payment', 'method', 'paiement', 'methode'],
-                'Order': ['order', 'id', 'commande', 'numero', 'name'],
-                'Presentment Amount': ['amount', 'montant', 'presentment'],
-                'Fee': ['fee', 'frais', 'commission'],
-                'Net': ['net', 'montant', 'amount'],
-                # IMPORTANT: Pas de mapping approximatif pour Total et Taxes !
-                # 'Total': sera géré par mapping exact uniquement
-                # 'Taxes': sera géré par mapping exact uniquement
-                'Piece': ['piece', 'reference', 'ref', 'order', 'id', 'commande', 'externe', 'external'],
-                'Référence LMB': ['lmb', 'reference', 'ref']
-            }
-            
-            if missing_col in keywords_mapping:
-                keywords = keywords_mapping[missing_col]
-                for col in df.columns:
-                    col_lower = col.lower()
-                    # Vérifier si un des mots-clés est dans le nom de la colonne
-                    if any(keyword in col_lower for keyword in keywords):
-                        print(f"🔍 Correspondance trouvée: '{col}' pour '{missing_col}' (mot-clé détecté)")
-                        column_mapping[col] = missing_col
-                        found_match = True
-                        break
-              # Si toujours pas trouvé, essayer une correspondance plus flexible
-            if not found_match:
-                for col in df.columns:
-                    # PROTECTION: Empêcher que "Subtotal" soit mappé vers "Total"
-                    if missing_col == 'Total' and 'subtotal' in col.lower():
-                        print(f"❌ REJETÉ: '{col}' ne peut pas être mappé vers 'Total' (doit être la vraie colonne Total)")
-                        continue
-                    
-                    # PROTECTION: Empêcher que d'autres colonnes soient mappées vers "Taxes"
-                    if missing_col == 'Taxes' and col.lower() not in ['taxes', 'tax']:
-                        continue
-                    
-                    # Vérification de similarité (contient une partie du nom)
-                    if any(part.lower() in col.lower() for part in missing_col.lower().split() if len(part) > 2):
-                        print(f"🔍 Correspondance approximative: '{col}' pour '{missing_col}'")
-                        # Demander confirmation via un message de debug
-                        print(f"   -> Voulez-vous utiliser '{col}' pour '{missing_col}' ? (automatiquement accepté)")
-                        column_mapping[col] = missing_col
-                        found_match = True
-                        break
-    
+    return column_mapping, missing_columns
+
+def match_columns_approximately(columns, missing_columns, column_mapping, sources):
+    """Correspondance approximative (mots-clés puis parties du nom) des colonnes manquantes"""
+    for missing_col in missing_columns:
+        found_match = False
+
+        # Vérification exacte des mots-clés
+        if missing_col in COLUMN_KEYWORDS:
+            keywords = COLUMN_KEYWORDS[missing_col]
+            for col in columns:
+                col_lower = col.lower()
+                # Vérifier si un des mots-clés est dans le nom de la colonne
+                if any(keyword in col_lower for keyword in keywords):
+                    logger.debug("🔍 Correspondance trouvée: '%s' pour '%s' (mot-clé détecté)", col, missing_col)
+                    column_mapping[col] = missing_col
+                    sources[col] = 'mot-clé'
+                    found_match = True
+                    break
+
+        # Si toujours pas trouvé, essayer une correspondance plus flexible
+        if not found_match:
+            for col in columns:
+                # PROTECTION: Empêcher que "Subtotal" soit mappé vers "Total"
+                if missing_col == 'Total' and 'subtotal' in col.lower():
+                    logger.debug("❌ REJETÉ: '%s' ne peut pas être mappé vers 'Total' (doit être la vraie colonne Total)", col)
+                    continue
+
+                # PROTECTION: Empêcher que d'autres colonnes soient mappées vers "Taxes"
+                if missing_col == 'Taxes' and col.lower() not in ['taxes', 'tax']:
+                    continue
+
+                # Vérification de similarité (contient une partie du nom)
+                if any(part.lower() in col.lower() for part in missing_col.lower().split() if len(part) > 2):
+                    logger.debug("🔍 Correspondance approximative: '%s' pour '%s' (automatiquement acceptée)", col, missing_col)
+                    column_mapping[col] = missing_col
+                    sources[col] = 'approximative'
+                    found_match = True
+                    break
+
+def resolve_column_mapping(columns, expected_columns, file_type=""):
+    """
+    Calcule la correspondance {colonne du fichier: nom standardisé} à partir des seuls
+    noms de colonnes (en-tête), sans lire les données.
+    Le résultat est mis en cache par empreinte de l'en-tête: une mise en page déjà vue
+    (export Shopify/LMB habituel) est résolue sans nouvelle recherche, approximative comprise.
+    La correspondance retenue est tracée à chaque appel (audit).
+    """
+    fingerprint = (tuple(columns), tuple(expected_columns))
+    with _column_mapping_cache_lock:
+        cached = _column_mapping_cache.get(fingerprint)
+        if cached is not None:
+            _column_mapping_cache.move_to_end(fingerprint)
+    if cached is not None:
+        column_mapping, sources = cached
+        logger.debug("En-tête déjà résolu pour %s", file_type)
+    else:
+        logger.debug("Colonnes disponibles dans %s: %s", file_type, list(columns))
+        column_mapping, missing_columns = match_column_variants(columns, expected_columns)
+        sources = dict.fromkeys(column_mapping, 'exacte')
+
+        if missing_columns:
+            logger.warning("⚠️ Colonnes manquantes dans %s: %s", file_type, missing_columns)
+            logger.info("Colonnes disponibles: %s", list(columns))
+            match_columns_approximately(columns, missing_columns, column_mapping, sources)
+
+        # Fichiers chargés en parallèle: la recherche se fait hors du verrou, seul le cache est protégé
+        with _column_mapping_cache_lock:
+            _column_mapping_cache[fingerprint] = (column_mapping, sources)
+            if len(_column_mapping_cache) > COLUMN_MAPPING_CACHE_SIZE:
+                _column_mapping_cache.popitem(last=False)
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Correspondance des colonnes (%s): %s", file_type,
+                    ', '.join(f"'{col}' -> '{target}' ({sources[col]})" for col, target in column_mapping.items()))
+    return dict(column_mapping)
+
+def normalize_column_names(df, expected_columns, file_type=""):
+    """Normalise les noms de colonnes en cherchant des correspondances approximatives"""
+    column_mapping = resolve_column_mapping(df.columns, expected_columns, file_type)
+
     # Renommer les colonnes
     if column_mapping:
         df = df.rename(columns=column_mapping)
-        print(f"✓ Colonnes renommées: {column_mapping}")
+        logger.debug("✓ Colonnes renommées: %s", column_mapping)
     
     return df
 
@@ -315,7 +783,7 @@ def validate_required_columns(df, required_columns, file_type=""):
         """
         raise ValueError(error_msg)
     
-    print(f"✓ Toutes les colonnes requises sont présentes dans {file_type}")
+    logger.info("✓ Toutes les colonnes requises sont présentes dans %s", file_type)
     return True
 
 def clean_text_data(df, text_columns):
@@ -326,7 +794,10 @@ def clean_text_data(df, text_columns):
     return df
 
 def format_date_to_french(date_str):
-    """Convertit une date en format français jj/mm/aaaa"""
+    """
+    Convertit une date en format français jj/mm/aaaa (une valeur à la fois).
+    Conservée comme référence de format_dates_to_french, utilisée sur les colonnes entières.
+    """
     try:
         if pd.isna(date_str) or str(date_str).lower() in ['nan', 'none', '']:
             return ''
@@ -356,9 +827,76 @@ def format_date_to_french(date_str):
             return str(date_str)
             
     except Exception as e:
-        print(f"Erreur lors du formatage de la date '{date_str}': {e}")
+        logger.debug("Erreur lors du formatage de la date '%s': %s", date_str, e)
         return str(date_str) if date_str else ''
 
+# Formats de date d'entrée, par ordre de priorité (voir format_date_to_french)
+DATE_INPUT_FORMATS = [
+    '%Y-%m-%d',           # 2024-12-25
+    '%d/%m/%Y',           # 25/12/2024
+    '%m/%d/%Y',           # 12/25/2024
+    '%Y-%m-%d %H:%M:%S',  # 2024-12-25 10:30:00
+    '%d-%m-%Y',           # 25-12-2024
+    '%Y/%m/%d'            # 2024/12/25
+]
+
+# Nombre de valeurs examinées pour détecter le format dominant d'une colonne
+DATE_FORMAT_SAMPLE_SIZE = 1000
+
+def detect_dominant_date_format(values):
+    """Renvoie le format de DATE_INPUT_FORMATS qui reconnaît le plus de valeurs de l'échantillon"""
+    sample = values.iloc[:DATE_FORMAT_SAMPLE_SIZE]
+    best_format, best_count = None, 0
+    for fmt in DATE_INPUT_FORMATS:
+        count = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if count > best_count:
+            best_format, best_count = fmt, count
+    return best_format
+
+def format_dates_to_french(values):
+    """
+    Version vectorisée de format_date_to_french appliquée à une colonne entière:
+    1. le format dominant est détecté sur un échantillon puis appliqué à toute la colonne
+       (les formats plus prioritaires gardent la main sur les valeurs ambiguës, ex: 05/06/2025)
+    2. les valeurs restantes passent par les autres formats, puis par l'analyse automatique
+    Même résultat jj/mm/aaaa que format_date_to_french; valeur d'origine si non reconnue.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime('%d/%m/%Y').fillna('')
+
+    text = values.astype(str)
+    result = pd.Series('', index=values.index, dtype=object)
+    present = values.notna() & ~text.str.lower().isin(['nan', 'none', ''])
+    remaining = text[present]
+    if remaining.empty:
+        return result
+
+    parsed = pd.Series(pd.NaT, index=remaining.index, dtype='datetime64[ns]')
+    dominant = detect_dominant_date_format(remaining)
+    if dominant is not None:
+        parsed = pd.to_datetime(remaining, format=dominant, errors='coerce')
+        matched = parsed.notna()
+        # Priorité des formats: une valeur reconnue par un format plus prioritaire le garde
+        for fmt in DATE_INPUT_FORMATS[:DATE_INPUT_FORMATS.index(dominant)]:
+            priority = pd.to_datetime(remaining[matched], format=fmt, errors='coerce')
+            parsed.update(priority.dropna())
+
+    # Retardataires: autres formats par ordre de priorité, puis analyse automatique
+    for fmt in DATE_INPUT_FORMATS:
+        leftovers = remaining[parsed.isna()]
+        if leftovers.empty or fmt == dominant:
+            continue
+        parsed.update(pd.to_datetime(leftovers, format=fmt, errors='coerce').dropna())
+
+    leftovers = remaining[parsed.isna()]
+    if not leftovers.empty:
+        # Analyse automatique à l'heure locale (le décalage UTC éventuel est ignoré)
+        local = leftovers.str.replace(r'\s*(?:Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+        parsed.update(pd.to_datetime(local, format='mixed', errors='coerce').dropna())
+
+    result[present] = parsed.dt.strftime('%d/%m/%Y').where(parsed.notna(), remaining)
+    return result
+
 def categorize_payment_method(payment_method_orders, payment_method_transactions, ttc_value, fallback_amount=None):
     """
     Catégorise les méthodes de paiement et retourne les montants par catégorie
@@ -374,59 +912,179 @@ def categorize_payment_method(payment_method_orders, payment_method_transactions
     amount_to_use = ttc_value
     if pd.isna(ttc_value) and fallback_amount is not None and not pd.isna(fallback_amount):
         amount_to_use = fallback_amount
-        print(f"DEBUG: Utilisation fallback amount {fallback_amount} pour méthode orders='{payment_method_orders}', transactions='{payment_method_transactions}'")
+        logger.debug("Utilisation fallback amount %s pour méthode orders='%s', transactions='%s'", fallback_amount, payment_method_orders, payment_method_transactions)
     
     # Si aucun montant valide, retourner 0 partout
     if pd.isna(amount_to_use):
-        print(f"DEBUG: Aucun montant valide pour méthodes orders='{payment_method_orders}', transactions='{payment_method_transactions}', retour 0")
+        logger.debug("Aucun montant valide pour méthodes orders='%s', transactions='%s', retour 0", payment_method_orders, payment_method_transactions)
         return result
     
     ttc_amount = float(amount_to_use)    # Préparer les chaînes pour la comparaison
     payment_orders_str = str(payment_method_orders).lower() if not pd.isna(payment_method_orders) else ""
     payment_transactions_str = str(payment_method_transactions).lower() if not pd.isna(payment_method_transactions) else ""
     
-    print(f"DEBUG: Analyse paiement - Orders: '{payment_orders_str}', Transactions: '{payment_transactions_str}', Montant: {ttc_amount}")
+    logger.debug("Analyse paiement - Orders: '%s', Transactions: '%s', Montant: %s", payment_orders_str, payment_transactions_str, ttc_amount)
     
     # DEBUG SPÉCIAL pour les commandes PayPal problématiques
     if any(ref in str(payment_orders_str + payment_transactions_str) for ref in ['1041', '1037', '1040', '1042']):
-        print(f"🔍 DEBUG COMMANDE SPÉCIALE: Orders='{payment_method_orders}', Transactions='{payment_method_transactions}', TTC={ttc_amount}")
+        logger.debug("🔍 COMMANDE SPÉCIALE: Orders='%s', Transactions='%s', TTC=%s", payment_method_orders, payment_method_transactions, ttc_amount)
     
     # PRIORITÉ 1: Vérifier PayPal dans les transactions (plus précis)
     # Détection élargie : paypal, pay pal, pp, etc.
     if ('paypal' in payment_transactions_str or 'pay pal' in payment_transactions_str or 
         'pay-pal' in payment_transactions_str or payment_transactions_str == 'pp'):
         result['PayPal'] = ttc_amount
-        print(f"DEBUG: PayPal détecté dans transactions -> PayPal: {ttc_amount}")
+        logger.debug("PayPal détecté dans transactions -> PayPal: %s", ttc_amount)
     # AUSSI: Vérifier PayPal dans les commandes (fallback)
     elif ('paypal' in payment_orders_str or 'pay pal' in payment_orders_str or 
           'pay-pal' in payment_orders_str or payment_orders_str == 'pp'):
         result['PayPal'] = ttc_amount
-        print(f"DEBUG: PayPal détecté dans commandes -> PayPal: {ttc_amount}")
+        logger.debug("PayPal détecté dans commandes -> PayPal: %s", ttc_amount)
     # PRIORITÉ 2: Alma et Younited
     elif 'alma' in payment_orders_str or 'alma' in payment_transactions_str:
         result['ALMA'] = ttc_amount
-        print(f"DEBUG: ALMA détecté -> ALMA: {ttc_amount}")
+        logger.debug("ALMA détecté -> ALMA: %s", ttc_amount)
     elif 'younited' in payment_orders_str or 'younited' in payment_transactions_str:
         result['Younited'] = ttc_amount
-        print(f"DEBUG: Younited détecté -> Younited: {ttc_amount}")
+        logger.debug("Younited détecté -> Younited: %s", ttc_amount)
     # PRIORITÉ 3: Vrais virements bancaires uniquement
     elif ('virement' in payment_orders_str or 'wire' in payment_orders_str or 'bank' in payment_orders_str or
           'custom' in payment_orders_str):  # Custom = souvent virement bancaire
         result['Virement bancaire'] = ttc_amount
-        print(f"DEBUG: Virement bancaire détecté -> Virement bancaire: {ttc_amount}")    # PRIORITÉ 4: Paiements par carte bancaire
+        logger.debug("Virement bancaire détecté -> Virement bancaire: %s", ttc_amount)    # PRIORITÉ 4: Paiements par carte bancaire
     elif ('shopify payments' in payment_orders_str or 'shopify payment' in payment_orders_str or
           'credit_card' in payment_orders_str or 'credit card' in payment_orders_str or
           'carte' in payment_transactions_str or 'card' in payment_transactions_str):
         # Paiements par carte: vont dans la colonne "Carte bancaire"
         result['Carte bancaire'] = ttc_amount
-        print(f"DEBUG: Paiement par carte détecté -> Carte bancaire: {ttc_amount}")
+        logger.debug("Paiement par carte détecté -> Carte bancaire: %s", ttc_amount)
     else:
         # Méthode non reconnue, laisser les cellules vides pour traitement manuel
-        print(f"DEBUG: Méthode de paiement non reconnue: orders='{payment_orders_str}', transactions='{payment_transactions_str}' -> cellules vides")
+        logger.debug("Méthode de paiement non reconnue: orders='%s', transactions='%s' -> cellules vides", payment_orders_str, payment_transactions_str)
         # Toutes les catégories restent à 0 (cellules vides)
-    
+
+    return result
+
+# Colonnes de méthodes de paiement du tableau final (dans l'ordre d'affichage)
+PAYMENT_CATEGORIES = ['Virement bancaire', 'Carte bancaire', 'ALMA', 'Younited', 'PayPal']
+
+# Table des règles de catégorisation, dans l'ordre de priorité de categorize_payment_method.
+# Chaque règle: (catégorie, mots-clés commandes, mots-clés transactions, valeurs exactes)
+# - mots-clés: sous-chaînes recherchées dans la méthode de paiement en minuscules
+# - valeurs exactes: valeurs acceptées si la méthode vaut exactement cette chaîne (commandes ou transactions)
+PAYMENT_RULES = [
+    ('PayPal', ['paypal', 'pay pal', 'pay-pal'], ['paypal', 'pay pal', 'pay-pal'], ['pp']),
+    ('ALMA', ['alma'], ['alma'], []),
+    ('Younited', ['younited'], ['younited'], []),
+    ('Virement bancaire', ['virement', 'wire', 'bank', 'custom'], [], []),  # Custom = souvent virement bancaire
+    ('Carte bancaire', ['shopify payment', 'credit_card', 'credit card'], ['carte', 'card'], []),
+]
+
+# Expressions régulières précompilées une seule fois pour chaque règle
+_COMPILED_PAYMENT_RULES = [
+    (
+        category,
+        re.compile('|'.join(re.escape(k) for k in orders_keywords)) if orders_keywords else None,
+        re.compile('|'.join(re.escape(k) for k in transactions_keywords)) if transactions_keywords else None,
+        exact_values,
+    )
+    for category, orders_keywords, transactions_keywords, exact_values in PAYMENT_RULES
+]
+
+def _lowercase_payment_series(values, index):
+    """Prépare une colonne de méthodes de paiement pour la comparaison (NaN -> chaîne vide)"""
+    if values is None:
+        return pd.Series('', index=index, dtype=object)
+    values = pd.Series(values, index=index)
+    return values.where(values.notna(), '').astype(str).str.lower()
+
+def categorize_payment_methods_vectorized(payment_methods_orders, payment_methods_transactions, ttc_amounts, fallback_amounts=None):
+    """
+    Version vectorisée de categorize_payment_method appliquée à des colonnes entières.
+    Les chaînes sont mises en minuscules une seule fois, puis les règles de PAYMENT_RULES
+    sont évaluées par masques booléens dans l'ordre de priorité
+    (PayPal > ALMA > Younited > Virement > Carte).
+    Retourne un DataFrame avec une colonne par catégorie de PAYMENT_CATEGORIES.
+    """
+    index = ttc_amounts.index
+    orders_str = _lowercase_payment_series(payment_methods_orders, index)
+    transactions_str = _lowercase_payment_series(payment_methods_transactions, index)
+
+    # Montant à utiliser: TTC calculé, sinon le montant de fallback (Total des commandes)
+    amounts = pd.to_numeric(ttc_amounts, errors='coerce')
+    if fallback_amounts is not None:
+        fallback = pd.to_numeric(pd.Series(fallback_amounts, index=index), errors='coerce')
+        amounts = amounts.where(amounts.notna(), fallback)
+    has_amount = amounts.notna()
+
+    # Catégorie retenue pour chaque ligne (la première règle qui correspond l'emporte)
+    assigned = pd.Series(False, index=index)
+    result = pd.DataFrame(0.0, index=index, columns=PAYMENT_CATEGORIES)
+
+    for category, orders_regex, transactions_regex, exact_values in _COMPILED_PAYMENT_RULES:
+        mask = pd.Series(False, index=index)
+        if orders_regex is not None:
+            mask |= orders_str.str.contains(orders_regex, regex=True)
+        if transactions_regex is not None:
+            mask |= transactions_str.str.contains(transactions_regex, regex=True)
+        if exact_values:
+            mask |= orders_str.isin(exact_values) | transactions_str.isin(exact_values)
+
+        mask &= ~assigned
+        assigned |= mask
+
+        rows = mask & has_amount
+        result.loc[rows, category] = amounts[rows].astype(float)
+
+    logger.debug("Catégorisation vectorisée - %s/%s méthodes reconnues, %s lignes sans montant", assigned.sum(), len(index), (~has_amount).sum())
+
     return result
 
+# Colonnes de montants du journal (format français "1 234,56" dans le fichier LMB)
+JOURNAL_AMOUNT_COLUMNS = ['Montant du document TTC', 'Montant du document HT', 'Montant marge HT']
+
+def parse_french_amounts(values):
+    """
+    Convertit une colonne de montants au format français ("12,34", "1 000,50") en float.
+    Les colonnes déjà numériques sont retournées telles quelles; les valeurs invalides deviennent NaN.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    cleaned = values.astype(str).str.replace(',', '.', regex=False).str.replace(' ', '', regex=False)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+def allocate_cents(totals, proportions, groups):
+    """
+    Répartit des montants en centimes selon des proportions (méthode du plus fort reste).
+    - totals: montant total à répartir, répété sur chaque ligne d'un même groupe
+    - proportions: part de chaque ligne dans son groupe (ramenées à une somme de 1 par groupe)
+    - groups: identifiant du groupe (ligne du journal d'origine)
+    Les parts d'un groupe sont arrondies au centime et leur somme est toujours égale
+    au total arrondi au centime. Les totaux NaN restent NaN.
+    """
+    # Proportions normalisées par groupe: leur somme ne peut pas dépasser le total
+    proportions = proportions / proportions.groupby(groups).transform('sum')
+
+    signs = np.sign(totals)
+    total_cents = (totals.abs() * 100).round()
+    raw_cents = total_cents * proportions
+    floor_cents = np.floor(raw_cents)
+
+    # Centimes restant à distribuer dans chaque groupe, attribués aux plus forts restes
+    shortfall = total_cents - floor_cents.groupby(groups).transform('sum')
+    remainder_rank = (raw_cents - floor_cents).groupby(groups).rank(method='first', ascending=False)
+    extra_cents = (remainder_rank <= shortfall).astype(float)
+    allocated_cents = floor_cents + extra_cents
+
+    # Contrôle: les parts de chaque groupe redonnent exactement son total arrondi
+    known = total_cents.notna()
+    group_cents = allocated_cents[known].groupby(groups[known]).sum()
+    expected_cents = total_cents[known].groupby(groups[known]).first()
+    if not group_cents.eq(expected_cents).all():
+        raise ValueError("Répartition au centime incohérente: la somme des parts diffère du montant du journal")
+
+    return signs * allocated_cents / 100
+
 def calculate_corrected_amounts(df_merged_final):
     """
     Calcule les montants HT, TVA, TTC avec logique stricte et fallback conditionnel.
@@ -436,16 +1094,16 @@ def calculate_corrected_amounts(df_merged_final):
                            alors utiliser "Total" et "Taxes" du fichier commandes UNIQUEMENT pour ces lignes
     """
     # Debug: afficher les colonnes disponibles
-    print(f"DEBUG: Colonnes disponibles: {list(df_merged_final.columns)}")
+    logger.debug("Colonnes disponibles: %s", list(df_merged_final.columns))
     
     # Vérifier s'il y a des doublons
     column_counts = df_merged_final.columns.value_counts()
     duplicates = column_counts[column_counts > 1]
     if not duplicates.empty:
-        print(f"DEBUG: Colonnes dupliquées trouvées: {duplicates.to_dict()}")
+        logger.debug("Colonnes dupliquées trouvées: %s", duplicates.to_dict())
         # Supprimer les doublons en gardant la première occurrence
         df_merged_final = df_merged_final.loc[:, ~df_merged_final.columns.duplicated()]
-        print(f"DEBUG: Colonnes après suppression des doublons: {list(df_merged_final.columns)}")
+        logger.debug("Colonnes après suppression des doublons: %s", list(df_merged_final.columns))
     
     # Initialiser toutes les séries avec NaN (cellules vides) et le bon index
     ttc_amounts = pd.Series([None] * len(df_merged_final), dtype=float, index=df_merged_final.index)
@@ -457,34 +1115,32 @@ def calculate_corrected_amounts(df_merged_final):
     journal_ht_available = 'Montant du document HT' in df_merged_final.columns
     
     if journal_ttc_available:
-        print("DEBUG: Traitement des montants TTC du Journal (priorité absolue)")
-        # Convertir les montants français (virgule) en format numérique
-        ttc_col = df_merged_final['Montant du document TTC'].astype(str).str.replace(',', '.').str.replace(' ', '')
-        ttc_amounts_journal = pd.to_numeric(ttc_col, errors='coerce')
+        logger.debug("Traitement des montants TTC du Journal (priorité absolue)")
+        # Montants français (virgule) convertis en numérique (déjà numériques après nettoyage du journal)
+        ttc_amounts_journal = parse_french_amounts(df_merged_final['Montant du document TTC'])
         
         # Appliquer les montants du journal là où ils existent
         mask_journal_ttc = ttc_amounts_journal.notna()
         ttc_amounts.loc[mask_journal_ttc] = ttc_amounts_journal.loc[mask_journal_ttc]
-        print(f"DEBUG: {mask_journal_ttc.sum()} montants TTC récupérés du Journal")
+        logger.debug("%s montants TTC récupérés du Journal", mask_journal_ttc.sum())
         
     if journal_ht_available:
-        print("DEBUG: Traitement des montants HT du Journal (priorité absolue)")
-        # Convertir les montants français (virgule) en format numérique
-        ht_col = df_merged_final['Montant du document HT'].astype(str).str.replace(',', '.').str.replace(' ', '')
-        ht_amounts_journal = pd.to_numeric(ht_col, errors='coerce')
+        logger.debug("Traitement des montants HT du Journal (priorité absolue)")
+        # Montants français (virgule) convertis en numérique (déjà numériques après nettoyage du journal)
+        ht_amounts_journal = parse_french_amounts(df_merged_final['Montant du document HT'])
         
         # Appliquer les montants HT du journal là où ils existent
         mask_journal_ht = ht_amounts_journal.notna()
         ht_amounts.loc[mask_journal_ht] = ht_amounts_journal.loc[mask_journal_ht]
-        print(f"DEBUG: {mask_journal_ht.sum()} montants HT récupérés du Journal")
+        logger.debug("%s montants HT récupérés du Journal", mask_journal_ht.sum())
         
         # Calculer TVA = TTC - HT (seulement là où on a les deux du journal)
         mask_both_journal = ttc_amounts.notna() & ht_amounts.notna()
-        tva_amounts.loc=mask_both_journal] = ttc_amounts.loc[mask_both_journal] - ht_amounts.loc[mask_both_journal]
-        print(f"DEBUG: {mask_both_journal.sum()} montants TVA calculés depuis Journal (TTC - HT)")
+        tva_amounts.loc[mask_both_journal] = ttc_amounts.loc[mask_both_journal] - ht_amounts.loc[mask_both_journal]
+        logger.debug("%s montants TVA calculés depuis Journal (TTC - HT)", mask_both_journal.sum())
       # ÉTAPE 2: Appliquer le fallback conditionnel
     # Condition: TTC, HT, TVA sont TOUS vides (peu importe le statut de Shopify)
-    print("DEBUG: Application du fallback conditionnel...")
+    logger.debug("Application du fallback conditionnel...")
     
     # Identifier les lignes où les montants principaux sont vides (TTC, HT, TVA)
     mask_amounts_empty = (
@@ -494,11 +1150,11 @@ def calculate_corrected_amounts(df_merged_final):
     )
     
     lines_for_fallback = mask_amounts_empty.sum()
-    print(f"DEBUG: {lines_for_fallback} lignes éligibles au fallback (TTC, HT, TVA tous vides, peu importe Shopify)")
+    logger.debug("%s lignes éligibles au fallback (TTC, HT, TVA tous vides, peu importe Shopify)", lines_for_fallback)
     
     # Appliquer le fallback uniquement pour ces lignes
     if lines_for_fallback > 0 and 'Total' in df_merged_final.columns:
-        print("DEBUG: Application du fallback depuis les commandes (Total et Taxes)")
+        logger.debug("Application du fallback depuis les commandes (Total et Taxes)")
         
         # Récupérer les montants des commandes
         total_from_orders = pd.to_numeric(df_merged_final['Total'], errors='coerce')
@@ -517,7 +1173,7 @@ def calculate_corrected_amounts(df_merged_final):
         mask_fallback_ht = mask_amounts_empty & ttc_amounts.notna() & tva_amounts.notna()
         ht_amounts.loc[mask_fallback_ht] = ttc_amounts.loc[mask_fallback_ht] - tva_amounts.loc[mask_fallback_ht]
         
-        print(f"DEBUG: Fallback appliqué - TTC: {mask_fallback_ttc.sum()}, TVA: {mask_fallback_tva.sum()}, HT: {mask_fallback_ht.sum()}")
+        logger.debug("Fallback appliqué - TTC: %s, TVA: %s, HT: %s", mask_fallback_ttc.sum(), mask_fallback_tva.sum(), mask_fallback_ht.sum())
     
     # Statistiques finales
     ttc_filled = ttc_amounts.notna().sum()
@@ -525,11 +1181,12 @@ def calculate_corrected_amounts(df_merged_final):
     tva_filled = tva_amounts.notna().sum()
     n_rows = len(df_merged_final)
     
-    print(f"DEBUG: RÉSULTAT FINAL - Cellules remplies - TTC: {ttc_filled}/{n_rows}, HT: {ht_filled}/{n_rows}, TVA: {tva_filled}/{n_rows}")
-    print(f"DEBUG: Cellules vides (formatage rouge) - TTC: {n_rows - ttc_filled}, HT: {n_rows - ht_filled}, TVA: {n_rows - tva_filled}")
-    print(f"DEBUG: Échantillon TTC: {ttc_amounts.head().tolist()}")
-    print(f"DEBUG: Échantillon HT: {ht_amounts.head().tolist()}")
-    print(f"DEBUG: Échantillon TVA: {tva_amounts.head().tolist()}")
+    logger.debug("RÉSULTAT FINAL - Cellules remplies - TTC: %s/%s, HT: %s/%s, TVA: %s/%s", ttc_filled, n_rows, ht_filled, n_rows, tva_filled, n_rows)
+    logger.debug("Cellules vides (formatage rouge) - TTC: %s, HT: %s, TVA: %s", n_rows - ttc_filled, n_rows - ht_filled, n_rows - tva_filled)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Échantillon TTC: %s", ttc_amounts.head().tolist())
+        logger.debug("Échantillon HT: %s", ht_amounts.head().tolist())
+        logger.debug("Échantillon TVA: %s", tva_amounts.head().tolist())
     
     return {
         'HT': ht_amounts,
@@ -539,488 +1196,792 @@ def calculate_corrected_amounts(df_merged_final):
 
 def calculate_invoice_dates(df_merged_final):
     """
-    Calcule les dates de facture avec logique de priorité.
+    Calcule les dates de facture avec logique de priorité (colonnes entières, sans boucle).
     PRIORITÉ 1: Utilise "Date du document" du Journal si disponible
     PRIORITÉ 2: Utilise "Fulfilled at" des commandes (date de livraison/expédition)
     """
-    print(f"DEBUG: Calcul des dates de facture...")
+    logger.debug("Calcul des dates de facture...")
     
     # Vérifier les colonnes disponibles
     journal_date_available = 'Date du document' in df_merged_final.columns
     fulfilled_date_available = 'Fulfilled at' in df_merged_final.columns
     
     # Initialiser la série des dates
-    invoice_dates = pd.Series([None] * len(df_merged_final))
+    invoice_dates = pd.Series([None] * len(df_merged_final), index=df_merged_final.index, dtype=object)
     
     if journal_date_available:
-        print("DEBUG: Utilisation prioritaire des dates du Journal")
-        # Convertir les dates du journal 
-        journal_dates = df_merged_final['Date du document'].copy()
+        logger.debug("Utilisation prioritaire des dates du Journal")
+        journal_dates = df_merged_final['Date du document']
         
         # Pour les lignes avec données Journal, utiliser la date du journal
         mask_journal_available = journal_dates.notna() & (journal_dates != '') & (journal_dates != 'nan')
         if mask_journal_available.any():
-            # Convertir format DD/MM/YYYY HH:MM:SS vers DD/MM/YYYY
-            for idx in journal_dates[mask_journal_available].index:
-                date_str = str(journal_dates[idx])
-                if ' ' in date_str:
-                    # Enlever la partie heure
-                    date_part = date_str.split(' ')[0]
-                    invoice_dates[idx] = date_part
-                else:
-                    invoice_dates[idx] = date_str
-            print(f"DEBUG: {mask_journal_available.sum()} dates récupérées du Journal")
+            # Convertir format DD/MM/YYYY HH:MM:SS vers DD/MM/YYYY (partie heure enlevée)
+            journal_str = journal_dates[mask_journal_available].astype(str)
+            invoice_dates[mask_journal_available] = journal_str.str.split(' ', n=1).str[0]
+            logger.debug("%s dates récupérées du Journal", mask_journal_available.sum())
     
     if fulfilled_date_available:
-        print("DEBUG: Utilisation fallback des dates Fulfilled at")
+        logger.debug("Utilisation fallback des dates Fulfilled at")
         # Pour les lignes sans date Journal, utiliser Fulfilled at
-        fulfilled_dates = df_merged_final['Fulfilled at'].copy()
+        fulfilled_dates = df_merged_final['Fulfilled at']
         
         # Masque pour les lignes qui n'ont pas encore de date
         mask_need_fulfilled = invoice_dates.isna() & fulfilled_dates.notna() & (fulfilled_dates != '') & (fulfilled_dates != 'nan')
         
         if mask_need_fulfilled.any():
-            # Convertir format ISO vers format MM/DD/YYYY
-            for idx in fulfilled_dates[mask_need_fulfilled].index:
-                date_str = str(fulfilled_dates[idx])
-                if 'T' in date_str or '+' in date_str:
-                    # Format: 2025-05-19 11:11:57 +0200 ou 2025-05-19T11:11:57+02:00
-                    try:
-                        # Enlever timezone et heure
-                        if '+' in date_str:
-                            date_str = date_str.split('+')[0]
-                        if 'T' in date_str:
-                            date_str = date_str.split('T')[0]
-                        elif ' ' in date_str:
-                            date_str = date_str.split(' ')[0]
-                          # Convertir YYYY-MM-DD vers DD/MM/YYYY (format français)
-                        from datetime import datetime
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                        invoice_dates[idx] = date_obj.strftime('%d/%m/%Y')
-                    except:
-                        # En cas d'erreur, garder la date originale
-                        invoice_dates[idx] = date_str
-                else:
-                    invoice_dates[idx] = date_str
-            print(f"DEBUG: {mask_need_fulfilled.sum()} dates récupérées de Fulfilled at")
+            fulfilled_str = fulfilled_dates[mask_need_fulfilled].astype(str)
+            
+            # Format ISO: 2025-05-19 11:11:57 +0200 ou 2025-05-19T11:11:57+02:00
+            has_plus = fulfilled_str.str.contains('+', regex=False)
+            is_iso = fulfilled_str.str.contains('T', regex=False) | has_plus
+            
+            # Enlever timezone et heure
+            date_part = fulfilled_str.where(~has_plus, fulfilled_str.str.split('+', n=1).str[0])
+            has_t = date_part.str.contains('T', regex=False)
+            has_space = date_part.str.contains(' ', regex=False)
+            date_part = date_part.where(~has_t, date_part.str.split('T', n=1).str[0])
+            date_part = date_part.where(has_t | ~has_space, date_part.str.split(' ', n=1).str[0])
+            
+            # Convertir YYYY-MM-DD vers DD/MM/YYYY (format français), sinon garder la date partielle
+            parsed = pd.to_datetime(date_part, format='%Y-%m-%d', errors='coerce')
+            iso_dates = parsed.dt.strftime('%d/%m/%Y').where(parsed.notna(), date_part)
+            
+            invoice_dates[mask_need_fulfilled] = iso_dates.where(is_iso, fulfilled_str)
+            logger.debug("%s dates récupérées de Fulfilled at", mask_need_fulfilled.sum())
     
     # Compter les résultats
     dates_found = invoice_dates.notna().sum()
-    print(f"DEBUG: Total dates de facture trouvées: {dates_found}/{len(df_merged_final)}")
+    logger.debug("Total dates de facture trouvées: %s/%s", dates_found, len(df_merged_final))
     
     # Échantillon de résultats
-    sample_dates = invoice_dates[invoice_dates.notna()].head(5)
-    print(f"DEBUG: Échantillon dates: {sample_dates.tolist()}")
+    if logger.isEnabledFor(logging.DEBUG):
+        sample_dates = invoice_dates[invoice_dates.notna()].head(5)
+        logger.debug("Échantillon dates: %s", sample_dates.tolist())
     
     return invoice_dates
 
-def generate_consolidated_billing_table(orders_file, transactions_file, journal_file):
+# Colonnes requises pour chaque fichier (après normalisation des noms)
+REQUIRED_ORDERS_COLUMNS = ['Name', 'Fulfilled at', 'Billing name', 'Financial Status',
+                           'Tax 1 Value', 'Outstanding Balance', 'Payment Method', 'Total', 'Taxes']
+REQUIRED_TRANSACTIONS_COLUMNS = ['Order', 'Presentment Amount', 'Fee', 'Net', 'Payment Method Name']
+REQUIRED_JOURNAL_COLUMNS = ['Piece', 'Référence LMB']
+
+# Colonnes lues en plus des colonnes requises quand elles existent dans le fichier
+OPTIONAL_JOURNAL_COLUMNS = ['Date du document'] + JOURNAL_AMOUNT_COLUMNS
+
+# Agrégation des transactions par commande: montants sommés, première méthode de paiement
+TRANSACTION_AGGREGATIONS = {
+    'Presentment Amount': 'sum',
+    'Fee': 'sum',
+    'Net': 'sum',
+    'Payment Method Name': 'first',  # Garder la méthode de paiement
+}
+
+# Lecture des fichiers d'entrée: (colonnes requises, colonnes optionnelles, séparateur, libellé)
+CSV_INPUT_SCHEMAS = {
+    'orders': (REQUIRED_ORDERS_COLUMNS, [], ',', "fichier des commandes"),
+    'transactions': (REQUIRED_TRANSACTIONS_COLUMNS, [], ',', "fichier des transactions"),
+    'journal': (REQUIRED_JOURNAL_COLUMNS, OPTIONAL_JOURNAL_COLUMNS, ';', "fichier journal"),
+}
+
+# Types explicites à la lecture (par nom de colonne standardisé)
+CSV_COLUMN_DTYPES = {
+    'Financial Status': 'category',
+    'Payment Method': 'category',
+    'Payment Method Name': 'category',
+    'Tax 1 Value': 'float64',
+    'Outstanding Balance': 'float64',
+    'Total': 'float64',
+    'Taxes': 'float64',
+    'Presentment Amount': 'float64',
+    'Fee': 'float64',
+    'Net': 'float64',
+}
+
+# Colonnes de dates converties en datetime dès la lecture
+CSV_DATETIME_COLUMNS = ['Fulfilled at']
+
+# Fuseau de la boutique: heure locale des dates Shopify quand le parseur les convertit en UTC
+SHOP_TIMEZONE = os.environ.get('SHOP_TIMEZONE', 'Europe/Paris')
+
+# Moteur de lecture CSV: pyarrow (multi-thread) si installé, sinon moteur C de pandas;
+# CSV_ENGINE ('c', 'pyarrow' ou 'python') impose un moteur
+CSV_ENGINE = os.environ.get('CSV_ENGINE') or ('pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c')
+
+def parse_local_datetimes(values):
     """
-    Fonction principale pour générer le tableau de facturation consolidé
+    Convertit une colonne de dates en datetime64 à l'heure locale
+    (ex: "2025-05-19 11:11:57 +0200" -> 2025-05-19 11:11:57, le décalage UTC est ignoré).
+    Si une valeur renseignée n'est pas une date ISO, la colonne est renvoyée telle quelle
+    et format_dates_to_french s'en charge.
     """
-    try:
-        print("=== DÉBUT DU TRAITEMENT ===")        # ÉTAPE 1: Chargement des fichiers CSV
-        print("1. Chargement des fichiers CSV...")
-        
-        # Chargement du fichier des commandes (séparateur virgule)
-        df_orders = safe_read_csv(orders_file, separator=',')
-        print(f"   - Commandes chargées: {len(df_orders)} lignes")
-          # Chargement du fichier des transactions (séparateur virgule)  
-        df_transactions = safe_read_csv(transactions_file, separator=',')
-        print(f"   - Transactions chargées: {len(df_transactions)} lignes")
-        
-        # Chargement du fichier journal (séparateur point-virgule)
-        df_journal = safe_read_csv(journal_file, separator=';')
-        print(f"   - Journal chargé: {len(df_journal)} lignes")
-          # Vérification et normalisation des colonnes requises
-        required_orders_cols = ['Name', 'Fulfilled at', 'Billing name', 'Financial Status', 
-                               'Tax 1 Value', 'Outstanding Balance', 'Payment Method', 'Total', 'Taxes']
-        required_transactions_cols = ['Order', 'Presentment Amount', 'Fee', 'Net', 'Payment Method Name']
-        required_journal_cols = ['Piece', 'Référence LMB']
-        
-        print("\n2. Vérification et normalisation des colonnes...")
-        
-        # Normaliser les colonnes
-        df_orders = normalize_column_names(df_orders, required_orders_cols, "fichier des commandes")
-        df_transactions = normalize_column_names(df_transactions, required_transactions_cols, "fichier des transactions")
-        df_journal = normalize_column_names(df_journal, required_journal_cols, "fichier journal")
-          # Valider que toutes les colonnes requises sont présentes
-        validate_required_columns(df_orders, required_orders_cols, "fichier des commandes")
-        validate_required_columns(df_transactions, required_transactions_cols, "fichier des transactions")
-        validate_required_columns(df_journal, required_journal_cols, "fichier journal")
-        
-        print("3. Nettoyage et formatage des données...")
-        
-        # Nettoyage des colonnes de texte utilisées comme clés de jointure
-        df_orders = clean_text_data(df_orders, ['Name', 'Billing name', 'Financial Status', 'Payment Method'])
-        df_transactions = clean_text_data(df_transactions, ['Order', 'Payment Method Name'])
-        df_journal = clean_text_data(df_journal, ['Piece', 'Référence LMB'])
-        
-        # Formatage des dates - conversion en format français jj/mm/aaaa
-        df_orders['Fulfilled at'] = df_orders['Fulfilled at'].apply(format_date_to_french)
-          # Formatage des colonnes monétaires en type numérique
-        monetary_cols_orders = ['Tax 1 Value', 'Outstanding Balance']
-        monetary_cols_transactions = ['Presentment Amount', 'Fee', 'Net']
-        
-        for col in monetary_cols_orders:
-            if col in df_orders.columns:
-                df_orders[col] = pd.to_numeric(df_orders[col], errors='coerce').fillna(0)
-        
-        for col in monetary_cols_transactions:
-            if col in df_transactions.columns:
-                df_transactions[col] = pd.to_numeric(df_transactions[col], errors='coerce').fillna(0)
-        
-        print("3.5. Agrégation des commandes pour éviter les doublons...")
-        
-        # IMPORTANT: Grouper les commandes par Name pour éviter les doublons
-        # (cas où il y a plusieurs lignes de produits par commande)
-        print(f"   - Nombre de lignes avant agrégation des commandes: {len(df_orders)}")
-        
-        # Colonnes à garder telles quelles (prendre la première valeur)
-        first_value_cols = ['Fulfilled at', 'Billing name', 'Financial Status', 'Payment Method']
-        
-        # Colonnes à sommer (montants, quantités, etc.)
-        sum_cols = ['Tax 1 Value', 'Outstanding Balance']
-          # Détecter automatiquement d'autres colonnes numériques qui pourraient nécessiter une sommation        # Temporairement désactiver l'auto-détection pour éviter les erreurs pandas
-        # for col in df_orders.columns:
-        #     if col not in first_value_cols and col != 'Name':
-        #         try:
-        #             # Si c'est une colonne numérique, on la somme
-        #             if pd.api.types.is_numeric_dtype(df_orders[col]):
-        #                 if col not in sum_cols:
-        #                     sum_cols.append(col)
-        #                     print(f"   - Colonne numérique détectée pour sommation: {col}")
-        #             # Sinon, on prend la première valeur
-        #             elif col not in first_value_cols:
-        #                 first_value_cols.append(col)
-        #         except Exception as e:
-        #             print(f"   - Erreur lors de l'analyse de la colonne {col}: {e}")
-        #             # En cas d'erreur, traiter comme une colonne de première valeur
-        #             if col not in first_value_cols:
-        #                 first_value_cols.append(col)
-        
-        # Ajouter toutes les autres colonnes aux first_value_cols pour éviter les erreurs
-        for col in df_orders.columns:
-            if col not in first_value_cols and col not in sum_cols and col != 'Name':
-                first_value_cols.append(col)
-        
-        # Préparer les opérations d'agrégation
-        agg_operations = {}
-        
-        # Pour les colonnes de texte/dates, prendre la première valeur
-        for col in first_value_cols:
-            if col in df_orders.columns:
-                agg_operations[col] = 'first'
-          # Pour les colonnes monétaires, faire la somme
-        for col in sum_cols:
-            if col in df_orders.columns:
-                agg_operations[col] = 'sum'
-        
-        # Grouper par Name (identifiant unique de la commande)
-        if agg_operations:
-            df_orders_aggregated = df_orders.drop_duplicates(subset=['Name'], keep='first')
-        else:
-            # Si pas d'opérations d'agrégation, juste dédupliquer
-            df_orders_aggregated = df_orders.drop_duplicates(subset=['Name'], keep='first')
-        
-        print(f"   - Nombre de lignes après agrégation des commandes: {len(df_orders_aggregated)}")
-        
-        # Note: Un même client peut avoir plusieurs commandes distinctes
-        # Chaque commande doit apparaître sur une ligne séparée
-        
-        # Remplacer df_orders par la version agrégée
-        df_orders = df_orders_aggregated
-          # ÉTAPE 2: Agrégation des transactions par commande
-        print("4. Agrégation des transactions par commande...")
-        
-        # Grouper par Order et sommer les montants pour éviter les doublons
-        # IMPORTANT: Garder aussi Payment Method Name (prendre la première valeur)
-        df_transactions_aggregated = df_transactions.groupby('Order').agg({
-            'Presentment Amount': 'sum',
-            'Fee': 'sum',
-            'Net': 'sum',
-            'Payment Method Name': 'first'  # Garder la méthode de paiement
-        }).reset_index()
-        
-        print(f"   - Transactions après agrégation: {len(df_transactions_aggregated)} lignes")
-          # ÉTAPE 3: Fusion des DataFrames
-        print("5. Fusion des DataFrames...")
-        
-        # Première fusion: Commandes + Transactions agrégées (jointure à gauche)
-        df_merged_step1 = pd.merge(df_orders, df_transactions_aggregated, 
-                                  left_on='Name', right_on='Order', how='left')
-        print(f"   - Après fusion commandes-transactions: {len(df_merged_step1)} lignes")
-        
-        # Diagnostic avant fusion avec journal
-        print("   - Diagnostic avant fusion avec journal:")
-        print(f"     * Commandes uniques dans df_merged_step1: {df_merged_step1['Name'].nunique()} ({list(df_merged_step1['Name'].unique()[:5])}...)")
-        print(f"     * Références uniques dans journal: {df_journal['Piece'].nunique()} ({list(df_journal['Piece'].unique()[:5])}...)")
-          # Vérifier les correspondances
-        commandes_dans_journal = df_merged_step1['Name'].isin(df_journal['Piece']).sum()
-        print(f"     * Commandes qui ont une correspondance dans le journal: {commandes_dans_journal}/{len(df_merged_step1)}")
-          # Deuxième fusion: Résultat + Journal (jointure à gauche)
-        # TOUJOURS essayer d'améliorer les correspondances avec normalisation
-        print("DEBUG: Début de la logique de fusion avec journal")
-        print(f"DEBUG: commandes_dans_journal = {commandes_dans_journal}, len(df_merged_step1) = {len(df_merged_step1)}")
-        if commandes_dans_journal < len(df_merged_step1):  # Si pas 100% de correspondances
-            print("     🔧 Application de la normalisation des références...")
-            df_merged_step1_improved = improve_journal_matching(df_merged_step1, df_journal)
-            
-            # Utiliser les données améliorées
-            df_merged_final = df_merged_step1_improved
-        else:
-            print("     ✅ Toutes les correspondances trouvées, fusion standard")
-            # Fusion standard si toutes les correspondances sont déjà trouvées
-            df_merged_final = pd.merge(df_merged_step1, df_journal, 
-                                      left_on='Name', right_on='Piece', how='left')
-        print(f"   - Après fusion avec journal: {len(df_merged_final)} lignes")
-        
-        # Diagnostic après fusion
-        ref_lmb_non_nulles = df_merged_final['Référence LMB'].notna().sum()
-        print(f"   - Références LMB trouvées: {ref_lmb_non_nulles}/{len(df_merged_final)} ({ref_lmb_non_nulles/len(df_merged_final)*100:.1f}%)")        # ÉTAPE 4: Création du tableau final avec les 16 colonnes
-        print("6. Création du tableau final...")
-        
-        # DEBUG: Vérifier les colonnes disponibles dans df_merged_final
-        print(f"DEBUG: Colonnes dans df_merged_final: {list(df_merged_final.columns)}")
-        print(f"DEBUG: 'Payment Method Name' présente: {'Payment Method Name' in df_merged_final.columns}")
-        
-        # DEBUG: Vérifier quelques exemples de Payment Method Name
-        if 'Payment Method Name' in df_merged_final.columns:
-            payment_methods = df_merged_final['Payment Method Name'].dropna().unique()
-            print(f"DEBUG: Valeurs uniques de Payment Method Name: {payment_methods}")
-        
-        df_final = pd.DataFrame()
-        
-        # Colonnes du tableau final dans l'ordre requis
-        df_final['Centre de profit'] = 'lcdi.fr'  # Valeur statique
-        df_final['Réf.WEB'] = df_merged_final['Name']
-        df_final['Réf. LMB'] = df_merged_final['Référence LMB'].fillna('')
-        df_final['Date Facture'] = calculate_invoice_dates(df_merged_final)
-        df_final['Etat'] = df_merged_final['Financial Status'].fillna('').apply(translate_financial_status)
-        df_final['Client'] = df_merged_final['Billing name'].fillna('')
-        
-        # Calculs des montants
-        corrected_amounts = calculate_corrected_amounts(df_merged_final)
-        df_final['HT'] = corrected_amounts['HT']
-        df_final['TVA'] = corrected_amounts['TVA']
-        df_final['TTC'] = corrected_amounts['TTC']
-        df_final['reste'] = df_merged_final['Outstanding Balance'].fillna(0)
-        df_final['Shopify'] = df_merged_final['Net'].fillna(0)
-        df_final['Frais de commission'] = df_merged_final['Fee'].fillna(0)
-        
-        # Traitement des méthodes de paiement
-        print("7. Traitement des méthodes de paiement...")
-        payment_categorization = df_merged_final.apply(
-            lambda row: categorize_payment_method(
-                row.get('Payment Method'),  # Méthode de paiement des commandes
-                row.get('Payment Method Name'),  # Méthode de paiement des transactions (plus précise pour PayPal),
-                corrected_amounts['TTC'].loc[row.name] if row.name in corrected_amounts['TTC'].index else None,  # Utiliser le TTC calculé
-                fallback_amount=row.get('Total', 0)  # Fallback sur le montant de la commande
-            ), 
-            axis=1
-        )
-        
-        df_final['Virement bancaire'] = [pm['Virement bancaire'] for pm in payment_categorization]
-        df_final['Carte bancaire'] = [pm['Carte bancaire'] for pm in payment_categorization]
-        df_final['ALMA'] = [pm['ALMA'] for pm in payment_categorization]
-        df_final['Younited'] = [pm['Younited'] for pm in payment_categorization]
-        df_final['PayPal'] = [pm['PayPal'] for pm in payment_categorization]          # PRÉPARATION STATUT DYNAMIQUE: Créer une colonne vide pour les formules Excel
-        # Les formules seront ajoutées lors de la génération du fichier Excel
-        df_final['Statut'] = ''  # Colonne vide pour les formules
-        
-        print("8. Nettoyage final des données...")
-        
-        # Appliquer les indicateurs d'informations manquantes
-        df_final = fill_missing_data_indicators(df_final, df_merged_final)
-        
-        # S'assurer que "Centre de profit" est toujours "lcdi.fr" (forcer après toutes les fusions)
-        df_final['Centre de profit'] = 'lcdi.fr'
-        
-        # Indicateurs de données manquantes
-        df_final = fill_missing_data_indicators(df_final, df_merged_final)
-        
-        print(f"=== TRAITEMENT TERMINÉ ===")
-        print(f"Tableau final généré avec {len(df_final)} lignes et {len(df_final.columns)} colonnes")
-        
-        return df_final
-        
-    except Exception as e:
-        print(f"ERREUR lors du traitement: {str(e)}")
-        raise e
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if getattr(values.dt, 'tz', None) is not None:
+            return values.dt.tz_convert(SHOP_TIMEZONE).dt.tz_localize(None)
+        return values
 
-def process_dataframes_directly(df_orders, df_transactions, df_journal):
+    text = values.astype('string').str.strip()
+    present = text.notna() & text.ne('')
+    text = text.str.replace(r'\s*(?:Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+    parsed = pd.to_datetime(text.where(present), format='ISO8601', errors='coerce')
+    if parsed[present].isna().any():
+        return values
+    return parsed
+
+def input_csv_read_options(file_path, input_type):
     """
-    Fonction auxiliaire pour traiter directement des DataFrames (utilisée pour les tests)
+    Encodage, correspondance des colonnes et options de pd.read_csv d'un fichier d'entrée,
+    déterminés depuis l'en-tête seul: colonnes utiles (usecols) et types explicites (dtype)
     """
-    try:
-        print("=== DÉBUT DU TRAITEMENT (DataFrames) ===")
-        
-        # ÉTAPE 1: Les DataFrames sont déjà chargés
-        print("1. DataFrames déjà chargés...")
-        print(f"   - Commandes: {len(df_orders)} lignes")
-        print(f"   - Transactions: {len(df_transactions)} lignes")
-        print(f"   - Journal: {len(df_journal)} lignes")
-          # ÉTAPE 2: Vérification et normalisation des colonnes
-        print("2. Vérification et normalisation des colonnes...")
-          # Normaliser les noms de colonnes pour les commandes
-        required_orders_cols = ['Name', 'Fulfilled at', 'Billing name', 'Financial Status', 'Tax 1 Value', 'Outstanding Balance', 'Payment Method', 'Total', 'Taxes']
-        df_orders = normalize_column_names(df_orders, required_orders_cols, 'commandes')
-        validate_required_columns(df_orders, required_orders_cols, "fichier des commandes")
-        
-        # Normaliser les noms de colonnes pour les transactions
-        required_trans_cols = ['Order', 'Presentment Amount', 'Fee', 'Net']
-        df_transactions = normalize_column_names(df_transactions, required_trans_cols, 'transactions')
-        validate_required_columns(df_transactions, required_trans_cols, "fichier des transactions")
-        
-        # Normaliser les noms de colonnes pour le journal
-        required_journal_cols = ['Piece', 'Référence LMB']
-        df_journal = normalize_column_names(df_journal, required_journal_cols, 'journal')
-        validate_required_columns(df_journal, required_journal_cols, "fichier journal")
-          # ÉTAPE 3: Nettoyage et formatage des données
-        print("3. Nettoyage et formatage des données...")
-        
-        # Nettoyage des colonnes de texte utilisées comme clés de jointure
-        df_orders = clean_text_data(df_orders, ['Name', 'Billing name', 'Financial Status', 'Payment Method'])
-        df_transactions = clean_text_data(df_transactions, ['Order', 'Payment Method Name'])
-        df_journal = clean_text_data(df_journal, ['Piece', 'Référence LMB'])
-        
-        # Formatage des dates - conversion en format français jj/mm/aaaa
-        df_orders['Fulfilled at'] = df_orders['Fulfilled at'].apply(format_date_to_french)
-        
-        # Formatage des colonnes monétaires en type numérique
-        monetary_cols_orders = ['Tax 1 Value', 'Outstanding Balance']
-        monetary_cols_transactions = ['Presentment Amount', 'Fee', 'Net']
-        
-        for col in monetary_cols_orders:
-            if col in df_orders.columns:
-                df_orders[col] = pd.to_numeric(df_orders[col], errors='coerce').fillna(0)
-        
-        for col in monetary_cols_transactions:
-            if col in df_transactions.columns:
-                df_transactions[col] = pd.to_numeric(df_transactions[col], errors='coerce').fillna(0)
-        
-        # ÉTAPE 3.5: Agrégation des commandes pour éviter les doublons par commande
-        print("3.5. Agrégation des commandes pour éviter les doublons...")
-        print(f"   - Nombre de lignes avant agrégation des commandes: {len(df_orders)}")
-        
-        # Définir les colonnes pour l'agrégation        # Listes de base pour l'agrégation
-        first_cols = ['Fulfilled at', 'Billing name', 'Financial Status', 'Payment Method', 'Email', 'Lineitem name']
-        sum_cols = ['Tax 1 Value', 'Outstanding Balance']
-        
-        # Colonnes monétaires spécifiques à sommer (éviter l'auto-détection problématique)
-        predefined_sum_cols = ['Total', 'Taxes', 'Shipping', 'Discount Amount', 'Refunded Amount', 
-                              'Lineitem price', 'Lineitem quantity', 'Outstanding Balance']
-        
-        for col in predefined_sum_cols:
-            if col in df_orders.columns and col not in sum_cols:
+    expected_columns, optional_columns, separator, file_type = CSV_INPUT_SCHEMAS[input_type]
+    with profile_step(f'detect_encoding:{input_type}'):
+        encoding = detect_encoding(file_path)
+
+    # En-tête seul pour résoudre les colonnes à lire
+    header = list(pd.read_csv(file_path, sep=separator, encoding=encoding, nrows=0).columns)
+    column_mapping = resolve_column_mapping(header, expected_columns, file_type)
+
+    read_options = {'engine': CSV_ENGINE}
+    if set(expected_columns) <= set(column_mapping.values()):
+        read_options['usecols'] = [col for col in header
+                                   if col in column_mapping or col in optional_columns]
+        read_options['dtype'] = {col: CSV_COLUMN_DTYPES[target] for col, target in column_mapping.items()
+                                 if target in CSV_COLUMN_DTYPES}
+    # Sinon lecture complète: validate_required_columns affichera toutes les colonnes disponibles
+    return encoding, column_mapping, read_options
+
+def read_input_csv(file_path, input_type):
+    """
+    Lit un fichier d'entrée (orders, transactions ou journal) en ne gardant que les colonnes
+    utiles au traitement, résolues depuis l'en-tête avec la même correspondance que
+    normalize_column_names, et avec des types explicites (category, float, datetime).
+    """
+    separator, file_type = CSV_INPUT_SCHEMAS[input_type][2:]
+    encoding, column_mapping, read_options = input_csv_read_options(file_path, input_type)
+
+    with profile_step(f'read_csv:{input_type}'):
+        try:
+            df = safe_read_csv(file_path, separator, encoding, **read_options)
+        except ValueError as e:
+            # Montant non numérique (ex: virgule décimale): lecture sans forcer les floats,
+            # la conversion pd.to_numeric du nettoyage s'en charge
+            logger.warning("Types explicites refusés pour %s (%s), lecture sans conversion float", file_type, e)
+            read_options['dtype'] = {col: dtype for col, dtype in read_options.get('dtype', {}).items()
+                                     if dtype != 'float64'}
+            df = safe_read_csv(file_path, separator, encoding, **read_options)
+
+    for col, target in column_mapping.items():
+        if target in CSV_DATETIME_COLUMNS and col in df.columns:
+            df[col] = parse_local_datetimes(df[col])
+
+    return df
+
+def iter_input_csv(file_path, input_type, chunk_size):
+    """
+    Lit un fichier d'entrée par blocs de chunk_size lignes (mode en flux), avec les mêmes
+    colonnes que read_input_csv. Moteur C (pyarrow ne lit pas par blocs) et sans type float
+    forcé: un montant invalide au milieu du fichier ne doit pas interrompre la lecture,
+    la conversion pd.to_numeric du nettoyage s'en charge.
+    """
+    separator = CSV_INPUT_SCHEMAS[input_type][2]
+    encoding, column_mapping, read_options = input_csv_read_options(file_path, input_type)
+    read_options.update(engine='c', chunksize=chunk_size)
+    if 'dtype' in read_options:
+        read_options['dtype'] = {col: dtype for col, dtype in read_options['dtype'].items() if dtype != 'float64'}
+
+    with pd.read_csv(file_path, sep=separator, encoding=encoding, **read_options) as reader:
+        for chunk in reader:
+            for col, target in column_mapping.items():
+                if target in CSV_DATETIME_COLUMNS and col in chunk.columns:
+                    chunk[col] = parse_local_datetimes(chunk[col])
+            yield chunk
+
+def aggregate_orders_first_line(df_orders):
+    """
+    Stratégie d'agrégation par défaut: une ligne par commande (Name),
+    en gardant la première ligne de produits de chaque commande
+    """
+    return df_orders.drop_duplicates(subset=['Name'], keep='first')
+
+def aggregate_orders_with_sums(df_orders):
+    """
+    Stratégie d'agrégation alternative: première valeur pour les colonnes texte/dates,
+    somme pour les colonnes monétaires numériques (Tax 1 Value, Outstanding Balance, Total, Taxes...)
+    """
+    sum_cols = ['Tax 1 Value', 'Outstanding Balance']
+    predefined_sum_cols = ['Total', 'Taxes', 'Shipping', 'Discount Amount', 'Refunded Amount',
+                           'Lineitem price', 'Lineitem quantity']
+
+    for col in predefined_sum_cols:
+        if col in df_orders.columns and pd.api.types.is_numeric_dtype(df_orders[col]):
+            sum_cols.append(col)
+
+    agg_operations = {}
+    for col in df_orders.columns:
+        if col == 'Name':
+            continue
+        agg_operations[col] = 'sum' if col in sum_cols else 'first'
+
+    return df_orders.groupby('Name', sort=False, as_index=False).agg(agg_operations)
+
+def match_journal_with_normalization(df_merged_step1, df_journal):
+    """
+    Stratégie de rapprochement par défaut avec le journal:
+    fusion standard si toutes les commandes ont une correspondance exacte,
+    sinon normalisation des références (improve_journal_matching)
+    """
+    commandes_dans_journal = df_merged_step1['Name'].isin(df_journal['Piece']).sum()
+    logger.info("     * Commandes qui ont une correspondance dans le journal: %s/%s", commandes_dans_journal, len(df_merged_step1))
+
+    if commandes_dans_journal < len(df_merged_step1):  # Si pas 100% de correspondances
+        logger.info("     🔧 Application de la normalisation des références...")
+        return improve_journal_matching(df_merged_step1, df_journal)
+
+    logger.info("     ✅ Toutes les correspondances trouvées, fusion standard")
+    return match_journal_exact(df_merged_step1, df_journal)
+
+def match_journal_exact(df_merged_step1, df_journal):
+    """Stratégie de rapprochement stricte: jointure à gauche Name = Piece sans normalisation"""
+    return pd.merge(df_merged_step1, df_journal, left_on='Name', right_on='Piece', how='left')
+
+# Instrumentation du pipeline: temps réel, temps CPU, pic de mémoire (RSS) et nombre de
+# lignes par étape. PIPELINE_PROFILING: 'basic' (défaut), 'memory' (ajoute tracemalloc,
+# plus coûteux) ou 'off' (aucune mesure).
+PIPELINE_PROFILING = os.environ.get('PIPELINE_PROFILING', 'basic')
+
+# DataFrames dont le nombre de lignes est relevé à la fin de chaque étape
+STAGE_ROW_COUNTS = {
+    'load_files': ['orders', 'transactions', 'journal'],
+    'normalize_columns': ['orders', 'transactions', 'journal'],
+    'clean_data': ['orders', 'transactions', 'journal'],
+    'aggregate_orders': ['orders'],
+    'aggregate_transactions': ['transactions'],
+    'merge_transactions': ['merged_step1'],
+    'merge_journal': ['merged_final'],
+    'build_final_table': ['final'],
+    'finalize': ['final'],
+}
+
+_active_profiler = contextvars.ContextVar('active_profiler', default=None)
+
+def peak_rss_bytes():
+    """Pic de mémoire résidente du processus (None si le module resource est indisponible)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: kilo-octets, macOS: octets
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class PipelineProfiler:
+    """
+    Collecte les mesures des étapes (et sous-étapes imbriquées) sous forme de dictionnaires
+    sérialisables en JSON. stage(name) est un context manager qui renvoie l'enregistrement
+    de l'étape (ou None en mode 'off'), complétable par l'appelant (ex: nombre de lignes).
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode or PIPELINE_PROFILING
+        self.records = []
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.mode == 'off':
+            yield None
+            return
+
+        record = {'name': name, 'depth': self._depth}
+        self.records.append(record)
+        # tracemalloc seulement au premier niveau: reset_peak fausserait l'étape englobante
+        trace_memory = self.mode == 'memory' and self._depth == 0 and tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+
+        self._depth += 1
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record['wall_s'] = round(time.perf_counter() - wall_start, 6)
+            record['cpu_s'] = round(time.process_time() - cpu_start, 6)
+            peak_rss = peak_rss_bytes()
+            if peak_rss is not None:
+                record['peak_rss_bytes'] = peak_rss
+            if trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record['tracemalloc_delta_bytes'] = current - memory_start
+                record['tracemalloc_peak_bytes'] = peak - memory_start
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Rend ce profileur actif pour profile_step (et démarre tracemalloc en mode 'memory')"""
+        token = _active_profiler.set(self)
+        started_tracing = self.mode == 'memory' and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            yield self
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            _active_profiler.reset(token)
+
+    def absorb(self, other):
+        """Ajoute les mesures d'un autre profileur (thread) comme sous-étapes de l'étape en cours"""
+        for record in other.records:
+            self.records.append(dict(record, depth=record['depth'] + self._depth))
+
+    def to_dict(self):
+        """Mesures au format JSON: mode, étapes dans l'ordre de démarrage et durée totale"""
+        return {
+            'mode': self.mode,
+            'total_wall_s': round(sum(r.get('wall_s', 0) for r in self.records if r['depth'] == 0), 6),
+            'stages': self.records,
+        }
+
+def profile_step(name):
+    """Mesure une sous-étape avec le profileur actif; sans profileur actif, aucun coût"""
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
+
+# Ingestion parallèle des fichiers d'entrée (chargement, normalisation, nettoyage):
+# nombre de threads, un par fichier au plus et pas plus que de processeurs
+# (1: ingestion séquentielle, étape par étape)
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', min(3, os.cpu_count() or 1)))
+
+# Étapes couvertes par l'ingestion parallèle, dans l'ordre du pipeline
+INGEST_STEPS = ['load_files', 'normalize_columns', 'clean_data']
+
+# Cache intermédiaire par étape: commandes agrégées, transactions agrégées, journal
+# normalisé et fusion commandes-transactions, stockés sous une clé dérivée des empreintes
+# des fichiers dont ils dépendent. Un nouveau passage ne recalcule que l'aval des
+# fichiers modifiés (ex: seul le journal change -> rapprochement journal + écriture).
+STAGE_CACHE_FOLDER = os.path.join('cache', 'stages')
+STAGE_CACHE_MAX_BYTES = int(os.environ.get('STAGE_CACHE_MAX_MB', 1000)) * 1024 * 1024
+
+# Parquet (colonnaire) si pyarrow est installé, sinon pickle pandas
+STAGE_CACHE_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') is not None else 'pickle'
+
+# Résultat produit par chaque étape du pipeline et mis en cache à la fin de l'étape
+STAGE_CACHE_ARTIFACTS = {
+    'clean_data': ['journal'],
+    'aggregate_orders': ['orders'],
+    'aggregate_transactions': ['transactions'],
+    'merge_transactions': ['merged_step1'],
+}
+
+class StageCache:
+    """
+    Stockage sur disque des DataFrames intermédiaires du pipeline, un fichier par
+    (résultat, clé). Écriture atomique (fichier temporaire puis renommage) pour les
+    processus concurrents, éviction LRU (date de dernier accès) au-delà de max_bytes.
+    """
+
+    EXTENSIONS = {'parquet': '.parquet', 'pickle': '.pkl'}
+
+    def __init__(self, folder, max_bytes, storage_format=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.storage_format = storage_format or STAGE_CACHE_FORMAT
+
+    @staticmethod
+    def make_key(*parts):
+        """Clé d'un résultat intermédiaire à partir des empreintes et paramètres dont il dépend"""
+        return hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+    def _path(self, name, key, storage_format):
+        return os.path.join(self.folder, f"{name}-{key}{self.EXTENSIONS[storage_format]}")
+
+    def contains(self, name, key):
+        """Un résultat est-il en cache pour (name, key) ?"""
+        return any(os.path.exists(self._path(name, key, storage_format)) for storage_format in self.EXTENSIONS)
+
+    def load(self, name, key):
+        """DataFrame en cache pour (name, key), ou None"""
+        for storage_format in self.EXTENSIONS:
+            path = self._path(name, key, storage_format)
+            if not os.path.exists(path):
+                continue
+            try:
+                df = pd.read_parquet(path) if storage_format == 'parquet' else pd.read_pickle(path)
+            except Exception as e:
+                logger.warning("Cache d'étape illisible (%s): %s", os.path.basename(path), e)
+                continue
+            os.utime(path)  # Date d'accès pour l'éviction LRU
+            return df
+        return None
+
+    def save(self, name, key, df):
+        """Enregistre un DataFrame; repli sur pickle si le format colonnaire le refuse"""
+        os.makedirs(self.folder, exist_ok=True)
+        storage_format = self.storage_format
+        path = self._path(name, key, storage_format)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            if storage_format == 'parquet':
                 try:
-                    # Vérifier que la colonne contient réellement des valeurs numériques
-                    non_null_values = df_orders[col].dropna()
-                    if len(non_null_values) > 0:
-                        # Tenter de convertir en numérique
-                        pd.to_numeric(non_null_values, errors='raise')
-                        sum_cols.append(col)
-                        print(f"   - Colonne prédéfinie ajoutée pour sommation: {col}")
-                except Exception:
-                    # Si conversion échoue, traiter comme première valeur
-                    if col not in first_cols:
-                        first_cols.append(col)
-                        print(f"   - Colonne {col} traitée comme 'first' (non numérique)")
-        
-        # Ajouter les autres colonnes non numériques à first_cols
-        for col in df_orders.columns:
-            if col not in sum_cols and col not in first_cols and col != 'Name':
-                first_cols.append(col)
-        
-        # Construire le dictionnaire d'opérations d'agrégation
-        agg_operations = {}
-        
-        # Configurer les opérations d'agrégation
-        for col in first_cols:
-            if col in df_orders.columns:
-                agg_operations[col] = 'first'
-        
-        # Pour les colonnes monétaires, faire la somme
-        for col in sum_cols:
-            if col in df_orders.columns:
-                agg_operations[col] = 'sum'
-        
-        # Grouper par Name (identifiant unique de la commande)
-        if agg_operations:
-            df_orders_aggregated = df_orders.drop_duplicates(subset=['Name'], keep='first')
-        else:
-            # Si pas d'opérations d'agrégation, juste dédupliquer
-            df_orders_aggregated = df_orders.drop_duplicates(subset=['Name'], keep='first')
-        
-        print(f"   - Nombre de lignes après agrégation des commandes: {len(df_orders_aggregated)}")
-        
-        # Note: Un même client peut avoir plusieurs commandes distinctes
-        # Chaque commande doit apparaître sur une ligne séparée
-        
-        # Remplacer df_orders par la version agrégée
-        df_orders = df_orders_aggregated
-        
-        # ÉTAPE 4: Agrégation des transactions par commande
-        print("4. Agrégation des transactions par commande...")
-        
+                    df.to_parquet(temp_path)
+                except Exception as e:
+                    # Colonnes objet de types mélangés: non représentables en Parquet
+                    logger.warning("Parquet impossible pour %s (%s), sauvegarde pickle", name, e)
+                    storage_format = 'pickle'
+                    path = self._path(name, key, storage_format)
+            if storage_format == 'pickle':
+                df.to_pickle(temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("Impossible d'enregistrer le cache d'étape %s: %s", name, e)
+            return
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._evict()
+
+    def _evict(self):
+        """Supprime les fichiers les moins récemment utilisés au-delà de max_bytes"""
+        files = [(entry.stat().st_mtime, entry.path, entry.stat().st_size)
+                 for entry in os.scandir(self.folder) if entry.is_file() and not entry.name.endswith('.tmp')]
+        total_size = sum(size for _, _, size in files)
+        for _, path, size in sorted(files):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+stage_cache = StageCache(STAGE_CACHE_FOLDER, STAGE_CACHE_MAX_BYTES) if STAGE_CACHE_MAX_BYTES > 0 else None
+
+class BillingPipeline:
+    """
+    Pipeline de consolidation commandes + transactions + journal en étapes explicites.
+    Chaque étape lit et complète un dictionnaire d'état partagé, ce qui permet de
+    chronométrer, mettre en cache ou remplacer une étape indépendamment des autres.
+
+    Stratégies interchangeables:
+    - journal_matching(df_merged_step1, df_journal) -> df_merged_final
+    - orders_aggregation(df_orders) -> df_orders agrégé (une ligne par commande)
+
+    progress_callback(stage), optionnel, est appelé au début de chaque étape
+    (suivi de la progression des traitements en arrière-plan).
+
+    stage_cache (StageCache), optionnel: avec run_from_files, les résultats intermédiaires
+    dont les fichiers d'entrée n'ont pas changé sont relus au lieu d'être recalculés;
+    les étapes correspondantes sont alors sautées pour ces fichiers.
+    """
+
+    STAGES = [
+        'normalize_columns',
+        'clean_data',
+        'aggregate_orders',
+        'aggregate_transactions',
+        'merge_transactions',
+        'merge_journal',
+        'build_final_table',
+        'finalize',
+    ]
+
+    # Étapes propres à chaque fichier d'entrée, exécutables dès qu'il est reçu (prepare_input)
+    PREPARE_STAGES = ['load_files', 'normalize_columns', 'clean_data', 'aggregate_orders', 'aggregate_transactions']
+
+    def __init__(self, journal_matching=None, orders_aggregation=None, progress_callback=None, stage_cache=None):
+        self.journal_matching = journal_matching or match_journal_with_normalization
+        self.orders_aggregation = orders_aggregation or aggregate_orders_first_line
+        self.progress_callback = progress_callback
+        self.stage_cache = stage_cache
+        # Profileur actif (traitement en arrière-plan) ou propre à ce pipeline
+        self.profiler = _active_profiler.get() or PipelineProfiler()
+        self.stage_timings = {}
+
+    def run_from_files(self, orders_file, transactions_file, journal_file):
+        """Charge les trois fichiers CSV puis exécute le pipeline"""
+        state = {
+            'orders_file': orders_file,
+            'transactions_file': transactions_file,
+            'journal_file': journal_file,
+            'restored': set(),
+        }
+        if self.stage_cache is not None:
+            self._restore_from_cache(state)
+        self._run_stage('load_files', state)
+        return self._run_stages(state)
+
+    def run(self, df_orders, df_transactions, df_journal):
+        """Exécute le pipeline sur des DataFrames déjà chargés"""
+        logger.info("1. DataFrames déjà chargés...")
+        logger.info("   - Commandes: %s lignes", len(df_orders))
+        logger.info("   - Transactions: %s lignes", len(df_transactions))
+        logger.info("   - Journal: %s lignes", len(df_journal))
+        state = {'orders': df_orders, 'transactions': df_transactions, 'journal': df_journal, 'restored': set()}
+        return self._run_stages(state)
+
+    def _run_stages(self, state):
+        for stage in self.STAGES:
+            self._run_stage(stage, state)
+        return state['final']
+
+    def _run_stage(self, stage, state):
+        if self.progress_callback:
+            self.progress_callback(stage)
+        start = time.perf_counter()
+        with self.profiler.stage(stage) as record:
+            getattr(self, f'stage_{stage}')(state)
+            if record is not None:
+                record['rows'] = {name: len(state[name]) for name in STAGE_ROW_COUNTS.get(stage, [])
+                                  if isinstance(state.get(name), pd.DataFrame)}
+        self.stage_timings[stage] = time.perf_counter() - start
+
+        # Mise en cache des résultats recalculés par cette étape
+        if 'cache_keys' in state:
+            for name in STAGE_CACHE_ARTIFACTS.get(stage, []):
+                if self._pending(state, name):
+                    self.stage_cache.save(name, state['cache_keys'][name], state[name])
+
+    def _restore_from_cache(self, state):
+        """
+        Calcule les clés des résultats intermédiaires (empreintes des fichiers, version du code,
+        stratégie d'agrégation) et relit ceux qui sont déjà en cache
+        """
+        version = self._cache_version()
+        hashes = {name: hash_file(state[f'{name}_file']) for name in ('orders', 'transactions', 'journal')}
+        keys = {name: self.stage_cache.make_key(name, version, file_hash) for name, file_hash in hashes.items()}
+        keys['merged_step1'] = self.stage_cache.make_key('merged_step1', version, hashes['orders'], hashes['transactions'])
+        state['cache_keys'] = keys
+
+        # Fusion commandes-transactions en cache: commandes et transactions sont inutiles
+        restore_order = [('merged_step1', ['orders', 'transactions', 'merged_step1']),
+                         ('orders', ['orders']), ('transactions', ['transactions']), ('journal', ['journal'])]
+        for name, covers in restore_order:
+            if name in state['restored']:
+                continue
+            df = self.stage_cache.load(name, keys[name])
+            if df is not None:
+                state[name] = df
+                state['restored'].update(covers)
+                logger.info("   - Cache d'étape: %s relu (%s lignes), recalcul évité", name, len(df))
+
+    def _cache_version(self):
+        """Version des résultats en cache: code et stratégie d'agrégation des commandes"""
+        return f"{CODE_VERSION}|{getattr(self.orders_aggregation, '__name__', repr(self.orders_aggregation))}"
+
+    def prepare_input(self, name, file_path):
+        """
+        Prépare un seul fichier d'entrée (chargement, normalisation, nettoyage et agrégation),
+        sans attendre les deux autres, et enregistre le résultat dans le cache d'étape:
+        run_from_files le relira ensuite au lieu de le recalculer. Renvoie le nombre de lignes
+        préparées, ou None si le résultat était déjà en cache.
+        """
+        key = self.stage_cache.make_key(name, self._cache_version(), hash_file(file_path))
+        if self.stage_cache.contains(name, key):
+            return None
+        state = {f'{name}_file': file_path, 'cache_keys': {name: key},
+                 'restored': {'orders', 'transactions', 'journal'} - {name}}
+        for stage in self.PREPARE_STAGES:
+            self._run_stage(stage, state)
+        return len(state[name])
+
+    @staticmethod
+    def _pending(state, name):
+        """Le résultat name reste-t-il à calculer (pas relu depuis le cache) ?"""
+        return name not in state['restored']
+
+    def stage_load_files(self, state):
+        logger.info("1. Chargement des fichiers CSV...")
+
+        # Fichiers indépendants jusqu'à la fusion: chargés, normalisés et nettoyés en parallèle
+        pending = [name for name in CSV_INPUT_SCHEMAS if self._pending(state, name)]
+        if INGEST_WORKERS > 1 and len(pending) > 1:
+            self._ingest_in_parallel(state, pending)
+            return
+
+        # Commandes et transactions: séparateur virgule, journal: séparateur point-virgule
+        # Seules les colonnes utiles sont lues, avec des types explicites
+        if self._pending(state, 'orders'):
+            state['orders'] = read_input_csv(state['orders_file'], 'orders')
+            logger.info("   - Commandes chargées: %s lignes", len(state['orders']))
+
+        if self._pending(state, 'transactions'):
+            state['transactions'] = read_input_csv(state['transactions_file'], 'transactions')
+            logger.info("   - Transactions chargées: %s lignes", len(state['transactions']))
+
+        if self._pending(state, 'journal'):
+            state['journal'] = read_input_csv(state['journal_file'], 'journal')
+            logger.info("   - Journal chargé: %s lignes", len(state['journal']))
+
+    def _ingest_in_parallel(self, state, names):
+        """
+        Chargement, normalisation et nettoyage des fichiers d'entrée dans des threads (l'analyse
+        CSV de pandas libère le GIL); normalize_columns et clean_data les sautent ensuite.
+        En cas d'erreur, celle que le traitement séquentiel aurait levée en premier
+        (étape la plus précoce, puis ordre commandes, transactions, journal).
+        """
+        with ThreadPoolExecutor(max_workers=min(INGEST_WORKERS, len(names))) as executor:
+            futures = {name: executor.submit(self._ingest_input, name, state[f'{name}_file']) for name in names}
+        results = {name: future.result() for name, future in futures.items()}
+
+        failures = []
+        for position, name in enumerate(names):
+            df, failed_step, error, profiler = results[name]
+            self.profiler.absorb(profiler)
+            if error is not None:
+                failures.append((INGEST_STEPS.index(failed_step), position, error))
+        if failures:
+            raise min(failures, key=lambda failure: failure[:2])[2]
+
+        state['ingested'] = set(names)
+        for name in names:
+            state[name] = results[name][0]
+            logger.info("   - %s chargé et nettoyé: %s lignes", CSV_INPUT_SCHEMAS[name][3].capitalize(), len(state[name]))
+
+    def _ingest_input(self, name, file_path):
+        """
+        Chargement, normalisation et nettoyage d'un seul fichier (thread d'ingestion).
+        Ne lève pas: renvoie (DataFrame, étape en échec, erreur, profileur du thread).
+        """
+        expected_columns, _, _, file_type = CSV_INPUT_SCHEMAS[name]
+        # Profileur propre au thread, fusionné ensuite dans celui du pipeline
+        profiler = PipelineProfiler('off' if self.profiler.mode == 'off' else 'basic')
+        step = 'load_files'
+        with profiler.activate(), profiler.stage(f'ingest:{name}'):
+            try:
+                df = read_input_csv(file_path, name)
+                step = 'normalize_columns'
+                with profiler.stage(f'normalize_column_names:{name}'):
+                    df = normalize_column_names(df, expected_columns, file_type)
+                validate_required_columns(df, expected_columns, file_type)
+                step = 'clean_data'
+                df = self._clean_input(name, df)
+            except Exception as e:
+                return None, step, e, profiler
+        return df, None, None, profiler
+
+    def _to_process(self, state, name):
+        """Le fichier name reste-t-il à traiter par l'étape (ni relu du cache, ni déjà ingéré) ?"""
+        return self._pending(state, name) and name not in state.get('ingested', ())
+
+    def stage_normalize_columns(self, state):
+        logger.info("2. Vérification et normalisation des colonnes...")
+
+        inputs = [('orders', REQUIRED_ORDERS_COLUMNS, "fichier des commandes"),
+                  ('transactions', REQUIRED_TRANSACTIONS_COLUMNS, "fichier des transactions"),
+                  ('journal', REQUIRED_JOURNAL_COLUMNS, "fichier journal")]
+        inputs = [(name, columns, file_type) for name, columns, file_type in inputs if self._to_process(state, name)]
+
+        for name, columns, file_type in inputs:
+            with self.profiler.stage(f'normalize_column_names:{name}'):
+                state[name] = normalize_column_names(state[name], columns, file_type)
+
+        # Valider que toutes les colonnes requises sont présentes
+        for name, columns, file_type in inputs:
+            validate_required_columns(state[name], columns, file_type)
+
+    def stage_clean_data(self, state):
+        logger.info("3. Nettoyage et formatage des données...")
+        for name in ('orders', 'transactions', 'journal'):
+            if self._to_process(state, name):
+                state[name] = self._clean_input(name, state[name])
+
+    @staticmethod
+    def _clean_input(name, df):
+        """
+        Nettoyage des colonnes de texte utilisées comme clés de jointure,
+        formatage des dates (jj/mm/aaaa, colonne entière) et des montants en type numérique
+        """
+        if name == 'orders':
+            df = clean_text_data(df, ['Name', 'Billing name', 'Financial Status', 'Payment Method'])
+            df['Fulfilled at'] = format_dates_to_french(df['Fulfilled at'])
+            for col in ['Tax 1 Value', 'Outstanding Balance']:
+                if col in df.columns:
+                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+        elif name == 'transactions':
+            df = clean_text_data(df, ['Order', 'Payment Method Name'])
+            for col in ['Presentment Amount', 'Fee', 'Net']:
+                if col in df.columns:
+                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+        elif name == 'journal':
+            df = clean_text_data(df, ['Piece', 'Référence LMB'])
+            # Montants du journal convertis une seule fois: ils restent numériques jusqu'à l'export Excel
+            for col in JOURNAL_AMOUNT_COLUMNS:
+                if col in df.columns:
+                    df[col] = parse_french_amounts(df[col])
+
+        return df
+
+    def stage_aggregate_orders(self, state):
+        # IMPORTANT: une seule ligne par commande (cas où il y a plusieurs lignes de produits par commande)
+        # Un même client peut avoir plusieurs commandes distinctes: chacune reste sur sa propre ligne
+        logger.info("3.5. Agrégation des commandes pour éviter les doublons...")
+        if not self._pending(state, 'orders'):
+            return
+        logger.info("   - Nombre de lignes avant agrégation des commandes: %s", len(state['orders']))
+
+        state['orders'] = self.orders_aggregation(state['orders'])
+
+        logger.info("   - Nombre de lignes après agrégation des commandes: %s", len(state['orders']))
+
+    def stage_aggregate_transactions(self, state):
+        logger.info("4. Agrégation des transactions par commande...")
+        if not self._pending(state, 'transactions'):
+            return
+
         # Grouper par Order et sommer les montants pour éviter les doublons
-        df_transactions_aggregated = df_transactions.groupby('Order').agg({
-            'Presentment Amount': 'sum',
-            'Fee': 'sum',
-            'Net': 'sum',
-            'Payment Method Name': 'first'  # Garder la méthode de paiement
-        }).reset_index()
-        
-        print(f"   - Transactions après agrégation: {len(df_transactions_aggregated)} lignes")
-          # ÉTAPE 5: Fusion des DataFrames
-        print("5. Fusion des DataFrames...")
-        
+        state['transactions'] = state['transactions'].groupby('Order').agg(TRANSACTION_AGGREGATIONS).reset_index()
+
+        logger.info("   - Transactions après agrégation: %s lignes", len(state['transactions']))
+
+    def stage_merge_transactions(self, state):
+        logger.info("5. Fusion des DataFrames...")
+        if not self._pending(state, 'merged_step1'):
+            return
+
         # Première fusion: Commandes + Transactions agrégées (jointure à gauche)
-        df_merged_step1 = pd.merge(df_orders, df_transactions_aggregated, 
-                                  left_on='Name', right_on='Order', how='left')
-        print(f"   - Après fusion commandes-transactions: {len(df_merged_step1)} lignes")
-        
-        # Diagnostic avant fusion avec journal
-        print("   - Diagnostic avant fusion avec journal:")
-        print(f"     * Commandes uniques dans df_merged_step1: {df_merged_step1['Name'].nunique()} ({list(df_merged_step1['Name'].unique()[:5])}...)")
-        print(f"     * Références uniques dans journal: {df_journal['Piece'].nunique()} ({list(df_journal['Piece'].unique()[:5])}...)")
-          # Vérifier les correspondances
-        commandes_dans_journal = df_merged_step1['Name'].isin(df_journal['Piece']).sum()
-        print(f"     * Commandes qui ont une correspondance dans le journal: {commandes_dans_journal}/{len(df_merged_step1)}")
-        
-        # Deuxième fusion: Résultat + Journal (jointure à gauche)
-        # TOUJOURS essayer d'améliorer les correspondances avec normalisation
-        print("DEBUG: Version 2 - Début de la logique de fusion avec journal")
-        print(f"DEBUG: Version 2 - commandes_dans_journal = {commandes_dans_journal}, len(df_merged_step1) = {len(df_merged_step1)}")
-        if commandes_dans_journal < len(df_merged_step1):  # Si pas 100% de correspondances
-            print("     🔧 [V2] Application de la normalisation des références...")
-            df_merged_step1_improved = improve_journal_matching(df_merged_step1, df_journal)
-            
-            # Utiliser les données améliorées
-            df_merged_final = df_merged_step1_improved
-        else:
-            print("     ✅ [V2] Toutes les correspondances trouvées, fusion standard")
-            # Fusion standard si toutes les correspondances sont déjà trouvées
-            df_merged_final = pd.merge(df_merged_step1, df_journal, 
-                                      left_on='Name', right_on='Piece', how='left')
-        print(f"   - Après fusion avec journal: {len(df_merged_final)} lignes")
-        
+        state['merged_step1'] = pd.merge(state['orders'], state['transactions'],
+                                         left_on='Name', right_on='Order', how='left')
+        logger.info("   - Après fusion commandes-transactions: %s lignes", len(state['merged_step1']))
+
+    def stage_merge_journal(self, state):
+        df_merged_step1 = state['merged_step1']
+        df_journal = state['journal']
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("   - Diagnostic avant fusion avec journal:")
+            logger.debug("     * Commandes uniques dans df_merged_step1: %s (%s...)", df_merged_step1['Name'].nunique(), list(df_merged_step1['Name'].unique()[:5]))
+            logger.debug("     * Références uniques dans journal: %s (%s...)", df_journal['Piece'].nunique(), list(df_journal['Piece'].unique()[:5]))
+
+        # Deuxième fusion: Résultat + Journal (jointure à gauche) selon la stratégie choisie
+        with self.profiler.stage('journal_matching'):
+            df_merged_final = self.journal_matching(df_merged_step1, df_journal)
+        logger.info("   - Après fusion avec journal: %s lignes", len(df_merged_final))
+
         # Diagnostic après fusion
         ref_lmb_non_nulles = df_merged_final['Référence LMB'].notna().sum()
-        print(f"   - Références LMB trouvées: {ref_lmb_non_nulles}/{len(df_merged_final)} ({ref_lmb_non_nulles/len(df_merged_final)*100:.1f}%)")
-          # ÉTAPE 6: Création du tableau final avec les 16 colonnes
-        print("6. Création du tableau final...")
-        
+        if len(df_merged_final) > 0:
+            logger.info("   - Références LMB trouvées: %s/%s (%.1f%%)", ref_lmb_non_nulles, len(df_merged_final), ref_lmb_non_nulles/len(df_merged_final)*100)
+
+        state['merged_final'] = df_merged_final
+
+    def stage_build_final_table(self, state):
+        # Création du tableau final avec les colonnes dans l'ordre requis
+        logger.info("6. Création du tableau final...")
+        df_merged_final = state['merged_final']
+
         df_final = pd.DataFrame()
-        
-        # Colonnes du tableau final dans l'ordre requis
         df_final['Centre de profit'] = 'lcdi.fr'  # Valeur statique
         df_final['Réf.WEB'] = df_merged_final['Name']
         df_final['Réf. LMB'] = df_merged_final['Référence LMB'].fillna('')
         df_final['Date Facture'] = calculate_invoice_dates(df_merged_final)
         df_final['Etat'] = df_merged_final['Financial Status'].fillna('').apply(translate_financial_status)
         df_final['Client'] = df_merged_final['Billing name'].fillna('')
-        
+
         # Calculs des montants
         corrected_amounts = calculate_corrected_amounts(df_merged_final)
         df_final['HT'] = corrected_amounts['HT']
@@ -1029,45 +1990,300 @@ def process_dataframes_directly(df_orders, df_transactions, df_journal):
         df_final['reste'] = df_merged_final['Outstanding Balance'].fillna(0)
         df_final['Shopify'] = df_merged_final['Net'].fillna(0)
         df_final['Frais de commission'] = df_merged_final['Fee'].fillna(0)
-        
+
         # Traitement des méthodes de paiement
-        print("7. Traitement des méthodes de paiement...")
-        payment_categorization = df_merged_final.apply(
-            lambda row: categorize_payment_method(
-                row.get('Payment Method'),  # Méthode de paiement des commandes
-                row.get('Payment Method Name'),  # Méthode de paiement des transactions (plus précise pour PayPal),
-                corrected_amounts['TTC'].loc[row.name] if row.name in corrected_amounts['TTC'].index else None,  # Utiliser le TTC calculé
-                fallback_amount=row.get('Total', 0)  # Fallback sur le montant de la commande
-            ), 
-            axis=1
-        )
-        
-        df_final['Virement bancaire'] = [pm['Virement bancaire'] for pm in payment_categorization]
-        df_final['Carte bancaire'] = [pm['Carte bancaire'] for pm in payment_categorization]
-        df_final['ALMA'] = [pm['ALMA'] for pm in payment_categorization]
-        df_final['Younited'] = [pm['Younited'] for pm in payment_categorization]
-        df_final['PayPal'] = [pm['PayPal'] for pm in payment_categorization]          # PRÉPARATION STATUT DYNAMIQUE: Créer une colonne vide pour les formules Excel
+        logger.info("7. Traitement des méthodes de paiement...")
+        with self.profiler.stage('payment_categorization'):
+            payment_categorization = categorize_payment_methods_vectorized(
+                df_merged_final.get('Payment Method'),  # Méthode de paiement des commandes
+                df_merged_final.get('Payment Method Name'),  # Méthode de paiement des transactions (plus précise pour PayPal)
+                corrected_amounts['TTC'],  # Utiliser le TTC calculé
+                fallback_amounts=df_merged_final.get('Total', 0)  # Fallback sur le montant de la commande
+            )
+
+        for category in PAYMENT_CATEGORIES:
+            df_final[category] = payment_categorization[category]
+
+        # PRÉPARATION STATUT DYNAMIQUE: Créer une colonne vide pour les formules Excel
         # Les formules seront ajoutées lors de la génération du fichier Excel
-        df_final['Statut'] = ''  # Colonne vide pour les formules
-        
-        print("8. Nettoyage final des données...")
-        
-        # Appliquer les indicateurs d'informations manquantes
-        df_final = fill_missing_data_indicators(df_final, df_merged_final)
-        
+        df_final['Statut'] = ''
+
+        state['final'] = df_final
+
+    def stage_finalize(self, state):
+        logger.info("8. Nettoyage final des données...")
+        df_final = state['final']
+
         # S'assurer que "Centre de profit" est toujours "lcdi.fr" (forcer après toutes les fusions)
         df_final['Centre de profit'] = 'lcdi.fr'
-        
-        # Indicateurs de données manquantes
-        df_final = fill_missing_data_indicators(df_final, df_merged_final)
-        
-        print(f"=== TRAITEMENT TERMINÉ ===")
-        print(f"Tableau final généré avec {len(df_final)} lignes et {len(df_final.columns)} colonnes")
-        
+
+        # Indicateurs de données manquantes et statut COMPLET/INCOMPLET (un seul passage)
+        df_final = fill_missing_data_indicators(df_final, state['merged_final'])
+
+        state['final'] = df_final
+
+# Mode en flux (exports plus grands que la mémoire): taille des blocs de lecture et
+# taille cumulée des commandes et transactions au-delà de laquelle le mode nouveau fichier
+# l'utilise (0: jamais)
+STREAMING_CHUNK_ROWS = int(os.environ.get('STREAMING_CHUNK_ROWS', 100_000))
+STREAMING_THRESHOLD_MB = int(os.environ.get('STREAMING_THRESHOLD_MB', 200))
+
+# Étapes du pipeline appliquées à chaque bloc de commandes en mode en flux
+STREAMING_ORDER_STAGES = ['clean_data', 'aggregate_orders', 'merge_transactions', 'merge_journal',
+                          'build_final_table', 'finalize']
+
+def should_stream(orders_file, transactions_file):
+    """Les fichiers sont-ils assez gros pour le mode en flux (STREAMING_THRESHOLD_MB) ?"""
+    if STREAMING_THRESHOLD_MB <= 0:
+        return False
+    size = os.path.getsize(orders_file) + os.path.getsize(transactions_file)
+    return size > STREAMING_THRESHOLD_MB * 1024 * 1024
+
+def combine_transaction_aggregates(partials):
+    """Fusionne des agrégats partiels de transactions (une ligne par commande et par bloc)"""
+    if not partials:
+        return pd.DataFrame(columns=['Order'] + list(TRANSACTION_AGGREGATIONS))
+    return pd.concat(partials, ignore_index=True).groupby('Order').agg(TRANSACTION_AGGREGATIONS).reset_index()
+
+def concat_chunks(first, second):
+    """
+    Concatène deux blocs consécutifs d'un même fichier. Une colonne entièrement vide dans
+    un bloc (lue en float64) prend d'abord le type texte ou décimal de l'autre bloc, ce que
+    pandas fait aujourd'hui implicitement avec un FutureWarning (blocs vides ou colonnes
+    toutes NA exclues du calcul des types)
+    """
+    def empty_column_types(frame, other):
+        empty = frame.columns[frame.isna().all().to_numpy()]
+        return {col: other[col].dtype for col in empty
+                if col in other.columns and other[col].dtype.kind in 'Of'
+                and other[col].dtype != frame[col].dtype and other[col].notna().any()}
+
+    return pd.concat([first.astype(empty_column_types(first, second)),
+                      second.astype(empty_column_types(second, first))], ignore_index=True)
+
+def iter_complete_orders(chunks):
+    """
+    Blocs de commandes complètes: les lignes de la dernière commande d'un bloc, qui peut
+    continuer dans le bloc suivant, sont reportées sur celui-ci (lignes d'une même commande
+    consécutives, comme dans l'export Shopify)
+    """
+    carry = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = concat_chunks(carry, chunk)
+        is_last_order = chunk['Name'].eq(chunk['Name'].iloc[-1]).to_numpy()
+        carry = chunk[is_last_order].copy()
+        if not is_last_order.all():
+            yield chunk[~is_last_order].copy()
+    if carry is not None:
+        yield carry
+
+class StreamingBillingPipeline:
+    """
+    Variante en flux du pipeline, pour les exports plus grands que la mémoire:
+    1. journal (le plus petit fichier) chargé en entier et nettoyé
+    2. transactions lues par blocs et agrégées par commande au fil de la lecture
+    3. premier passage léger sur les commandes (références et Total): choix du rapprochement
+       exact ou normalisé, comme match_journal_with_normalization, puis index du journal
+       construit une seule fois (build_journal_index)
+    4. commandes lues par blocs: nettoyage, agrégation, fusions, tableau final, puis écriture
+       du bloc dans le classeur (ExcelStreamWriter)
+    Les étapes de chaque bloc sont celles de BillingPipeline. La mémoire est bornée par la
+    taille des blocs, plus le journal et l'agrégat des transactions (une ligne par commande).
+    """
+
+    def __init__(self, chunk_size=None, progress_callback=None):
+        self.chunk_size = chunk_size or STREAMING_CHUNK_ROWS
+        self.progress_callback = progress_callback
+        self.profiler = _active_profiler.get() or PipelineProfiler()
+        # Étapes appliquées aux blocs: mesurées globalement, pas bloc par bloc
+        self.chunk_pipeline = BillingPipeline()
+        self.chunk_pipeline.profiler = PipelineProfiler('off')
+
+    @contextlib.contextmanager
+    def _stage(self, step, name):
+        if self.progress_callback:
+            self.progress_callback(step)
+        with self.profiler.stage(name) as record:
+            yield record
+
+    def _read_chunks(self, file_path, input_type):
+        """Blocs d'un fichier d'entrée aux colonnes normalisées et validées"""
+        expected_columns, _, _, file_type = CSV_INPUT_SCHEMAS[input_type]
+        for chunk in iter_input_csv(file_path, input_type, self.chunk_size):
+            chunk = normalize_column_names(chunk, expected_columns, file_type)
+            validate_required_columns(chunk, expected_columns, file_type)
+            yield chunk
+
+    def load_journal(self, journal_file):
+        """Journal chargé, normalisé et nettoyé comme dans BillingPipeline"""
+        state = {'journal': read_input_csv(journal_file, 'journal'), 'restored': {'orders', 'transactions'}}
+        self.chunk_pipeline.stage_normalize_columns(state)
+        self.chunk_pipeline.stage_clean_data(state)
+        return state['journal']
+
+    def aggregate_transactions(self, transactions_file):
+        """
+        Agrégat des transactions par commande, calculé bloc par bloc. Les agrégats partiels
+        sont regroupés dès que leur taille dépasse celle du dernier regroupement (coût linéaire).
+        """
+        partials = []
+        pending_rows = 0
+        compacted_rows = 0
+        for chunk in self._read_chunks(transactions_file, 'transactions'):
+            state = {'transactions': chunk, 'restored': {'orders', 'journal'}}
+            self.chunk_pipeline.stage_clean_data(state)
+            self.chunk_pipeline.stage_aggregate_transactions(state)
+            partials.append(state['transactions'])
+            pending_rows += len(state['transactions'])
+            if pending_rows > max(self.chunk_size, compacted_rows):
+                partials = [combine_transaction_aggregates(partials)]
+                pending_rows = compacted_rows = len(partials[0])
+        return combine_transaction_aggregates(partials)
+
+    def build_journal_matching(self, orders_file, df_journal):
+        """
+        Stratégie de rapprochement des blocs, décidée sur l'ensemble des commandes:
+        fusion exacte si toutes les références sont dans le journal, sinon index du journal
+        normalisé (références multiples réparties au prorata du Total des commandes)
+        """
+        pieces = df_journal['Piece']
+        piece_str = pieces[pieces.notna()].astype(str).str.strip()
+        multi_numbers = piece_str[piece_str.str.contains(' ', regex=False)].str.extractall(r'LCDI-(\d+)')[0]
+        multi_keys = set('#LCDI-' + multi_numbers)
+
+        all_exact = True
+        totals = []
+        seen = set()
+        for chunk in self._read_chunks(orders_file, 'orders'):
+            names = chunk['Name'].astype(str).str.strip()
+            all_exact = all_exact and bool(names.isin(pieces).all())
+            if multi_keys and 'Total' in chunk.columns:
+                # Total de la première ligne de chaque commande citée par une référence multiple
+                first_lines = pd.DataFrame({'Name_normalized': normalize_order_names(names),
+                                            'Total': chunk['Total']}).drop_duplicates('Name_normalized')
+                first_lines = first_lines[first_lines['Name_normalized'].isin(multi_keys - seen)]
+                seen.update(first_lines['Name_normalized'])
+                totals.append(first_lines)
+
+        if all_exact:
+            logger.info("     ✅ Toutes les correspondances trouvées, fusion standard")
+            return match_journal_exact
+
+        logger.info("     🔧 Application de la normalisation des références...")
+        df_totals = pd.concat(totals, ignore_index=True) if totals else pd.DataFrame(columns=['Name_normalized'])
+        journal_index = build_journal_index(df_totals, df_journal)
+
+        def match_journal_with_index(df_merged_step1, df_journal):
+            df_merged_step1['Name_normalized'] = normalize_order_names(df_merged_step1['Name'])
+            return join_journal_index(df_merged_step1, journal_index)
+
+        return match_journal_with_index
+
+    def process_orders_chunk(self, df_orders, df_transactions, df_journal):
+        """Tableau final d'un bloc de commandes complètes (étapes de BillingPipeline)"""
+        state = {'orders': df_orders, 'transactions': df_transactions, 'journal': df_journal,
+                 'restored': {'transactions', 'journal'}}
+        for stage in STREAMING_ORDER_STAGES:
+            getattr(self.chunk_pipeline, f'stage_{stage}')(state)
+        return state['final']
+
+    def run_to_file(self, orders_file, transactions_file, journal_file, output_path, missing_highlight=None):
+        """
+        Exécute le pipeline en flux et écrit le tableau bloc par bloc dans le classeur
+        (CSV si openpyxl n'est pas disponible). Renvoie (chemin, is_excel, nombre de lignes).
+        """
+        with self._stage('load_files', 'load_journal') as record:
+            df_journal = self.load_journal(journal_file)
+            if record is not None:
+                record['rows'] = {'journal': len(df_journal)}
+
+        with self._stage('aggregate_transactions', 'aggregate_transactions') as record:
+            df_transactions = self.aggregate_transactions(transactions_file)
+            if record is not None:
+                record['rows'] = {'transactions': len(df_transactions)}
+        logger.info("   - Transactions agrégées en flux: %s commandes", len(df_transactions))
+
+        with self._stage('merge_journal', 'index_journal'):
+            self.chunk_pipeline.journal_matching = self.build_journal_matching(orders_file, df_journal)
+
+        try:
+            import openpyxl
+            writer = ExcelStreamWriter(output_path.replace('.csv', '.xlsx'), missing_highlight)
+            is_excel = True
+        except ImportError:
+            logger.warning("⚠️ openpyxl non disponible, sauvegarde en CSV")
+            writer = CsvStreamWriter(output_path)
+            is_excel = False
+
+        with self._stage('build_final_table', 'stream_orders') as record:
+            chunks = 0
+            for df_orders in iter_complete_orders(self._read_chunks(orders_file, 'orders')):
+                writer.append(self.process_orders_chunk(df_orders, df_transactions, df_journal))
+                chunks += 1
+                logger.info("   - Bloc %s écrit (%s lignes au total)", chunks, writer.n_rows)
+            if record is not None:
+                record['rows'] = {'final': writer.n_rows}
+                record['chunks'] = chunks
+
+        with self._stage('excel', 'excel'):
+            final_path = writer.close()
+        return final_path, is_excel, writer.n_rows
+
+class CsvStreamWriter:
+    """Écriture CSV bloc par bloc (mode en flux sans openpyxl), même format que l'export CSV"""
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.n_rows = 0
+        self.started = False
+
+    def append(self, df_chunk):
+        first = not self.started
+        df_chunk.to_csv(self.output_path, sep=';', decimal=',', index=False,
+                        mode='w' if first else 'a', header=first, encoding='utf-8-sig' if first else 'utf-8')
+        self.started = True
+        self.n_rows += len(df_chunk)
+
+    def close(self):
+        return self.output_path
+
+def generate_consolidated_billing_table(orders_file, transactions_file, journal_file, progress_callback=None):
+    """
+    Fonction principale pour générer le tableau de facturation consolidé
+    progress_callback(stage): appelé au début de chaque étape du pipeline (optionnel)
+    """
+    try:
+        logger.info("=== DÉBUT DU TRAITEMENT ===")
+        pipeline = BillingPipeline(progress_callback=progress_callback, stage_cache=stage_cache)
+        df_final = pipeline.run_from_files(orders_file, transactions_file, journal_file)
+
+        logger.info("=== TRAITEMENT TERMINÉ ===")
+        logger.info("Tableau final généré avec %s lignes et %s colonnes", len(df_final), len(df_final.columns))
+
         return df_final
-        
+
+    except Exception as e:
+        logger.error("ERREUR lors du traitement: %s", e)
+        raise e
+
+def process_dataframes_directly(df_orders, df_transactions, df_journal):
+    """
+    Fonction auxiliaire pour traiter directement des DataFrames (utilisée pour les tests)
+    """
+    try:
+        logger.info("=== DÉBUT DU TRAITEMENT (DataFrames) ===")
+        df_final = BillingPipeline().run(df_orders, df_transactions, df_journal)
+
+        logger.info("=== TRAITEMENT TERMINÉ ===")
+        logger.info("Tableau final généré avec %s lignes et %s colonnes", len(df_final), len(df_final.columns))
+
+        return df_final
+
     except Exception as e:
-        print(f"ERREUR lors du traitement: {str(e)}")
+        logger.error("ERREUR lors du traitement: %s", e)
         raise e
 
 def process_dataframes_with_normalization(df_orders, df_transactions, df_journal):
@@ -1075,209 +2291,20 @@ def process_dataframes_with_normalization(df_orders, df_transactions, df_journal
     Version améliorée qui utilise toujours la normalisation des références
     """
     try:
-        print("=== DÉBUT DU TRAITEMENT AVEC NORMALISATION ===")
-        
-        # ÉTAPE 1: Les DataFrames sont déjà chargés
-        print("1. DataFrames déjà chargés...")
-        print(f"   - Commandes: {len(df_orders)} lignes")
-        print(f"   - Transactions: {len(df_transactions)} lignes")
-        print(f"   - Journal: {len(df_journal)} lignes")
-          # ÉTAPE 2: Vérification et normalisation des colonnes
-        print("2. Vérification et normalisation des colonnes...")
-          # Définir les colonnes requises
-        required_orders_cols = ['Name', 'Fulfilled at', 'Billing name', 'Financial Status', 'Tax 1 Value', 'Outstanding Balance', 'Payment Method', 'Total', 'Taxes']
-        required_transactions_cols = ['Order', 'Presentment Amount', 'Fee', 'Net', 'Payment Method Name']
-        required_journal_cols = ['Piece', 'Référence LMB']
-          # Normaliser les noms de colonnes pour les commandes
-        df_orders = normalize_column_names(df_orders, required_orders_cols, 'commandes')
-        validate_required_columns(df_orders, required_orders_cols, "fichier des commandes")
-        
-        # Normaliser les noms de colonnes pour les transactions
-        df_transactions = normalize_column_names(df_transactions, required_transactions_cols, 'transactions')
-        validate_required_columns(df_transactions, required_transactions_cols, "fichier des transactions")
-        
-        # Normaliser les noms de colonnes pour le journal
-        df_journal = normalize_column_names(df_journal, required_journal_cols, 'journal')
-        validate_required_columns(df_journal, required_journal_cols, "fichier journal")
-        
-        # ÉTAPE 3: Nettoyage et formatage des données
-        print("3. Nettoyage et formatage des données...")
-        
-        # Nettoyage des colonnes de texte utilisées comme clés de jointure
-        df_orders = clean_text_data(df_orders, ['Name', 'Billing name', 'Financial Status', 'Payment Method'])
-        df_transactions = clean_text_data(df_transactions, ['Order', 'Payment Method Name'])
-        df_journal = clean_text_data(df_journal, ['Piece', 'Référence LMB'])
-        
-        # Formatage des dates - conversion en format français jj/mm/aaaa
-        df_orders['Fulfilled at'] = df_orders['Fulfilled at'].apply(format_date_to_french)
-        
-        # Formatage des colonnes monétaires en type numérique
-        monetary_cols_orders = ['Tax 1 Value', 'Outstanding Balance']
-        monetary_cols_transactions = ['Presentment Amount', 'Fee', 'Net']
-        
-        for col in monetary_cols_orders:
-            if col in df_orders.columns:
-                df_orders[col] = pd.to_numeric(df_orders[col], errors='coerce').fillna(0)
-        
-        for col in monetary_cols_transactions:
-            if col in df_transactions.columns:
-                df_transactions[col] = pd.to_numeric(df_transactions[col], errors='coerce').fillna(0)
-        
-        # ÉTAPE 3.5: Agrégation des commandes pour éviter les doublons
-        print("3.5. Agrégation des commandes pour éviter les doublons...")
-        print(f"   - Nombre de lignes avant agrégation des commandes: {len(df_orders)}")
-        
-        # Définir les colonnes pour l'agrégation
-        first_cols = ['Fulfilled at', 'Billing name', 'Financial Status', 'Payment Method', 'Email', 'Lineitem name']
-        sum_cols = ['Tax 1 Value', 'Outstanding Balance']
-        
-        # Construire le dictionnaire d'opérations d'agrégation
-        agg_operations = {}
-        
-        # Détecter automatiquement les colonnes numériques pour la sommation
-        for col in df_orders.columns:
-            if col not in first_cols and col != 'Name':  # Name est la clé de groupement
-                if df_orders[col].dtype in ['int64', 'float64'] or pd.api.types.is_numeric_dtype(df_orders[col]):
-                    if col not in sum_cols:
-                        sum_cols.append(col)
-                        print(f"   - Colonne numérique détectée pour sommation: {col}")
-                elif col not in first_cols:
-                    first_cols.append(col)
-        
-        # Configurer les opérations d'agrégation
-        for col in first_cols:
-            if col in df_orders.columns:
-                agg_operations[col] = 'first'
-        
-        # Pour les colonnes monétaires, faire la somme
-        for col in sum_cols:
-            if col in df_orders.columns:
-                agg_operations[col] = 'sum'
-        
-        # Grouper par Name (identifiant unique de la commande)
-        if agg_operations:
-            df_orders_aggregated = df_orders.drop_duplicates(subset=['Name'], keep='first')
-        else:
-            # Si pas d'opérations d'agrégation, juste dédupliquer
-            df_orders_aggregated = df_orders.drop_duplicates(subset=['Name'], keep='first')
-        
-        print(f"   - Nombre de lignes après agrégation des commandes: {len(df_orders_aggregated)}")
-        
-        # Note: Un même client peut avoir plusieurs commandes distinctes
-        # Chaque commande doit apparaître sur une ligne séparée
-        
-        # Remplacer df_orders par la version agrégée
-        df_orders = df_orders_aggregated
-        
-        # ÉTAPE 4: Agrégation des transactions par commande
-        print("4. Agrégation des transactions par commande...")
-        
-        # Grouper par Order et sommer les montants pour éviter les doublons
-        df_transactions_aggregated = df_transactions.groupby('Order').agg({
-            'Presentment Amount': 'sum',
-            'Fee': 'sum',
-            'Net': 'sum',
-            'Payment Method Name': 'first'  # Garder la méthode de paiement
-        }).reset_index()
-        
-        print(f"   - Transactions après agrégation: {len(df_transactions_aggregated)} lignes")
-          # ÉTAPE 5: Fusion des DataFrames
-        print("5. Fusion des DataFrames...")
-        
-        # Première fusion: Commandes + Transactions agrégées (jointure à gauche)
-        df_merged_step1 = pd.merge(df_orders, df_transactions_aggregated, 
-                                  left_on='Name', right_on='Order', how='left')
-        print(f"   - Après fusion commandes-transactions: {len(df_merged_step1)} lignes")
-        
-        # Diagnostic avant fusion avec journal
-        print("   - Diagnostic avant fusion avec journal:")
-        print(f"     * Commandes uniques dans df_merged_step1: {df_merged_step1['Name'].nunique()} ({list(df_merged_step1['Name'].unique()[:5])}...)")
-        print(f"     * Références uniques dans journal: {df_journal['Piece'].nunique()} ({list(df_journal['Piece'].unique()[:5])}...)")
-          # Vérifier les correspondances
-        commandes_dans_journal = df_merged_step1['Name'].isin(df_journal['Piece']).sum()
-        print(f"     * Commandes qui ont une correspondance dans le journal: {commandes_dans_journal}/{len(df_merged_step1)}")
-        
-        # Deuxième fusion: Résultat + Journal (jointure à gauche)
-        # TOUJOURS essayer d'améliorer les correspondances avec normalisation
-        print("DEBUG: Version 2 - Début de la logique de fusion avec journal")
-        print(f"DEBUG: Version 2 - commandes_dans_journal = {commandes_dans_journal}, len(df_merged_step1) = {len(df_merged_step1)}")
-        if commandes_dans_journal < len(df_merged_step1):  # Si pas 100% de correspondances
-            print("     🔧 [V2] Application de la normalisation des références...")
-            df_merged_step1_improved = improve_journal_matching(df_merged_step1, df_journal)
-            
-            # Utiliser les données améliorées
-            df_merged_final = df_merged_step1_improved
-        else:
-            print("     ✅ [V2] Toutes les correspondances trouvées, fusion standard")
-            # Fusion standard si toutes les correspondances sont déjà trouvées
-            df_merged_final = pd.merge(df_merged_step1, df_journal, 
-                                      left_on='Name', right_on='Piece', how='left')
-        print(f"   - Après fusion avec journal: {len(df_merged_final)} lignes")
-        
-        # Diagnostic après fusion
-        ref_lmb_non_nulles = df_merged_final['Référence LMB'].notna().sum()
-        print(f"   - Références LMB trouvées: {ref_lmb_non_nulles}/{len(df_merged_final)} ({ref_lmb_non_nulles/len(df_merged_final)*100:.1f}%)")
-          # ÉTAPE 6: Création du tableau final avec les 16 colonnes
-        print("6. Création du tableau final...")
-        
-        df_final = pd.DataFrame()
-        
-        # Colonnes du tableau final dans l'ordre requis
-        df_final['Centre de profit'] = 'lcdi.fr'  # Valeur statique
-        df_final['Réf.WEB'] = df_merged_final['Name']
-        df_final['Réf. LMB'] = df_merged_final['Référence LMB'].fillna('')
-        df_final['Date Facture'] = calculate_invoice_dates(df_merged_final)
-        df_final['Etat'] = df_merged_final['Financial Status'].fillna('').apply(translate_financial_status)
-        df_final['Client'] = df_merged_final['Billing name'].fillna('')
-          # Calculs des montants
-        corrected_amounts = calculate_corrected_amounts(df_merged_final)
-        df_final['HT'] = corrected_amounts['HT']
-        df_final['TVA'] = corrected_amounts['TVA']
-        df_final['TTC'] = corrected_amounts['TTC']
-        df_final['reste'] = df_merged_final['Outstanding Balance'].fillna(0)
-        df_final['Shopify'] = df_merged_final['Net'].fillna(0)
-        df_final['Frais de commission'] = df_merged_final['Fee'].fillna(0)
-        
-        # Traitement des méthodes de paiement
-        print("7. Traitement des méthodes de paiement...")
-        payment_categorization = df_merged_final.apply(
-            lambda row: categorize_payment_method(
-                row.get('Payment Method'),  # Méthode de paiement des commandes
-                row.get('Payment Method Name'),  # Méthode de paiement des transactions (plus précise pour PayPal),
-                corrected_amounts['TTC'].loc[row.name] if row.name in corrected_amounts['TTC'].index else None,  # Utiliser le TTC calculé
-                fallback_amount=row.get('Total', 0)  # Fallback sur le montant de la commande
-            ), 
-            axis=1
-        )
-        
-        df_final['Virement bancaire'] = [pm['Virement bancaire'] for pm in payment_categorization]
-        df_final['Carte bancaire'] = [pm['Carte bancaire'] for pm in payment_categorization]
-        df_final['ALMA'] = [pm['ALMA'] for pm in payment_categorization]
-        df_final['Younited'] = [pm['Younited'] for pm in payment_categorization]
-        df_final['PayPal'] = [pm['PayPal'] for pm in payment_categorization]          # PRÉPARATION STATUT DYNAMIQUE: Créer une colonne vide pour les formules Excel
-        # Les formules seront ajoutées lors de la génération du fichier Excel
-        df_final['Statut'] = ''  # Colonne vide pour les formules
-        
-        print("8. Nettoyage final des données...")
-        
-        # Appliquer les indicateurs d'informations manquantes
-        df_final = fill_missing_data_indicators(df_final, df_merged_final)
-        
-        # S'assurer que "Centre de profit" est toujours "lcdi.fr" (forcer après toutes les fusions)
-        df_final['Centre de profit'] = 'lcdi.fr'
-        
-        # Indicateurs de données manquantes
-        df_final = fill_missing_data_indicators(df_final, df_merged_final)
-        
-        print(f"=== TRAITEMENT TERMINÉ ===")
-        print(f"Tableau final généré avec {len(df_final)} lignes et {len(df_final.columns)} colonnes")
-        
+        logger.info("=== DÉBUT DU TRAITEMENT AVEC NORMALISATION ===")
+        pipeline = BillingPipeline(journal_matching=match_journal_with_normalization)
+        df_final = pipeline.run(df_orders, df_transactions, df_journal)
+
+        logger.info("=== TRAITEMENT TERMINÉ ===")
+        logger.info("Tableau final généré avec %s lignes et %s colonnes", len(df_final), len(df_final.columns))
+
         return df_final
-        
+
     except Exception as e:
-        print(f"ERREUR lors du traitement: {str(e)}")
+        logger.error("ERREUR lors du traitement: %s", e)
         raise e
 
+
 def translate_financial_status(status):
     """
     Traduit les statuts financiers anglais en français
@@ -1348,354 +2375,1028 @@ def normalize_reference_with_multiples(ref):
     
     return [ref_str]
 
+def normalize_order_names(names):
+    """Normalise les références des commandes au format #LCDI-XXXX (vectorisé)"""
+    names_str = names.astype(str)
+    normalized = names_str.where(names_str.str.startswith('#'), '#' + names_str)
+    return normalized.where(names.notna(), None)
+
+def build_journal_index(df_orders_normalized, df_journal, journal_ref_col='Piece'):
+    """
+    Construit l'index du journal: référence normalisée (#LCDI-XXXX) -> ligne du journal.
+    - Références simples: normalisées avec un '#' en tête
+    - Références multiples ('LCDI-1020 LCDI-1021'): extraites avec str.extractall puis éclatées
+      en une ligne par commande, avec les montants répartis au prorata du Total des commandes
+      (ou à parts égales si les totaux ne sont pas exploitables)
+    En cas de doublon, la dernière ligne du journal l'emporte.
+    Retourne un DataFrame indexé par la référence normalisée, avec les colonnes du journal.
+    """
+    df_journal = df_journal.reset_index(drop=True)
+    for col in JOURNAL_AMOUNT_COLUMNS:
+        if col in df_journal.columns:
+            df_journal[col] = parse_french_amounts(df_journal[col])
+
+    pieces = df_journal[journal_ref_col]
+    piece_str = pieces[pieces.notna()].astype(str).str.strip()
+    is_multi = piece_str.str.contains(' ', regex=False)
+
+    # Cas 1: Références simples (ex: LCDI-1038 ou #LCDI-1038)
+    simple = piece_str[~is_multi]
+    simple_entries = pd.DataFrame({
+        '_position': simple.index,
+        '_match': 0,
+        '_key': simple.where(simple.str.startswith('#'), '#' + simple).values,
+    })
+
+    # Cas 2: Références multiples (ex: LCDI-1020 LCDI-1021) -> une ligne par commande
+    numbers = piece_str[is_multi].str.extractall(r'LCDI-(\d+)')[0]
+    multi_entries = pd.DataFrame({
+        '_position': numbers.index.get_level_values(0),
+        '_match': numbers.index.get_level_values(1),
+        '_key': ('#LCDI-' + numbers).values,
+    })
+
+    if not multi_entries.empty:
+        logger.info("     - %s références multiples détectées -> %s commandes", multi_entries['_position'].nunique(), len(multi_entries))
+
+        # Totaux des commandes concernées (première commande trouvée pour chaque référence)
+        if 'Total' in df_orders_normalized.columns:
+            first_orders = df_orders_normalized.drop_duplicates(subset=['Name_normalized'], keep='first')
+            order_totals = pd.Series(
+                pd.to_numeric(first_orders['Total'], errors='coerce').values,
+                index=first_orders['Name_normalized'].values
+            )
+        else:
+            order_totals = pd.Series(dtype=float)
+        command_totals = multi_entries['_key'].map(order_totals).fillna(0)
+
+        # Proportion de chaque commande, une seule règle par ligne du journal: prorata des Totals
+        # positifs dès que leur somme est positive (une commande absente de l'export ou sans
+        # Total reçoit 0, le montant entier va aux commandes présentes), sinon parts égales
+        positive_totals = command_totals.clip(lower=0)
+        grouped = positive_totals.groupby(multi_entries['_position'])
+        positive_sum = grouped.transform('sum')
+        n_refs = grouped.transform('size')
+        proportions = (positive_totals / positive_sum).where(positive_sum > 0, 1.0 / n_refs)
+
+        # Répartir les montants du journal au centime près (la somme des parts = montant du journal)
+        multi_rows = df_journal.iloc[multi_entries['_position']].reset_index(drop=True)
+        for col in JOURNAL_AMOUNT_COLUMNS:
+            if col in multi_rows.columns:
+                multi_rows[col] = allocate_cents(multi_rows[col], proportions, multi_entries['_position'])
+    else:
+        multi_rows = df_journal.iloc[[]]
+
+    simple_rows = df_journal.iloc[simple_entries['_position']].reset_index(drop=True)
+    journal_rows = pd.concat([simple_rows, multi_rows], ignore_index=True)
+    entries = pd.concat([simple_entries, multi_entries], ignore_index=True)
+
+    # Ordre du journal respecté: la dernière ligne pour une référence donnée l'emporte
+    order = entries.sort_values(['_position', '_match'], kind='stable').index
+    entries = entries.loc[order]
+    journal_rows = journal_rows.loc[order]
+    keep = ~entries['_key'].duplicated(keep='last').values
+
+    journal_index = journal_rows[keep]
+    journal_index.index = pd.Index(entries['_key'].values[keep], name='_key')
+    return journal_index
+
+def join_journal_index(df_orders_normalized, journal_index):
+    """
+    Rattache les lignes du journal indexé (build_journal_index) aux commandes:
+    jointure à gauche sur la référence normalisée (colonne Name_normalized)
+    """
+    df_journal_mapped = df_orders_normalized[['Name_normalized']].merge(
+        journal_index, how='left', left_on='Name_normalized', right_index=True
+    ).drop(columns=['Name_normalized'])
+    df_journal_mapped.index = df_orders_normalized.index
+
+    # Concaténer horizontalement
+    return pd.concat([df_orders_normalized, df_journal_mapped], axis=1)
+
 def improve_journal_matching(df_orders, df_journal):
     """
     Fusion améliorée avec gestion des références multiples
     Gère les formats #LCDI-XXXX vs LCDI-XXXX et les références multiples comme 'LCDI-1020 LCDI-1021'
+    Le journal est indexé une seule fois par référence normalisée (build_journal_index),
+    puis rattaché aux commandes par une seule jointure.
     """
-    print("   - Fusion avec normalisation et gestion des références multiples...")
-    
-    # Copier les DataFrames pour éviter de modifier les originaux
-    df_orders_copy = df_orders.copy()
-    df_journal_copy = df_journal.copy()
-    
+    logger.info("   - Fusion avec normalisation et gestion des références multiples...")
+
     # Trouver la colonne de référence dans le journal (peut être 'Piece' après normalisation)
     journal_ref_col = 'Piece'  # Nom standardisé après normalize_column_names
-    
-    if journal_ref_col not in df_journal_copy.columns:
-        print(f"❌ Erreur: Colonne '{journal_ref_col}' non trouvée dans le journal")
-        print(f"Colonnes disponibles: {list(df_journal_copy.columns)}")
+
+    df_orders_copy = df_orders.copy()
+    if journal_ref_col not in df_journal.columns:
+        logger.error("❌ Erreur: Colonne '%s' non trouvée dans le journal", journal_ref_col)
+        logger.info("Colonnes disponibles: %s", list(df_journal.columns))
         return df_orders_copy  # Retourner les commandes sans fusion
-    
+
     # Normaliser les références des commandes : toujours au format #LCDI-XXXX
-    df_orders_copy['Name_normalized'] = df_orders_copy['Name'].apply(
-        lambda x: x if str(x).startswith('#') else f"#{x}" if pd.notna(x) else None
-    )
+    df_orders_copy['Name_normalized'] = normalize_order_names(df_orders_copy['Name'])
+
+    journal_index = build_journal_index(df_orders_copy, df_journal, journal_ref_col)
+    df_merged = join_journal_index(df_orders_copy, journal_index)
+
+    # Compter les correspondances
+    correspondances = df_merged['Référence LMB'].notna().sum()
+    total = len(df_merged)
+
+    if total > 0:
+        logger.info("     - Correspondances trouvées : %s/%s (%.1f%%)", correspondances, total, correspondances/total*100)
+
+    return df_merged
+
+def compute_completeness_status(df_final):
+    """
+    Statut COMPLET/INCOMPLET de chaque ligne, calculé par masques sur les colonnes entières,
+    avec la même règle que la formule Excel (build_statut_formula), pour que l'export CSV,
+    le registre et le classeur donnent le même statut:
+    - une référence LMB (cellule non vide)
+    - un reste à payer nul (cellule vide comptée comme 0, comme dans Excel)
+    Sans colonne 'Réf. LMB' ou 'reste', toutes les lignes sont INCOMPLET (comme l'export Excel).
+    """
+    if 'Réf. LMB' not in df_final.columns or 'reste' not in df_final.columns:
+        return pd.Series('INCOMPLET', index=df_final.index, dtype=object)
+
+    # Cellules écrites vides dans le classeur: NaN/None et chaînes vides
+    has_lmb = ~(df_final['Réf. LMB'].isna() | df_final['Réf. LMB'].eq(''))
+    reste = df_final['reste']
+    reste_blank = reste.isna() | reste.eq('')
+    # Texte non numérique: différent de 0 pour Excel
+    reste_zero = reste_blank | pd.to_numeric(reste, errors='coerce').eq(0)
+
+    return pd.Series(np.where(has_lmb & reste_zero, 'COMPLET', 'INCOMPLET'),
+                     index=df_final.index, dtype=object)
+
+def fill_missing_data_indicators(df_final, df_merged_final):
+    """
+    Ajoute une colonne de statut simple : COMPLET ou INCOMPLET (compute_completeness_status)
+    Laisse les cellules vides sans marqueur pour les montants principaux (HT, TVA, TTC)
+    afin que le formatage conditionnel rouge s'applique.
+    Le statut calculé reste dans le DataFrame (export CSV, API); l'export Excel le
+    remplace par une formule dynamique.
+    """
+    # 1. Nettoyer SEULEMENT les colonnes numériques secondaires (pas HT, TVA, TTC, ni les méthodes de paiement)
+    # Les colonnes HT, TVA, TTC gardent leurs NaN pour le formatage conditionnel rouge
+    # Les colonnes de méthodes de paiement gardent leurs valeurs calculées
+    secondary_numeric_columns = ['reste', 'Shopify', 'Frais de commission']
     
-    # Créer un dictionnaire de mapping : référence normalisée -> données journal
-    journal_mapping = {}
+    for col in secondary_numeric_columns:
+        if col in df_final.columns:
+            df_final[col] = df_final[col].fillna(0)
+
+    # 2. Déterminer le statut : COMPLET ou INCOMPLET
+    df_final['Statut'] = compute_completeness_status(df_final)
+    logger.debug("Statut calculé: %s lignes COMPLET sur %s", (df_final['Statut'] == 'COMPLET').sum(), len(df_final))
+    logger.debug("Cellules NaN conservées pour formatage rouge - HT, TVA, TTC")
+    logger.debug("Cellules conservées (valeurs calculées) - Virement bancaire, ALMA, Younited, PayPal")
+    logger.debug("Cellules nettoyées (NaN->0) - colonnes secondaires: %s", secondary_numeric_columns)
     
-    # Pour chaque ligne du journal
-    for journal_idx, journal_row in df_journal_copy.iterrows():
-        journal_ref = journal_row[journal_ref_col]
-        if pd.isna(journal_ref):
+    return df_final
+
+# Valeurs texte considérées comme vides lors de la combinaison avec un ancien fichier
+EMPTY_CELL_STRINGS = ['nan', 'null', 'none', '<na>']
+
+def empty_cell_mask(values):
+    """
+    Masque des cellules vides au sens de la combinaison: NaN/NA, chaîne vide ou blanche,
+    zéro numérique, ou texte 'nan'/'null'/'none'/'<na>' (sans distinction de casse)
+    """
+    missing = values.isna().to_numpy()
+    text = values.astype(str)
+    empty = missing | (text.str.strip() == '').to_numpy() | text.str.lower().isin(EMPTY_CELL_STRINGS).to_numpy()
+
+    # Zéro numérique seulement ('0' en texte n'est pas vide); NA exclus de la comparaison
+    raw = values.to_numpy(dtype=object)
+    present = ~missing
+    is_zero = np.zeros(len(values), dtype=bool)
+    is_zero[present] = raw[present] == 0
+    return empty | is_zero
+
+def resolve_conflicting_rows(old_aligned, new_aligned, columns):
+    """
+    Résout les conflits entre lignes alignées par Réf.WEB (index commun), colonne par colonne:
+    - ancienne valeur vide (empty_cell_mask) et nouvelle renseignée: la nouvelle complète l'ancienne
+    - deux valeurs renseignées et différentes: l'ancienne est conservée
+    Renvoie ({colonne: valeurs de complément indexées par Réf.WEB}, conflits résolus, cellules complétées)
+    """
+    fills = {}
+    conflicts_resolved = 0
+    data_completed = 0
+    for col in columns:
+        if col == 'Réf.WEB':  # Ne pas modifier la référence
             continue
-            
-        journal_ref_str = str(journal_ref).strip()
+        old_values = old_aligned[col]
+        new_values = new_aligned[col]
+
+        # Ancienne valeur manquante/vide, nouvelle valeur porteuse de données
+        old_is_empty = empty_cell_mask(old_values)
+        new_has_data = ~empty_cell_mask(new_values)
+
+        # Si l'ancien est vide et le nouveau a des données, on complète
+        completed = old_is_empty & new_has_data
+        # Conflit réel (valeurs différentes) : priorité à l'ancien
+        both_filled = ~old_is_empty & new_has_data
+        conflicting = np.zeros(len(old_values), dtype=bool)
+        conflicting[both_filled] = (old_values.to_numpy(dtype=object)[both_filled]
+                                    != new_values.to_numpy(dtype=object)[both_filled])
+
+        data_completed += int(completed.sum())
+        conflicts_resolved += int(conflicting.sum())
+        if completed.any():
+            fills[col] = new_values[completed]
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for ref, old_value, new_value in zip(old_values.index[completed], old_values[completed], new_values[completed]):
+                logger.debug("  ✓ %s - Colonne '%s': Complété '%s' → '%s'", ref, col, old_value, new_value)
+            for ref, old_value, new_value in zip(old_values.index[conflicting], old_values[conflicting], new_values[conflicting]):
+                logger.debug("  → %s - Colonne '%s': Ancien conservé '%s' (nouveau: '%s')", ref, col, old_value, new_value)
+
+    return fills, conflicts_resolved, data_completed
+
+def load_old_file(old_file_path):
+    """Charge un ancien tableau de facturation (Excel .xlsx ou CSV)"""
+    if old_file_path.endswith('.xlsx'):
+        df_old = pd.read_excel(old_file_path)
+        logger.info("Ancien fichier Excel chargé: %s lignes", len(df_old))
+    else:
+        df_old = pd.read_csv(old_file_path)
+        logger.info("Ancien fichier CSV chargé: %s lignes", len(df_old))
+    return df_old
+
+def combine_with_old_file(df_new_data, old_file_path):
+    """
+    Combine les nouvelles données avec un ancien fichier Excel/CSV
+    Gestion intelligente des conflits :
+    - Priorité aux données de l'ancien fichier
+    - Exception : nouvelles données utilisées si elles complètent des données manquantes
+    Les lignes en conflit sont alignées par Réf.WEB (première ligne de chaque côté) et
+    comparées colonne par colonne avec des masques (resolve_conflicting_rows).
+    """
+    try:
+        logger.info("=== DÉBUT COMBINAISON INTELLIGENTE AVEC ANCIEN FICHIER ===")
         
-        # Cas 1: Référence simple (ex: LCDI-1038 ou #LCDI-1038)
-        if ' ' not in journal_ref_str:
-            # Normaliser la référence
-            journal_normalized = journal_ref_str if journal_ref_str.startswith('#') else f"#{journal_ref_str}"
-            journal_mapping[journal_normalized] = journal_row          # Cas 2: Référence multiple (ex: LCDI-1020 LCDI-1021)
-        else:
-            import re
-            # Extraire tous les numéros de commandes
-            numbers = re.findall(r'LCDI-(\d+)', journal_ref_str)
-            
-            if numbers:
-                print(f"     - Référence multiple détectée: '{journal_ref_str}' -> commandes {numbers}")
-                
-                # Pour les références multiples, on doit répartir les montants
-                # Stratégie: calculer le poids de chaque commande et répartir proportionnellement
-                
-                # Récupérer les montants totaux des commandes concernées pour calculer les proportions
-                command_totals = {}
-                total_sum = 0
-                
-                for num in numbers:
-                    target_ref = f"#LCDI-{num}"
-                    # Trouver la commande correspondante dans df_orders_copy
-                    matching_orders = df_orders_copy[df_orders_copy['Name_normalized'] == target_ref]
-                    if not matching_orders.empty:
-                        order_total = pd.to_numeric(matching_orders.iloc[0]['Total'], errors='coerce')
-                        if pd.notna(order_total):
-                            command_totals[target_ref] = order_total
-                            total_sum += order_total
-                        else:
-                            command_totals[target_ref] = 0
-                    else:
-                        command_totals[target_ref] = 0
-                
-                print(f"       - Totaux des commandes : {command_totals}, somme: {total_sum}")
-                
-                # Récupérer les montants du journal
-                journal_ttc = journal_row.get('Montant du document TTC', None)
-                journal_ht = journal_row.get('Montant du document HT', None)
-                journal_marge = journal_row.get('Montant marge HT', None)
-                
-                # Convertir les montants du journal au format numérique
-                if pd.notna(journal_ttc):
-                    try:
-                        journal_ttc_num = float(str(journal_ttc).replace(',', '.').replace(' ', ''))
-                    except:
-                        journal_ttc_num = None
-                else:
-                    journal_ttc_num = None
-                    
-                if pd.notna(journal_ht):
-                    try:
-                        journal_ht_num = float(str(journal_ht).replace(',', '.').replace(' ', ''))
-                    except:
-                        journal_ht_num = None
-                else:
-                    journal_ht_num = None
-                    
-                if pd.notna(journal_marge):
-                    try:
-                        journal_marge_num = float(str(journal_marge).replace(',', '.').replace(' ', ''))
-                    except:
-                        journal_marge_num = None
-                else:
-                    journal_marge_num = None
-                
-                print(f"       - Montants journal : TTC={journal_ttc_num}, HT={journal_ht_num}, Marge={journal_marge_num}")
+        # Charger l'ancien fichier
+        df_old = load_old_file(old_file_path)
+        
+        # Vérifier que la colonne Réf.WEB existe dans les deux fichiers
+        if 'Réf.WEB' not in df_old.columns:
+            logger.error("ERREUR: La colonne 'Réf.WEB' n'existe pas dans l'ancien fichier")
+            return df_new_data
+        
+        if 'Réf.WEB' not in df_new_data.columns:
+            logger.error("ERREUR: La colonne 'Réf.WEB' n'existe pas dans les nouvelles données")
+            return df_old
+        
+        logger.info("Nouvelles données: %s lignes", len(df_new_data))
+        logger.debug("Colonnes anciennes: %s", list(df_old.columns))
+        logger.debug("Colonnes nouvelles: %s", list(df_new_data.columns))
+        
+        # Identifier les références communes (potentiels conflits)
+        old_refs = set(df_old['Réf.WEB'].dropna())
+        new_refs = set(df_new_data['Réf.WEB'].dropna())
+        conflicting_refs = old_refs.intersection(new_refs)
+        
+        logger.info("Références avec conflits potentiels: %s", len(conflicting_refs))
+        if conflicting_refs:
+            logger.info("Exemples de conflits: %s", list(conflicting_refs)[:5])
+        
+        # Harmoniser les colonnes d'abord
+        old_columns = set(df_old.columns)
+        new_columns = set(df_new_data.columns)
+        all_columns = old_columns.union(new_columns)
+        
+        # Ajouter les colonnes manquantes avec des valeurs vides/NaN
+        for col in new_columns - old_columns:
+            df_old[col] = pd.NA
+            logger.info("Colonne '%s' ajoutée à l'ancien fichier", col)
+        
+        for col in old_columns - new_columns:
+            df_new_data[col] = pd.NA
+            logger.info("Colonne '%s' ajoutée aux nouvelles données", col)
+        
+        # Réordonner les colonnes
+        common_columns = sorted(all_columns)
+        df_old = df_old[common_columns]
+        df_new_data = df_new_data[common_columns]
+        
+        # Séparer les nouvelles données en deux groupes
+        df_new_unique = df_new_data[~df_new_data['Réf.WEB'].isin(conflicting_refs)].copy()
+        df_new_conflicts = df_new_data[df_new_data['Réf.WEB'].isin(conflicting_refs)].copy()
+        
+        logger.info("Nouvelles données uniques (pas de conflit): %s lignes", len(df_new_unique))
+        logger.info("Nouvelles données en conflit: %s lignes", len(df_new_conflicts))
+        
+        # Traiter les conflits avec priorité intelligente
+        conflicts_resolved = 0
+        data_completed = 0
+        
+        if len(df_new_conflicts) > 0:
+            logger.info("=== RÉSOLUTION DES CONFLITS ===")
+
+            # Alignement par Réf.WEB: première ligne de l'ancien fichier et des nouvelles données
+            old_refs_column = df_old['Réf.WEB']
+            old_aligned = (df_old[old_refs_column.isin(conflicting_refs)]
+                           .drop_duplicates('Réf.WEB').set_index('Réf.WEB'))
+            new_aligned = (df_new_conflicts.drop_duplicates('Réf.WEB').set_index('Réf.WEB')
+                           .reindex(old_aligned.index))
+
+            fills, conflicts_resolved, data_completed = resolve_conflicting_rows(old_aligned, new_aligned, common_columns)
+            for col, fill_values in fills.items():
+                # Toutes les lignes de l'ancien fichier portant ces références sont complétées
+                rows_to_fill = old_refs_column.isin(fill_values.index)
+                df_old[col] = df_old[col].mask(rows_to_fill, old_refs_column.map(fill_values))
                 
-                # Répartir les montants proportionnellement
-                for num in numbers:
-                    target_ref = f"#LCDI-{num}"
-                    
-                    # Créer une copie de la ligne journal pour cette commande
-                    proportional_journal_data = journal_row.copy()
-                    
-                    # Calculer la proportion de cette commande
-                    if total_sum > 0 and command_totals[target_ref] > 0:
-                        proportion = command_totals[target_ref] / total_sum
-                        print(f"       - {target_ref}: proportion = {proportion:.3f}")
-                        
-                        # Répartir les montants
-                        if journal_ttc_num is not None:
-                            proportional_ttc = journal_ttc_num * proportion
-                            proportional_journal_data['Montant du document TTC'] = f"{proportional_ttc:.2f}".replace('.', ',')
-                        
-                        if journal_ht_num is not None:
-                            proportional_ht = journal_ht_num * proportion
-                            proportional_journal_data['Montant du document HT'] = f"{proportional_ht:.2f}".replace('.', ',')
-                        
-                        if journal_marge_num is not None:
-                            proportional_marge = journal_marge_num * proportion
-                            proportional_journal_data['Montant marge HT'] = f"{proportional_marge:.2f}".replace('.', ',')
-                            
-                        print(f"         - Montants répartis : TTC={proportional_ttc:.2f}, HT={proportional_ht:.2f}")
-                    else:
-                        # Si pas de proportion calculable, distribuer équitablement
-                        equal_proportion = 1.0 / len(numbers)
-                        print(f"       - {target_ref}: proportion égale = {equal_proportion:.3f}")
-                        
-                        if journal_ttc_num is not None:
-                            equal_ttc = journal_ttc_num * equal_proportion
-                            proportional_journal_data['Montant du document TTC'] = f"{equal_ttc:.2f}".replace('.', ',')
-                        
-                        if journal_ht_num is not None:
-                            equal_ht = journal_ht_num * equal_proportion
-                            proportional_journal_data['Montant du document HT'] = f"{equal_ht:.2f}".replace('.', ',')
-                        
-                        if journal_marge_num is not None:
-                            equal_marge = journal_marge_num * equal_proportion
-                            proportional_journal_data['Montant marge HT'] = f"{equal_marge:.2f}".replace('.', ',')
-                    
-                    # Stocker le mapping
-                    journal_mapping[target_ref] = proportional_journal_data
-                    print(f"       - Mapped {target_ref} -> {proportional_journal_data['Référence LMB']} (montants répartis)")
-    
-    # Appliquer le mapping aux commandes
-    journal_data = []
-    for idx, row in df_orders_copy.iterrows():
-        order_ref = row['Name_normalized']
-        if order_ref in journal_mapping:
-            journal_data.append(journal_mapping[order_ref])
+        # Combiner : ancien fichier (mis à jour) + nouvelles données uniques
+        df_combined = pd.concat([df_old, df_new_unique], ignore_index=True)
+        
+        logger.info("=== RÉSULTAT COMBINAISON INTELLIGENTE ===")
+        logger.info("Total lignes combinées: %s", len(df_combined))
+        logger.info("Anciennes données (conservées): %s", len(df_old))
+        logger.info("Nouvelles données uniques ajoutées: %s", len(df_new_unique))
+        logger.info("Conflits résolus (priorité ancien): %s", conflicts_resolved)
+        logger.info("Données complétées (ancien vide): %s", data_completed)
+        logger.info("Doublons évités: %s", len(conflicting_refs))
+        
+        return df_combined
+        
+    except Exception as e:
+        logger.error("ERREUR lors de la combinaison intelligente: %s", e)
+        logger.info("Retour des nouvelles données uniquement")
+        return df_new_data
+
+# Registre permanent (mode 'ledger'): base SQLite locale, une ligne par Réf.WEB.
+# Chaque traitement y insère ses nouvelles lignes et complète les cellules vides des
+# lignes existantes (mêmes règles que la combinaison avec un ancien fichier); le classeur
+# est ensuite rendu depuis le registre, éventuellement sur une période de facturation.
+# Le coût d'une mise à jour dépend du nombre de lignes reçues, pas de l'historique.
+LEDGER_PATH = os.environ.get('LEDGER_PATH', os.path.join('data', 'ledger.sqlite3'))
+
+# Format des dates de facture du tableau final (voir format_dates_to_french)
+LEDGER_DATE_FORMAT = '%d/%m/%Y'
+
+def ledger_invoice_dates(values):
+    """Dates de facture au format ISO (AAAA-MM-JJ) pour les requêtes par période, None si absente"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        dates = values
+    else:
+        dates = pd.to_datetime(values, format=LEDGER_DATE_FORMAT, errors='coerce')
+    iso = dates.dt.strftime('%Y-%m-%d')
+    return iso.astype(object).where(iso.notna(), None)
+
+def _json_default(value):
+    """Types numpy/pandas non gérés par json.dumps"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def frame_to_json_rows(df):
+    """Lignes du DataFrame en JSON (NaN/NA -> null, flottants sans arrondi)"""
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    return [json.dumps(record, ensure_ascii=False, default=_json_default) for record in records]
+
+class BillingLedger:
+    """
+    Registre des lignes de facturation dans une base SQLite, clé primaire Réf.WEB.
+    Chaque ligne est stockée en JSON (colonnes libres, comme les anciens fichiers) avec
+    sa date de facture ISO indexée; l'ordre des colonnes est conservé dans ledger_columns.
+    Les écritures se font dans une transaction BEGIN IMMEDIATE: deux tâches ne peuvent pas
+    compléter la même ligne en même temps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with contextlib.closing(self._connect()) as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS ledger (
+                    position INTEGER PRIMARY KEY,
+                    ref_web TEXT NOT NULL UNIQUE,
+                    invoice_date TEXT,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ledger_invoice_date ON ledger (invoice_date);
+                CREATE TABLE IF NOT EXISTS ledger_columns (
+                    position INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                );
+            """)
+
+    def _connect(self):
+        # Transactions explicites (isolation_level=None) et attente si une autre tâche écrit
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def _columns(self, connection):
+        return [name for (name,) in connection.execute("SELECT name FROM ledger_columns ORDER BY position")]
+
+    def upsert(self, df_new_data):
+        """
+        Ajoute les nouvelles Réf.WEB au registre et complète les cellules vides des lignes
+        déjà enregistrées (priorité aux données du registre, voir resolve_conflicting_rows).
+        Seules les lignes du registre portant les références reçues sont relues.
+        Renvoie les compteurs de la mise à jour.
+        """
+        if 'Réf.WEB' not in df_new_data.columns:
+            raise ValueError("La colonne 'Réf.WEB' est absente des données à enregistrer")
+
+        # Statut non stocké: il est recalculé au rendu (les cellules complétées le changent)
+        has_ref = ~empty_cell_mask(df_new_data['Réf.WEB'])
+        df_new = df_new_data[has_ref].drop(columns=['Statut'], errors='ignore')
+        df_new['Réf.WEB'] = df_new['Réf.WEB'].astype(str).str.strip()
+        duplicated = df_new['Réf.WEB'].duplicated()
+        if duplicated.any():
+            logger.warning("⚠️ Registre: %s lignes en double (même Réf.WEB) ignorées", int(duplicated.sum()))
+            df_new = df_new[~duplicated]
+        if not has_ref.all():
+            logger.warning("⚠️ Registre: %s lignes sans Réf.WEB ignorées", int((~has_ref).sum()))
+
+        refs = df_new['Réf.WEB'].tolist()
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Colonnes du registre: les nouvelles colonnes sont ajoutées à la fin
+                columns = self._columns(connection)
+                connection.executemany("INSERT OR IGNORE INTO ledger_columns (name) VALUES (?)",
+                                       [(col,) for col in df_new.columns if col not in columns])
+                columns = self._columns(connection)
+
+                # Lignes déjà enregistrées pour les références reçues (recherche par index)
+                connection.execute("CREATE TEMP TABLE incoming (ref_web TEXT PRIMARY KEY)")
+                connection.executemany("INSERT INTO incoming VALUES (?)", [(ref,) for ref in refs])
+                stored = connection.execute(
+                    "SELECT ref_web, data FROM ledger JOIN incoming USING (ref_web)").fetchall()
+                connection.execute("DROP TABLE incoming")
+
+                df_new = df_new.reindex(columns=columns)
+                conflicts_resolved = 0
+                data_completed = 0
+                updated_rows = []
+                if stored:
+                    old_aligned = pd.DataFrame.from_records([json.loads(data) for _, data in stored],
+                                                            columns=columns)
+                    old_aligned.index = pd.Index([ref for ref, _ in stored], name='Réf.WEB')
+                    new_aligned = df_new.set_index('Réf.WEB', drop=False).reindex(old_aligned.index)
+
+                    fills, conflicts_resolved, data_completed = resolve_conflicting_rows(old_aligned, new_aligned, columns)
+                    changed = pd.Series(False, index=old_aligned.index)
+                    for col, fill_values in fills.items():
+                        rows_to_fill = old_aligned.index.isin(fill_values.index)
+                        old_aligned[col] = old_aligned[col].mask(rows_to_fill, fill_values.reindex(old_aligned.index))
+                        changed |= rows_to_fill
+
+                    # Seules les lignes complétées sont réécrites
+                    old_changed = old_aligned[changed.to_numpy()]
+                    updated_rows = list(zip(ledger_invoice_dates(old_changed['Date Facture']) if 'Date Facture' in columns
+                                            else [None] * len(old_changed),
+                                            frame_to_json_rows(old_changed),
+                                            old_changed.index))
+
+                now = time.time()
+                connection.executemany("UPDATE ledger SET invoice_date = ?, data = ?, updated_at = ? WHERE ref_web = ?",
+                                       [(date, data, now, ref) for date, data, ref in updated_rows])
+
+                stored_refs = {ref for ref, _ in stored}
+                df_added = df_new[~df_new['Réf.WEB'].isin(stored_refs)]
+                dates = (ledger_invoice_dates(df_added['Date Facture']) if 'Date Facture' in columns
+                         else [None] * len(df_added))
+                connection.executemany(
+                    "INSERT INTO ledger (ref_web, invoice_date, data, updated_at) VALUES (?, ?, ?, ?)",
+                    [(ref, date, data, now)
+                     for ref, date, data in zip(df_added['Réf.WEB'], dates, frame_to_json_rows(df_added))])
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+        summary = {
+            'received': len(df_new),
+            'added': len(df_added),
+            'updated': len(updated_rows),
+            'conflicts_resolved': conflicts_resolved,
+            'data_completed': data_completed,
+        }
+        logger.info("Registre mis à jour: %s lignes reçues, %s ajoutées, %s complétées (%s cellules), %s conflits (registre conservé)",
+                    summary['received'], summary['added'], summary['updated'], data_completed, conflicts_resolved)
+        return summary
+
+    def import_file(self, old_file_path):
+        """Reprend un ancien tableau Excel/CSV dans le registre (une seule lecture de l'historique)"""
+        return self.upsert(load_old_file(old_file_path))
+
+    def to_frame(self, start=None, end=None):
+        """
+        Tableau de facturation rendu depuis le registre, dans l'ordre d'insertion.
+        start/end (AAAA-MM-JJ, bornes incluses) limitent aux factures de la période;
+        les lignes sans date de facture ne sont rendues que sans période.
+        """
+        conditions, parameters = [], []
+        if start:
+            conditions.append("invoice_date >= ?")
+            parameters.append(start)
+        if end:
+            conditions.append("invoice_date <= ?")
+            parameters.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with contextlib.closing(self._connect()) as connection:
+            columns = self._columns(connection)
+            rows = connection.execute(f"SELECT data FROM ledger {where} ORDER BY position", parameters).fetchall()
+
+        df_result = pd.DataFrame.from_records([json.loads(data) for (data,) in rows], columns=columns)
+        if {'Réf. LMB', 'reste'}.issubset(df_result.columns):
+            df_result['Statut'] = compute_completeness_status(df_result)
+        logger.info("Registre rendu: %s lignes (période: %s → %s)", len(df_result), start or '…', end or '…')
+        return df_result
+
+    def stats(self):
+        """Nombre de lignes, période couverte et taille de la base"""
+        with contextlib.closing(self._connect()) as connection:
+            rows, first_date, last_date, last_update = connection.execute(
+                "SELECT COUNT(*), MIN(invoice_date), MAX(invoice_date), MAX(updated_at) FROM ledger").fetchone()
+        return {
+            'path': self.path,
+            'rows': rows,
+            'first_invoice_date': first_date,
+            'last_invoice_date': last_date,
+            'updated_at': last_update,
+            'size_bytes': os.path.getsize(self.path),
+        }
+
+# Cache des résultats: un même trio de fichiers (même contenu, même mode, même version
+# du code) renvoie directement le classeur déjà généré dans output/
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_MB', 500)) * 1024 * 1024
+RESULT_CACHE_INDEX = '.result_cache.json'
+
+# Version du code: l'empreinte de ce fichier, un changement de code invalide le cache
+try:
+    CODE_VERSION = hash_file(os.path.abspath(__file__))
+except OSError:
+    CODE_VERSION = 'inconnue'
+
+class ResultCache:
+    """
+    Cache adressé par contenu des classeurs générés.
+    La clé combine les empreintes des fichiers d'entrée, le mode de traitement et la version
+    du code. L'index (clé -> fichier de output/ et métadonnées) est un fichier JSON dans
+    le dossier de sortie; la taille totale du dossier est bornée par éviction LRU.
+    Seuls les classeurs référencés par l'index sont supprimés: les autres fichiers de
+    output/ (exemple livré avec le dépôt, .gitkeep...) comptent dans la taille sans être évincés.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(folder, RESULT_CACHE_INDEX)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, file_paths, processing_mode):
+        """Clé du résultat: empreintes des fichiers (dans l'ordre des clés), mode et version du code"""
+        parts = [f"{name}={hash_file(path)}" for name, path in sorted(file_paths.items())]
+        parts += [f"mode={processing_mode}", f"version={CODE_VERSION}"]
+        return hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+
+    def get(self, key):
+        """Résultat en cache (dict) si le classeur existe toujours, sinon None"""
+        with self.lock:
+            index = self._load_index()
+            entry = index.get(key)
+            if entry is not None and not os.path.exists(os.path.join(self.folder, entry['filename'])):
+                # Fichier supprimé entre-temps: entrée périmée
+                del index[key]
+                self._save_index(index)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry['last_access'] = time.time()
+            self._save_index(index)
+            return dict(entry)
+
+    def put(self, key, result):
+        """Enregistre un classeur généré puis applique l'éviction par taille"""
+        with self.lock:
+            index = self._load_index()
+            now = time.time()
+            index[key] = dict(result, created_at=now, last_access=now)
+            self._evict(index)
+            self._save_index(index)
+
+    def _folder_sizes(self):
+        """Taille de chaque fichier de output/ (hors fichiers cachés: index, .gitkeep)"""
+        return {entry.name: entry.stat().st_size for entry in os.scandir(self.folder)
+                if entry.is_file() and not entry.name.startswith('.')}
+
+    def _evict(self, index):
+        """Supprime les classeurs du cache les moins récemment utilisés au-delà de max_bytes"""
+        sizes = self._folder_sizes()
+        total_size = sum(sizes.values())
+        cached_files = sorted((entry['last_access'], entry['filename']) for entry in index.values()
+                              if entry['filename'] in sizes)
+        for _, filename in cached_files:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, filename))
+            except OSError:
+                continue
+            total_size -= sizes[filename]
+            self.evictions += 1
+            logger.info("Cache des résultats: %s supprimé (éviction LRU)", filename)
+
+        for key in [key for key, entry in index.items()
+                    if not os.path.exists(os.path.join(self.folder, entry['filename']))]:
+            del index[key]
+
+    def stats(self):
+        """Statistiques du cache: taux de succès, nombre d'entrées et taille du dossier"""
+        with self.lock:
+            index = self._load_index()
+        size_bytes = sum(self._folder_sizes().values())
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(index),
+            'size_bytes': size_bytes,
+            'max_bytes': self.max_bytes,
+            'code_version': CODE_VERSION,
+        }
+
+result_cache = ResultCache(OUTPUT_FOLDER, RESULT_CACHE_MAX_BYTES)
+
+# Traitement en arrière-plan: /process enregistre les fichiers, met la consolidation
+# en file d'attente dans un pool de processus local et renvoie un identifiant de tâche.
+# L'état de chaque tâche est partagé entre processus et consultable via /jobs/<id>.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_RETENTION_SECONDS = 3600  # Les tâches terminées sont oubliées au bout d'une heure
+
+# Étapes d'une tâche, dans l'ordre (pour le pourcentage de progression)
+JOB_STEPS = ['queued', 'load_files'] + BillingPipeline.STAGES + ['combine', 'ledger', 'excel', 'done']
+
+# Libellés affichés sur la page d'attente
+JOB_STEP_LABELS = {
+    'queued': "En attente d'un processus libre",
+    'load_files': 'Chargement des fichiers CSV',
+    'normalize_columns': 'Vérification des colonnes',
+    'clean_data': 'Nettoyage des données',
+    'aggregate_orders': 'Agrégation des commandes',
+    'aggregate_transactions': 'Agrégation des transactions',
+    'merge_transactions': 'Fusion commandes / transactions',
+    'merge_journal': 'Rapprochement avec le journal',
+    'build_final_table': 'Création du tableau final',
+    'finalize': 'Nettoyage final',
+    'combine': "Fusion avec l'ancien fichier",
+    'ledger': 'Mise à jour du registre',
+    'excel': 'Génération du fichier Excel',
+    'done': 'Terminé',
+}
+
+_job_executor = None
+_job_manager = None
+_job_states = None  # dict partagé (multiprocessing.Manager): job_id -> état de la tâche
+_job_lock = threading.Lock()
+
+def get_job_executor():
+    """Crée à la première utilisation le pool de processus et le dictionnaire d'état partagé"""
+    global _job_executor, _job_manager, _job_states
+    with _job_lock:
+        if _job_executor is None:
+            _job_manager = multiprocessing.Manager()
+            _job_states = _job_manager.dict()
+            # Les processus de traitement envoient leurs logs au processus principal
+            worker_log_queue = _job_manager.Queue()
+            start_log_listener(worker_log_queue, log_handlers)
+            _job_executor = ProcessPoolExecutor(max_workers=JOB_WORKERS, initializer=configure_logging,
+                                                initargs=(worker_log_queue,))
+    return _job_executor, _job_states
+
+def update_job_state(job_states, job_id, **changes):
+    """Met à jour l'état d'une tâche (le dict partagé ne voit que les réaffectations complètes)"""
+    state = dict(job_states.get(job_id, {}))
+    state.update(changes)
+    state['updated_at'] = time.time()
+    job_states[job_id] = state
+
+def report_job_step(job_states, job_id, step):
+    """Enregistre l'étape en cours et le pourcentage de progression correspondant"""
+    progress = int(100 * JOB_STEPS.index(step) / (len(JOB_STEPS) - 1))
+    status = 'done' if step == 'done' else 'running'
+    update_job_state(job_states, job_id, status=status, stage=step,
+                     stage_label=JOB_STEP_LABELS[step], progress=progress)
+
+def run_billing_job(job_id, temp_paths, processing_mode, job_states, cache_key, ledger_range=None,
+                    file_digests=None):
+    """
+    Exécuté dans un processus du pool: consolidation, fusion éventuelle avec l'ancien
+    fichier (ou mise à jour du registre) puis sauvegarde Excel. Renvoie les informations
+    de la page de succès et les mesures de chaque étape (clé 'metrics', voir PipelineProfiler).
+    Le nom du fichier de sortie contient le début de la clé du cache des résultats
+    (de l'identifiant de la tâche en mode registre, dont le résultat n'est pas mis en cache).
+    ledger_range: (début, fin) de la période rendue depuis le registre, bornes optionnelles
+    file_digests: {chemin: (empreinte, encodage)} calculés à la réception des fichiers
+    """
+    def progress_callback(step):
+        report_job_step(job_states, job_id, step)
+
+    for temp_path, (content_hash, encoding) in (file_digests or {}).items():
+        remember_file_digest(temp_path, content_hash, encoding)
+
+    profiler = PipelineProfiler()
+    output_path = job_output_path((cache_key or job_id)[:8])
+    with profiler.activate():
+        if processing_mode == 'new' and should_stream(temp_paths['orders_file'], temp_paths['transactions_file']):
+            # Exports volumineux: lecture par blocs, classeur écrit au fil de l'eau
+            logger.info("Fichiers volumineux: traitement en flux par blocs de %s lignes", STREAMING_CHUNK_ROWS)
+            pipeline = StreamingBillingPipeline(progress_callback=progress_callback)
+            final_path, is_excel, rows = pipeline.run_to_file(
+                temp_paths['orders_file'], temp_paths['transactions_file'], temp_paths['journal_file'], output_path)
+            return {
+                'filename': os.path.basename(final_path),
+                'rows': rows,
+                'is_excel': is_excel,
+                'combined': False,
+                'metrics': profiler.to_dict(),
+            }
+
+        df_new_data = generate_consolidated_billing_table(
+            temp_paths['orders_file'],
+            temp_paths['transactions_file'],
+            temp_paths['journal_file'],
+            progress_callback=progress_callback
+        )
+
+        # Traitement selon le mode
+        combined = processing_mode == 'combine' and 'old_file' in temp_paths
+        if combined:
+            # Mode combinaison : fusionner avec l'ancien fichier
+            progress_callback('combine')
+            with profiler.stage('combine') as record:
+                df_result = combine_with_old_file(df_new_data, temp_paths['old_file'])
+                if record is not None:
+                    record['rows'] = {'final': len(df_result)}
+        elif processing_mode == 'ledger':
+            # Mode registre : mise à jour incrémentale puis rendu depuis le registre
+            progress_callback('ledger')
+            with profiler.stage('ledger') as record:
+                ledger = BillingLedger(LEDGER_PATH)
+                if 'old_file' in temp_paths:
+                    ledger.import_file(temp_paths['old_file'])
+                ledger.upsert(df_new_data)
+                df_result = ledger.to_frame(*(ledger_range or (None, None)))
+                if record is not None:
+                    record['rows'] = {'new': len(df_new_data), 'final': len(df_result)}
         else:
-            # Créer une ligne vide avec les mêmes colonnes
-            empty_row = pd.Series(index=df_journal_copy.columns, dtype=object)
-            journal_data.append(empty_row)
-    
-    # Convertir en DataFrame
-    df_journal_mapped = pd.DataFrame(journal_data, index=df_orders_copy.index)
-    
-    # Concaténer horizontalement
-    df_merged = pd.concat([df_orders_copy, df_journal_mapped], axis=1)
-    
-    # Compter les correspondances
-    correspondances = df_merged['Référence LMB'].notna().sum()
-    total = len(df_merged)
-    
-    print(f"     - Correspondances trouvées : {correspondances}/{total} ({correspondances/total*100:.1f}%)")
-    
-    return df_merged
+            # Mode nouveau fichier
+            df_result = df_new_data
+
+        final_path, is_excel = write_job_output(df_result, output_path, progress_callback, profiler)
+
+    return {
+        'filename': os.path.basename(final_path),
+        'rows': len(df_result),
+        'is_excel': is_excel,
+        'combined': combined,
+        'metrics': profiler.to_dict(),
+    }
+
+def job_output_path(name_suffix):
+    """Fichier de sortie d'une tâche, horodaté au format DD_MM_YYYY (extension .xlsx si Excel)"""
+    timestamp = datetime.now().strftime('%d_%m_%Y')
+    output_filename = f'Compta_LCDI_Shopify_{timestamp}_{name_suffix}.csv'
+    return os.path.join(OUTPUT_FOLDER, output_filename)
+
+def write_job_output(df_result, output_path, progress_callback, profiler):
+    """Étape 'excel' d'une tâche"""
+    progress_callback('excel')
+    # Sauvegarde avec formatage conditionnel (Excel) ou CSV si pas possible
+    with profiler.stage('excel') as record:
+        final_path, is_excel = save_with_conditional_formatting(df_result, output_path)
+        if record is not None:
+            record['rows'] = {'final': len(df_result)}
+    return final_path, is_excel
+
+def run_ledger_export_job(job_id, job_states, ledger_range=None):
+    """Exécuté dans un processus du pool: rendu du registre (sur une période) sans nouveaux fichiers"""
+    def progress_callback(step):
+        report_job_step(job_states, job_id, step)
+
+    profiler = PipelineProfiler()
+    with profiler.activate():
+        progress_callback('ledger')
+        with profiler.stage('ledger') as record:
+            df_result = BillingLedger(LEDGER_PATH).to_frame(*(ledger_range or (None, None)))
+            if record is not None:
+                record['rows'] = {'final': len(df_result)}
+        final_path, is_excel = write_job_output(df_result, job_output_path(job_id[:8]), progress_callback, profiler)
+
+    return {
+        'filename': os.path.basename(final_path),
+        'rows': len(df_result),
+        'is_excel': is_excel,
+        'combined': False,
+        'metrics': profiler.to_dict(),
+    }
+
+def finish_billing_job(job_id, job_states, cache_key, future):
+    """
+    Rappel de fin de tâche (processus principal): enregistre le résultat ou l'erreur,
+    ajoute le classeur généré au cache des résultats (sauf cache_key None, résultats
+    dépendant du registre) et cumule les mesures pour /metrics
+    """
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.error("Erreur lors du traitement de la tâche %s: %s", job_id, e)
+        update_job_state(job_states, job_id, status='error', error=str(e))
+        record_job_metrics('error')
+        return
 
-def fill_missing_data_indicators(df_final, df_merged_final):
+    record_job_metrics('done', result['metrics'])
+    if cache_key is not None:
+        result_cache.put(cache_key, {key: value for key, value in result.items() if key != 'metrics'})
+    update_job_state(job_states, job_id, **result)
+    report_job_step(job_states, job_id, 'done')
+    logger.info("Tâche %s terminée: %s (%s lignes, %.2f s)", job_id, result['filename'], result['rows'], result['metrics']['total_wall_s'])
+
+# Mesures cumulées des tâches terminées (processus web), exposées par /metrics
+_metrics_lock = threading.Lock()
+_job_counts = {'done': 0, 'error': 0}
+_stage_metrics = {}  # étape -> {'count', 'wall_sum', 'cpu_sum', 'last_wall', 'last_rows', 'peak_rss'}
+
+def record_job_metrics(status, metrics=None):
+    """Cumule le statut d'une tâche et les mesures de ses étapes"""
+    with _metrics_lock:
+        _job_counts[status] += 1
+        for record in (metrics or {}).get('stages', []):
+            stage = _stage_metrics.setdefault(record['name'], {'count': 0, 'wall_sum': 0.0, 'cpu_sum': 0.0,
+                                                                'last_wall': 0.0, 'last_rows': 0, 'peak_rss': 0})
+            stage['count'] += 1
+            stage['wall_sum'] += record.get('wall_s', 0.0)
+            stage['cpu_sum'] += record.get('cpu_s', 0.0)
+            stage['last_wall'] = record.get('wall_s', 0.0)
+            stage['last_rows'] = sum(record.get('rows', {}).values())
+            stage['peak_rss'] = max(stage['peak_rss'], record.get('peak_rss_bytes', 0))
+
+def render_prometheus_metrics():
+    """Mesures au format texte Prometheus (exposition 0.0.4)"""
+    with _metrics_lock:
+        job_counts = dict(_job_counts)
+        stages = {name: dict(values) for name, values in _stage_metrics.items()}
+    cache = result_cache.stats()
+
+    metrics = [
+        ('lcdi_jobs_total', 'counter', 'Tâches de consolidation terminées, par statut',
+         [({'status': status}, count) for status, count in job_counts.items()]),
+        ('lcdi_stage_duration_seconds_sum', 'counter', 'Temps réel cumulé par étape',
+         [({'stage': name}, values['wall_sum']) for name, values in stages.items()]),
+        ('lcdi_stage_duration_seconds_count', 'counter', "Nombre d'exécutions par étape",
+         [({'stage': name}, values['count']) for name, values in stages.items()]),
+        ('lcdi_stage_cpu_seconds_sum', 'counter', 'Temps CPU cumulé par étape',
+         [({'stage': name}, values['cpu_sum']) for name, values in stages.items()]),
+        ('lcdi_stage_last_duration_seconds', 'gauge', 'Temps réel de la dernière exécution par étape',
+         [({'stage': name}, values['last_wall']) for name, values in stages.items()]),
+        ('lcdi_stage_last_rows', 'gauge', 'Lignes produites par la dernière exécution par étape',
+         [({'stage': name}, values['last_rows']) for name, values in stages.items()]),
+        ('lcdi_stage_peak_rss_bytes', 'gauge', 'Pic de mémoire résidente observé à la fin de chaque étape',
+         [({'stage': name}, values['peak_rss']) for name, values in stages.items()]),
+        ('lcdi_result_cache_hits_total', 'counter', 'Résultats servis depuis le cache', [({}, cache['hits'])]),
+        ('lcdi_result_cache_misses_total', 'counter', 'Résultats absents du cache', [({}, cache['misses'])]),
+        ('lcdi_result_cache_size_bytes', 'gauge', 'Taille du dossier de sortie', [({}, cache['size_bytes'])]),
+    ]
+
+    lines = []
+    for name, metric_type, help_text, samples in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+def submit_billing_job(job_id, temp_paths, processing_mode, cache_key, ledger_range=None, file_digests=None):
+    """Met une tâche de consolidation en file d'attente et renvoie immédiatement"""
+    job_function = functools.partial(run_billing_job, job_id, temp_paths, processing_mode,
+                                     cache_key=cache_key, ledger_range=ledger_range,
+                                     file_digests=file_digests)
+    return enqueue_job(job_id, processing_mode, cache_key, job_function)
+
+def submit_ledger_export_job(job_id, ledger_range=None):
+    """Met en file d'attente le rendu du registre et renvoie immédiatement"""
+    job_function = functools.partial(run_ledger_export_job, job_id, ledger_range=ledger_range)
+    return enqueue_job(job_id, 'ledger_export', None, job_function)
+
+def enqueue_job(job_id, processing_mode, cache_key, job_function):
     """
-    Ajoute une colonne de statut simple : COMPLET ou INCOMPLET
-    Laisse les cellules vides sans marqueur pour les montants principaux (HT, TVA, TTC)
-    afin que le formatage conditionnel rouge s'applique.
-    """    # 1. Nettoyer SEULEMENT les colonnes numériques secondaires (pas HT, TVA, TTC, ni les méthodes de paiement)
-    # Les colonnes HT, TVA, TTC gardent leurs NaN pour le formatage conditionnel rouge
-    # Les colonnes de méthodes de paiement gardent leurs valeurs calculées
-    secondary_numeric_columns = ['reste', 'Shopify', 'Frais de commission']
-    
-    for col in secondary_numeric_columns:
-        if col in df_final.columns:
-            df_final[col] = df_final[col].fillna(0)
-      # 2. Déterminer le statut : COMPLET ou INCOMPLET
-    status_info = []
-    for idx, row in df_final.iterrows():
-        # Une ligne est COMPLÈTE si elle a :
-        # - Une référence LMB (pas vide/NaN)
-        # - Au moins une méthode de paiement avec un montant > 0
-        # - Une date de facture (pas vide/NaN)
-        
-        has_lmb = pd.notna(row['Réf. LMB']) and str(row['Réf. LMB']).strip() != ''
-        has_date = pd.notna(row['Date Facture']) and str(row['Date Facture']).strip() != ''
-        
-        # Vérifier toutes les méthodes de paiement
-        payment_methods = ['Virement bancaire', 'ALMA', 'Younited', 'PayPal', 'Shopify']
-        has_payment = False
-        
-        for method in payment_methods:
-            if method in row and pd.notna(row[method]):
-                try:
-                    amount = float(row[method])
-                    if abs(amount) > 0.01:  # Tolérance pour les erreurs d'arrondi
-                        has_payment = True
-                        break
-                except (ValueError, TypeError):
-                    continue
-        
-        if has_lmb and has_payment and has_date:
-            status_info.append("COMPLET")
-        else:
-            status_info.append("INCOMPLET")
-      # 3. Préparer la colonne de statut pour les formules Excel dynamiques
-    df_final['Statut'] = ''  # Colonne vide - les formules seront ajoutées dans Excel
-    print(f"DEBUG: Cellules NaN conservées pour formatage rouge - HT, TVA, TTC")
-    print(f"DEBUG: Cellules conservées (valeurs calculées) - Virement bancaire, ALMA, Younited, PayPal")
-    print(f"DEBUG: Cellules nettoyées (NaN->0) - colonnes secondaires: {secondary_numeric_columns}")
-    
-    return df_final
+    Enregistre l'état initial d'une tâche puis la soumet au pool de processus;
+    job_function (functools.partial, sérialisable) reçoit le dict d'état partagé job_states
+    """
+    executor, job_states = get_job_executor()
 
-def combine_with_old_file(df_new_data, old_file_path):
+    # Oublier les tâches terminées depuis longtemps
+    expired_before = time.time() - JOB_RETENTION_SECONDS
+    for old_id, old_state in list(job_states.items()):
+        if old_state.get('status') in ('done', 'error') and old_state['updated_at'] < expired_before:
+            job_states.pop(old_id, None)
+
+    update_job_state(job_states, job_id, id=job_id, processing_mode=processing_mode, created_at=time.time())
+    report_job_step(job_states, job_id, 'queued')
+    future = executor.submit(job_function, job_states=job_states)
+    future.add_done_callback(functools.partial(finish_billing_job, job_id, job_states, cache_key))
+    return job_id
+
+# Fichier d'entrée associé à chaque champ du formulaire (préparation dès la fin de l'envoi)
+UPLOAD_INPUT_TYPES = {'orders_file': 'orders', 'transactions_file': 'transactions', 'journal_file': 'journal'}
+
+def run_prepare_input_job(input_type, file_path, file_digest):
     """
-    Combine les nouvelles données avec un ancien fichier Excel/CSV
-    Gestion intelligente des conflits :
-    - Priorité aux données de l'ancien fichier
-    - Exception : nouvelles données utilisées si elles complètent des données manquantes
+    Exécuté dans un processus du pool dès qu'un fichier envoyé par morceaux est complet:
+    chargement, normalisation, nettoyage et agrégation de ce seul fichier, enregistrés dans
+    le cache d'étape (BillingPipeline.prepare_input) pendant l'envoi des autres fichiers
     """
+    remember_file_digest(file_path, *file_digest)
+    return BillingPipeline(stage_cache=stage_cache).prepare_input(input_type, file_path)
+
+def finish_prepare_job(upload_id, future):
+    """Rappel de fin de préparation (processus principal): résultat noté dans le manifeste de l'envoi"""
     try:
-        print("=== DÉBUT COMBINAISON INTELLIGENTE AVEC ANCIEN FICHIER ===")
-        
-        # Charger l'ancien fichier
-        if old_file_path.endswith('.xlsx'):
-            df_old = pd.read_excel(old_file_path)
-            print(f"Ancien fichier Excel chargé: {len(df_old)} lignes")
-        else:
-            df_old = pd.read_csv(old_file_path)
-            print(f"Ancien fichier CSV chargé: {len(df_old)} lignes")
-        
-        # Vérifier que la colonne Réf.WEB existe dans les deux fichiers
-        if 'Réf.WEB' not in df_old.columns:
-            print("ERREUR: La colonne 'Réf.WEB' n'existe pas dans l'ancien fichier")
-            return df_new_data
-        
-        if 'Réf.WEB' not in df_new_data.columns:
-            print("ERREUR: La colonne 'Réf.WEB' n'existe pas dans les nouvelles données")
-            return df_old
-        
-        print(f"Nouvelles données: {len(df_new_data)} lignes")
-        print(f"Colonnes anciennes: {list(df_old.columns)}")
-        print(f"Colonnes nouvelles: {list(df_new_data.columns)}")
-        
-        # Identifier les références communes (potentiels conflits)
-        old_refs = set(df_old['Réf.WEB'].dropna())
-        new_refs = set(df_new_data['Réf.WEB'].dropna())
-        conflicting_refs = old_refs.intersection(new_refs)
-        
-        print(f"Références avec conflits potentiels: {len(conflicting_refs)}")
-        if conflicting_refs:
-            print(f"Exemples de conflits: {list(conflicting_refs)[:5]}")
-        
-        # Harmoniser les colonnes d'abord
-        old_columns = set(df_old.columns)
-        new_columns = set(df_new_data.columns)
-        all_columns = old_columns.union(new_columns)
-        
-        # Ajouter les colonnes manquantes avec des valeurs vides/NaN
-        for col in new_columns - old_columns:
-            df_old[col] = pd.NA
-            print(f"Colonne '{col}' ajoutée à l'ancien fichier")
-        
-        for col in old_columns - new_columns:
-            df_new_data[col] = pd.NA
-            print(f"Colonne '{col}' ajoutée aux nouvelles données")
-        
-        # Réordonner les colonnes
-        common_columns = sorted(all_columns)
-        df_old = df_old[common_columns]
-        df_new_data = df_new_data[common_columns]
-        
-        # Séparer les nouvelles données en deux groupes
-        df_new_unique = df_new_data[~df_new_data['Réf.WEB'].isin(conflicting_refs)].copy()
-        df_new_conflicts = df_new_data[df_new_data['Réf.WEB'].isin(conflicting_refs)].copy()
-        
-        print(f"Nouvelles données uniques (pas de conflit): {len(df_new_unique)} lignes")
-        print(f"Nouvelles données en conflit: {len(df_new_conflicts)} lignes")
-        
-        # Traiter les conflits avec priorité intelligente
-        conflicts_resolved = 0
-        data_completed = 0
-        
-        if len(df_new_conflicts) > 0:
-            print("=== RÉSOLUTION DES CONFLITS ===")
-            
-            for ref in conflicting_refs:
-                old_row = df_old[df_old['Réf.WEB'] == ref].iloc[0]
-                new_row = df_new_conflicts[df_new_conflicts['Réf.WEB'] == ref].iloc[0]
-                
-                # Analyser chaque colonne pour détecter les données manquantes
-                for col in common_columns:
-                    if col != 'Réf.WEB':  # Ne pas modifier la référence
-                        old_value = old_row[col]
-                        new_value = new_row[col]
-                          # Vérifier si l'ancienne valeur est manquante/vide
-                        old_is_empty = (pd.isna(old_value) or 
-                                      old_value == '' or 
-                                      old_value == 0 or 
-                                      str(old_value).strip() == '' or
-                                      str(old_value).lower() in ['nan', 'null', 'none', '<na>'])
-                        
-                        # Vérifier si la nouvelle valeur apporte des données
-                        new_has_data = (not pd.isna(new_value) and 
-                                      new_value != '' and 
-                                      new_value != 0 and 
-                                      str(new_value).strip() != '' and
-                                      str(new_value).lower() not in ['nan', 'null', 'none', '<na>'])
-                        
-                        # Si l'ancien est vide et le nouveau a des données, on complète
-                        if old_is_empty and new_has_data:
-                            df_old.loc[df_old['Réf.WEB'] == ref, col] = new_value
-                            data_completed += 1
-                            print(f"  ✓ {ref} - Colonne '{col}': Complété '{old_value}' → '{new_value}'")
-                        elif not old_is_empty and new_has_data and old_value != new_value:
-                            # Conflit réel : priorité à l'ancien fichier
-                            print(f"  → {ref} - Colonne '{col}': Ancien conservé '{old_value}' (nouveau: '{new_value}')")
-                            conflicts_resolved += 1
-                
-        # Combiner : ancien fichier (mis à jour) + nouvelles données uniques
-        df_combined = pd.concat([df_old, df_new_unique], ignore_index=True)
-        
-        print(f"=== RÉSULTAT COMBINAISON INTELLIGENTE ===")
-        print(f"Total lignes combinées: {len(df_combined)}")
-        print(f"Anciennes données (conservées): {len(df_old)}")
-        print(f"Nouvelles données uniques ajoutées: {len(df_new_unique)}")
-        print(f"Conflits résolus (priorité ancien): {conflicts_resolved}")
-        print(f"Données complétées (ancien vide): {data_completed}")
-        print(f"Doublons évités: {len(conflicting_refs)}")
-        
-        return df_combined
-        
+        rows = future.result()
     except Exception as e:
-        print(f"ERREUR lors de la combinaison intelligente: {e}")
-        print("Retour des nouvelles données uniquement")
-        return df_new_data
+        # Le traitement complet relira le fichier et signalera la même erreur
+        logger.warning("Préparation de l'envoi %s impossible: %s", upload_id, e)
+        chunked_uploads.update(upload_id, preparation='error', error=str(e))
+        return
+    logger.info("Envoi %s préparé (%s)", upload_id, 'déjà en cache' if rows is None else f'{rows} lignes')
+    chunked_uploads.update(upload_id, preparation='done')
+
+def submit_prepare_job(manifest):
+    """
+    Met en file d'attente la préparation d'un fichier d'entrée complet. Sans objet sans cache
+    d'étape, et pour les fichiers assez gros pour le mode en flux (qui ne lit pas ce cache).
+    """
+    input_type = UPLOAD_INPUT_TYPES.get(manifest['file_key'])
+    too_large = STREAMING_THRESHOLD_MB > 0 and manifest['size'] > STREAMING_THRESHOLD_MB * 1024 * 1024
+    if input_type is None or stage_cache is None or too_large:
+        return manifest
+    manifest = chunked_uploads.update(manifest['id'], preparation='queued')
+    executor, _ = get_job_executor()
+    future = executor.submit(run_prepare_input_job, input_type, manifest['path'],
+                             (manifest['content_hash'], manifest['encoding']))
+    future.add_done_callback(functools.partial(finish_prepare_job, manifest['id']))
+    return manifest
+
+def get_job_state(job_id):
+    """État d'une tâche, ou None si elle est inconnue"""
+    if _job_states is None:
+        return None
+    state = _job_states.get(job_id)
+    return dict(state) if state is not None else None
+
+def wants_json_response():
+    """La requête attend-elle du JSON (appel AJAX) plutôt qu'une page HTML ?"""
+    return request.headers.get('Content-Type') == 'application/json' or 'application/json' in request.headers.get('Accept', '')
+
+def parse_ledger_range(params):
+    """
+    Période (début, fin) demandée pour le rendu du registre, champs ledger_start/ledger_end
+    au format AAAA-MM-JJ (vides: pas de borne). None si une date est invalide.
+    """
+    bounds = []
+    for key in ('ledger_start', 'ledger_end'):
+        value = (params.get(key) or '').strip()
+        if value:
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+            except ValueError:
+                return None
+        bounds.append(value or None)
+    return tuple(bounds)
 
 @app.route('/')
 def index():
@@ -1705,34 +3406,42 @@ def index():
 @app.route('/process', methods=['POST'])
 def process_files():
     """Traite les fichiers uploadés et génère le tableau consolidé"""
-    print(f"\n{'*'*80}")
-    print(f"ROUTE /process APPELÉE!")
-    print(f"Method: {request.method}")
-    print(f"Content-Type: {request.content_type}")
-    print(f"Content-Length: {request.content_length}")
-    print(f"Form keys: {list(request.form.keys())}")
-    print(f"Files keys: {list(request.files.keys())}")
-    print(f"{'*'*80}\n")
-    
     logger.info("=== DEBUT DU TRAITEMENT ===")
-    logger.info(f"Méthode HTTP: {request.method}")
-    logger.info(f"URL: {request.url}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    logger.info(f"Form keys: {list(request.form.keys())}")
-    logger.info(f"Files keys: {list(request.files.keys())}")
+    logger.info("Méthode HTTP: %s", request.method)
+    logger.info("URL: %s", request.url)
+    logger.debug("Content-Type: %s, Content-Length: %s", request.content_type, request.content_length)
+    logger.debug("Headers: %s", dict(request.headers))
+    logger.info("Form keys: %s", list(request.form.keys()))
+    logger.info("Files keys: %s", list(request.files.keys()))
     
     try:
         # Récupérer le mode de traitement
         processing_mode = request.form.get('processing_mode', 'new')
-        logger.info(f"Mode de traitement: {processing_mode}")
+        logger.info("Mode de traitement: %s", processing_mode)
         
         # Vérification de la présence de tous les fichiers requis
         required_files = ['orders_file', 'transactions_file', 'journal_file']
         files = {}
         
+        # Fichiers déjà reçus par l'envoi par morceaux (champ <fichier>_upload)
+        uploads = {}
+        for file_key in CHUNKED_UPLOAD_EXTENSIONS:
+            upload_id = request.form.get(f'{file_key}_upload')
+            if not upload_id:
+                continue
+            upload = chunked_uploads.get(upload_id)
+            if upload is None or upload['status'] != 'complete' or upload['file_key'] != file_key:
+                error_msg = f'L\'envoi du fichier {file_key.replace("_", " ")} est introuvable ou incomplet.'
+                logger.error(error_msg)
+                flash(error_msg)
+                return redirect(url_for('index'))
+            uploads[file_key] = upload
+        
         logger.info("Vérification des fichiers requis...")
         for file_key in required_files:
-            logger.debug(f"Vérification du fichier: {file_key}")
+            logger.debug("Vérification du fichier: %s", file_key)
+            if file_key in uploads:
+                continue
             if file_key not in request.files:
                 error_msg = f'Le fichier {file_key.replace("_", " ")} est manquant.'
                 logger.error(error_msg)
@@ -1740,7 +3449,7 @@ def process_files():
                 return redirect(url_for('index'))
             
             file = request.files[file_key]
-            logger.debug(f"Fichier {file_key}: nom='{file.filename}', taille={file.content_length if hasattr(file, 'content_length') else 'inconnue'}")
+            logger.debug("Fichier %s: nom='%s', taille=%s", file_key, file.filename, file.content_length if hasattr(file, 'content_length') else 'inconnue')
             
             if file.filename == '':
                 error_msg = f'Veuillez sélectionner un fichier pour {file_key.replace("_", " ")}.'
@@ -1762,264 +3471,639 @@ def process_files():
         old_file = None
         if processing_mode == 'combine':
             logger.info("Mode combinaison: vérification du fichier ancien...")
-            if 'old_file' not in request.files or request.files['old_file'].filename == '':
-                error_msg = 'Veuillez sélectionner un ancien fichier à compléter.'
-                logger.error(error_msg)
-                flash(error_msg)
-                return redirect(url_for('index'))
-            
-            old_file = request.files['old_file']
-            logger.debug(f"Fichier ancien: nom='{old_file.filename}'")
-            
-            if not (old_file.filename.endswith('.xlsx') or old_file.filename.endswith('.csv')):
-                error_msg = 'L\'ancien fichier doit être au format Excel (.xlsx) ou CSV (.csv).'
+            if 'old_file' not in uploads:
+                if 'old_file' not in request.files or request.files['old_file'].filename == '':
+                    error_msg = 'Veuillez sélectionner un ancien fichier à compléter.'
+                    logger.error(error_msg)
+                    flash(error_msg)
+                    return redirect(url_for('index'))
+                
+                old_file = request.files['old_file']
+                logger.debug("Fichier ancien: nom='%s'", old_file.filename)
+                
+                if not (old_file.filename.endswith('.xlsx') or old_file.filename.endswith('.csv')):
+                    error_msg = 'L\'ancien fichier doit être au format Excel (.xlsx) ou CSV (.csv).'
+                    logger.error(error_msg)
+                    flash(error_msg)
+                    return redirect(url_for('index'))
+                
+                files['old_file'] = old_file
+        
+        # En mode registre, l'ancien fichier est facultatif: il sert à reprendre l'historique
+        ledger_range = None
+        if processing_mode == 'ledger':
+            ledger_range = parse_ledger_range(request.form)
+            if ledger_range is None:
+                error_msg = 'Période invalide: les dates doivent être au format AAAA-MM-JJ.'
                 logger.error(error_msg)
                 flash(error_msg)
                 return redirect(url_for('index'))
             
-            files['old_file'] = old_file
-        
-        # Sauvegarde temporaire des fichiers
+            if 'old_file' not in uploads and 'old_file' in request.files and request.files['old_file'].filename != '':
+                old_file = request.files['old_file']
+                logger.debug("Fichier à reprendre dans le registre: nom='%s'", old_file.filename)
+                if not (old_file.filename.endswith('.xlsx') or old_file.filename.endswith('.csv')):
+                    error_msg = 'L\'ancien fichier doit être au format Excel (.xlsx) ou CSV (.csv).'
+                    logger.error(error_msg)
+                    flash(error_msg)
+                    return redirect(url_for('index'))
+                files['old_file'] = old_file
+        
+        # Fichiers reçus placés dans uploads/, préfixés par l'identifiant de la tâche
+        # pour que deux traitements simultanés ne s'écrasent pas (renommage s'ils sont déjà
+        # sur disque, voir UploadSpool); empreintes et encodages transmis au traitement
+        job_id = uuid.uuid4().hex
         temp_paths = {}
+        file_digests = {}
         logger.info("Sauvegarde temporaire des fichiers...")
         try:
             for file_key, file in files.items():
-                filename = secure_filename(file.filename)
+                filename = f"{job_id}_{secure_filename(file.filename)}"
                 temp_path = os.path.join(UPLOAD_FOLDER, filename)
-                logger.debug(f"Sauvegarde {file_key} vers: {temp_path}")
-                file.save(temp_path)
+                logger.debug("Sauvegarde %s vers: %s", file_key, temp_path)
+                if isinstance(file.stream, UploadSpool):
+                    file_digests[temp_path] = file.stream.save_to(temp_path)
+                else:
+                    file.save(temp_path)
                 temp_paths[file_key] = temp_path
-                logger.debug(f"Fichier {file_key} sauvegardé avec succès")
+                logger.debug("Fichier %s sauvegardé avec succès", file_key)
+            
+            # Fichiers envoyés par morceaux: déjà dans uploads/, vérifiés et analysés à la fin de l'envoi
+            for file_key, upload in uploads.items():
+                if file_key == 'old_file' and processing_mode not in ('combine', 'ledger'):
+                    continue
+                temp_paths[file_key] = upload['path']
+                file_digests[upload['path']] = (upload['content_hash'], upload['encoding'])
                 
         except Exception as e:
-            logger.error(f"Erreur lors de la sauvegarde des fichiers: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.error("Erreur lors de la sauvegarde des fichiers: %s", e)
+            logger.error("Traceback: %s", traceback.format_exc())
             flash(f"Erreur lors de la sauvegarde des fichiers: {str(e)}")
             return redirect(url_for('index'))
             
-        # Génération des nouvelles données
-        df_new_data = generate_consolidated_billing_table(
-            temp_paths['orders_file'],
-            temp_paths['transactions_file'], 
-            temp_paths['journal_file']
-        )
-        
-        # Traitement selon le mode
-        if processing_mode == 'combine' and old_file:
-            # Mode combinaison : fusionner avec l'ancien fichier
-            old_file_path = os.path.join(UPLOAD_FOLDER, secure_filename(old_file.filename))
-            old_file.save(old_file_path)
-            temp_paths['old_file'] = old_file_path
-            
-            df_result = combine_with_old_file(df_new_data, old_file_path)
-            flash(f'Fichiers combinés avec succès! Fusion intelligente effectuée. Total: {len(df_result)} lignes.', 'success')
-        else:
-            # Mode nouveau fichier
-            df_result = df_new_data
-            flash(f'Tableau généré avec succès! {len(df_result)} lignes traitées.', 'success')
-          # Création du fichier de sortie avec timestamp au format DD_MM_YYYY
-            timestamp = datetime.now().strftime('%d_%m_%Y')
-            output_filename = f'Compta_LCDI_Shopify_{timestamp}.csv'
-            output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-              # Sauvegarde avec formatage conditionnel (Excel) ou CSV si pas possible
-            final_path, is_excel = save_with_conditional_formatting(df_result, output_path)
-            
-            if is_excel:
-                flash(f'Tableau Excel généré avec succès! {len(df_result)} lignes traitées. Les informations manquantes sont en rouge clair.', 'success')
-                download_filename = os.path.basename(final_path)
-            else:
-                flash(f'Tableau CSV généré avec succès! {len(df_result)} lignes traitées.', 'success')
-                download_filename = os.path.basename(final_path)
-              # Rediriger vers la page de succès qui gère le téléchargement automatique
-            return redirect(url_for('success_page', filename=download_filename))
+        # Mêmes fichiers déjà traités: le classeur existant est servi directement
+        # (sauf en mode registre, dont le résultat dépend du contenu du registre)
+        cache_key = None
+        cached = None
+        if processing_mode != 'ledger':
+            cache_key = result_cache.make_key(temp_paths, processing_mode)
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Résultat en cache (%s): %s", cache_key, cached['filename'])
+            # Les fichiers envoyés par morceaux restent disponibles pour un autre traitement
+            for file_key, temp_path in temp_paths.items():
+                if file_key not in uploads:
+                    os.remove(temp_path)
+            if wants_json_response():
+                return {'status': 'done', 'cached': True, 'filename': cached['filename'],
+                        'redirect_url': url_for('success_page', filename=cached['filename'])}
+            return redirect(url_for('success_page', filename=cached['filename']))
+        
+        # Consolidation et génération Excel en arrière-plan: la requête rend la main immédiatement
+        submit_billing_job(job_id, temp_paths, processing_mode, cache_key, ledger_range, file_digests)
+        logger.info("Tâche %s mise en file d'attente (mode: %s)", job_id, processing_mode)
+        
+        if wants_json_response():
+            return {'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}, 202
+        
+        # Page d'attente qui suit la progression puis redirige vers la page de succès
+        return redirect(url_for('job_page', job_id=job_id))
         
     except Exception as e:
-        logger.error(f'Erreur lors du traitement: {str(e)}')
-        logger.error(f'Traceback: {traceback.format_exc()}')
+        logger.error("Erreur lors du traitement: %s", e)
+        logger.error("Traceback: %s", traceback.format_exc())
         flash(f'Erreur lors du traitement: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def upload_status(manifest):
+    """État d'un envoi par morceaux: morceaux reçus (pour la reprise) et préparation du fichier"""
+    return {
+        'upload_id': manifest['id'],
+        'file_key': manifest['file_key'],
+        'filename': manifest['filename'],
+        'size': manifest['size'],
+        'chunk_size': manifest['chunk_size'],
+        'chunk_count': manifest['chunk_count'],
+        'received': sorted(int(index) for index in manifest['chunks']),
+        'status': manifest['status'],
+        'sha256': manifest['sha256'],
+        'preparation': manifest.get('preparation'),
+        'error': manifest.get('error'),
+    }
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Début d'un envoi par morceaux: JSON {file_key, filename, size, sha256 (facultatif)}"""
+    payload = request.get_json(silent=True) or {}
+    file_key = payload.get('file_key')
+    filename = str(payload.get('filename') or '')
+    size = payload.get('size')
+    sha256 = payload.get('sha256')
+
+    extensions = CHUNKED_UPLOAD_EXTENSIONS.get(file_key)
+    if extensions is None:
+        return {'error': f"Fichier inconnu: {file_key}"}, 400
+    if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in extensions:
+        formats = ', '.join(sorted(f'.{extension}' for extension in extensions))
+        return {'error': f"Le fichier {filename} doit être au format {formats}."}, 400
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return {'error': "Taille du fichier invalide."}, 400
+    if size > UPLOAD_MAX_BYTES:
+        return {'error': f"Le fichier est trop volumineux. Taille maximale: {UPLOAD_MAX_BYTES // (1024 * 1024)}MB."}, 413
+    if sha256 is not None and not re.fullmatch(r'[0-9a-fA-F]{64}', str(sha256)):
+        return {'error': "Empreinte sha256 invalide."}, 400
+
+    manifest = chunked_uploads.create(file_key, filename, size, sha256)
+    logger.info("Envoi %s créé: %s (%s octets, %s morceaux)", manifest['id'], manifest['filename'],
+                size, manifest['chunk_count'])
+    return upload_status(manifest), 201
+
+@app.route('/uploads/<upload_id>')
+def upload_state(upload_id):
+    """État d'un envoi: le client reprend après une coupure en n'envoyant que les morceaux manquants"""
+    manifest = chunked_uploads.get(upload_id)
+    if manifest is None:
+        return {'error': 'Envoi inconnu'}, 404
+    return upload_status(manifest)
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """Morceau index d'un envoi (corps brut); en-tête X-Chunk-SHA256 vérifié s'il est fourni"""
+    try:
+        manifest = chunked_uploads.write_chunk(upload_id, index, request.get_data(cache=False),
+                                               request.headers.get('X-Chunk-SHA256'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    if manifest is None:
+        return {'error': 'Envoi inconnu'}, 404
+    return {'upload_id': upload_id, 'index': index, 'received_count': len(manifest['chunks'])}
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """
+    Fin d'un envoi: vérification du fichier assemblé puis préparation immédiate du fichier
+    en arrière-plan, sans attendre les autres fichiers (voir BillingPipeline.prepare_input)
+    """
+    try:
+        manifest = chunked_uploads.complete(upload_id)
+    except ValueError as e:
+        return {'error': str(e)}, 409
+    if manifest is None:
+        return {'error': 'Envoi inconnu'}, 404
+    if manifest.get('preparation') is None:
+        manifest = submit_prepare_job(manifest)
+    return upload_status(manifest)
+
 @app.errorhandler(413)
 def too_large(e):
-    """Gestion des fichiers trop volumineux"""
-    flash('Le fichier est trop volumineux. Taille maximale: 16MB.', 'error')
+    """Gestion des fichiers trop volumineux (JSON pour l'envoi par morceaux et les appels AJAX)"""
+    logger.error("Fichier trop volumineux: %s", request.url)
+    message = f'Le fichier est trop volumineux. Taille maximale: {MAX_CONTENT_LENGTH // (1024 * 1024)}MB.'
+    if request.path.startswith('/uploads') or wants_json_response():
+        return {'error': message}, 413
+    flash(message, 'error')
     return redirect(url_for('index'))
 
-def save_with_conditional_formatting(df_result, output_path):
+# Colonnes où les données manquantes sont surlignées en rouge dans l'export Excel
+EXCEL_IMPORTANT_COLUMNS = ['Réf. LMB', 'Date Facture', 'Etat', 'Client']
+
+# Mode de surlignage des données manquantes dans l'export Excel:
+# - 'fill' (défaut, classeurs inchangés): remplissage rouge appliqué cellule par cellule
+# - 'conditional': règles de formatage conditionnel ISBLANK par colonne (gérées par Excel,
+#   restent justes quand les cellules sont complétées plus tard, fichier plus léger)
+EXCEL_MISSING_HIGHLIGHT = os.environ.get('EXCEL_MISSING_HIGHLIGHT', 'fill')
+
+def build_excel_styles():
+    """Styles partagés par les deux modes d'écriture Excel (en mémoire et en flux)"""
+    from openpyxl.styles import PatternFill, Font
+
+    return {
+        # Rouge encore plus profond pour les cellules manquantes et INCOMPLET
+        'missing_fill': PatternFill(start_color='CC0000', end_color='CC0000', fill_type='solid'),
+        'incomplete_fill': PatternFill(start_color='CC0000', end_color='CC0000', fill_type='solid'),
+        # Vert plus profond pour COMPLET
+        'complete_fill': PatternFill(start_color='66CC66', end_color='66CC66', fill_type='solid'),
+        # Blanc: le formatage de la colonne Statut est géré par Excel
+        'neutral_fill': PatternFill(start_color='FFFFFF', end_color='FFFFFF', fill_type='solid'),
+        'arial_font': Font(name='Arial', size=10),  # Police Arial par défaut
+        'header_font': Font(name='Arial', bold=True, size=10),
+        'shopify_header_font': Font(name='Arial', color='FF0000', bold=True, size=10),  # Rouge pour l'en-tête
+        'shopify_content_font': Font(name='Arial', color='FF0000', size=10),  # Rouge pour le contenu
+    }
+
+def build_statut_formula(ref_lmb_col, reste_col, excel_row):
     """
-    Sauvegarde le DataFrame en Excel avec formatage conditionnel rouge clair 
-    pour les cellules vides/manquantes
+    Formule Excel du statut: COMPLET si Réf. LMB non vide ET reste = 0
+    (même règle que compute_completeness_status, qui remplit le statut hors Excel)
+    """
+    return f'=IF(AND({ref_lmb_col}{excel_row}<>"",{reste_col}{excel_row}=0),"COMPLET","INCOMPLET")'
+
+def compute_excel_column_widths(df_result, statut_width=None):
+    """
+    Calcule la largeur de chaque colonne Excel à partir du DataFrame
+    (longueurs de chaînes vectorisées, en-tête compris, maximum 50 caractères).
+    statut_width: longueur du contenu de la colonne Statut (formules), si connue.
     """
+    from openpyxl.utils import get_column_letter
+
+    widths = {}
+    for col_idx, col_name in enumerate(df_result.columns):
+        if col_name == 'Statut' and statut_width is not None:
+            max_length = statut_width
+        else:
+            values = df_result.iloc[:, col_idx]
+            # Copie explicite: sur une colonne objet, astype(str) peut réécrire le bloc d'origine
+            lengths = values.copy().astype(str).str.len().where(values.notna(), 0)
+            max_length = int(lengths.max()) if len(lengths) else 0
+        max_length = max(max_length, len(str(col_name)))
+        widths[get_column_letter(col_idx + 1)] = min(max_length + 2, 50)  # Max 50 caractères
+    return widths
+
+def _copy_style_array(style_array, cell):
+    cell._style = copy(style_array)
+
+def _apply_named_style(style_name, cell):
+    cell.style = style_name
+
+def build_excel_cell_styles(ws, styles):
+    """
+    Prépare chaque combinaison police/remplissage utilisée dans le tableau:
+    {nom: fonction appliquant le style à une cellule}.
+    Affecter cell.font / cell.fill recalcule le hash du style à chaque cellule. Avec openpyxl 3.1
+    (openpyxl==3.1.2 dans requirements.txt), le style interne déjà enregistré dans le classeur
+    (StyleArray, attribut privé cell._style) est copié tel quel. Si une autre version d'openpyxl
+    n'a plus cette structure, les combinaisons deviennent des styles nommés (NamedStyle, API
+    publique, environ trois fois plus lente).
+    """
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import NamedStyle
     try:
-        # Essayer d'importer openpyxl pour Excel
+        from openpyxl.styles.cell_style import StyleArray
+    except ImportError:
+        StyleArray = None
+
+    combinations = {
+        'default': ('arial_font', None),
+        'missing': ('arial_font', 'missing_fill'),
+        'statut': ('arial_font', 'neutral_fill'),
+        'statut_fallback': ('arial_font', 'incomplete_fill'),
+        'shopify': ('shopify_content_font', None),
+    }
+    cell_styles = {}
+    for name, (font, fill) in combinations.items():
+        template = WriteOnlyCell(ws)
+        template.font = styles[font]
+        if fill:
+            template.fill = styles[fill]
+        style_array = getattr(template, '_style', None)
+        if StyleArray is not None and isinstance(style_array, StyleArray):
+            cell_styles[name] = functools.partial(_copy_style_array, style_array)
+        else:
+            named_style = NamedStyle(name=f'LCDI {name}', font=styles[font])
+            if fill:
+                named_style.fill = styles[fill]
+            ws.parent.add_named_style(named_style)
+            cell_styles[name] = functools.partial(_apply_named_style, named_style.name)
+    return cell_styles
+
+def add_excel_conditional_formatting(ws, columns, n_rows, styles, missing_highlight):
+    """
+    Ajoute les règles de formatage conditionnel au niveau des plages de colonnes:
+    - Statut: vert si "COMPLET", rouge si "INCOMPLET"
+    - Colonnes importantes (mode 'conditional'): rouge si la cellule est vide (ISBLANK)
+    """
+    from openpyxl.formatting.rule import CellIsRule, FormulaRule
+    from openpyxl.utils import get_column_letter
+
+    last_row = n_rows + 1
+    for col_idx, col_name in enumerate(columns):
+        col_letter = get_column_letter(col_idx + 1)
+        col_range = f"{col_letter}2:{col_letter}{last_row}"
+
+        if col_name == 'Statut':
+            ws.conditional_formatting.add(col_range, CellIsRule(operator='equal', formula=['"COMPLET"'], fill=styles['complete_fill']))
+            ws.conditional_formatting.add(col_range, CellIsRule(operator='equal', formula=['"INCOMPLET"'], fill=styles['incomplete_fill']))
+            logger.debug("Formatage conditionnel appliqué à la plage %s", col_range)
+        elif col_name in EXCEL_IMPORTANT_COLUMNS and missing_highlight == 'conditional':
+            ws.conditional_formatting.add(col_range, FormulaRule(formula=[f'ISBLANK({col_letter}2)'], fill=styles['missing_fill']))
+
+class ExcelStreamWriter:
+    """
+    Écrit le tableau en Excel avec openpyxl en mode write-only (flux), bloc de lignes par
+    bloc de lignes (append): chaque ligne est émise une seule fois sous forme de WriteOnlyCell
+    déjà stylées, la mémoire reste donc bornée quel que soit le nombre de lignes.
+    Même rendu que l'écriture en mémoire: police Arial, en-têtes en gras,
+    cellules manquantes en rouge, formules et formatage conditionnel du Statut,
+    colonne Shopify en rouge, première ligne figée.
+    En mode write-only, les largeurs de colonnes sont fixées avant la première ligne:
+    elles sont calculées sur le premier bloc.
+    missing_highlight: 'fill' ou 'conditional' (voir EXCEL_MISSING_HIGHLIGHT)
+    total_rows: nombre total de lignes s'il est connu (largeur de la colonne Statut)
+    """
+
+    def __init__(self, excel_path, missing_highlight=None, total_rows=None):
         from openpyxl import Workbook
-        from openpyxl.styles import PatternFill
-        from openpyxl.utils.dataframe import dataframe_to_rows
-        import pandas as pd
-        
-        # Créer un nouveau classeur Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Tableau Facturation"
-          # Ajouter les données du DataFrame
-        for r in dataframe_to_rows(df_result, index=False, header=True):
-            ws.append(r)        # Définir les styles de formatage
-        # Rouge encore plus profond pour les cellules manquantes et INCOMPLET
-        missing_fill = PatternFill(start_color='CC0000', end_color='CC0000', fill_type='solid')  # Rouge encore plus profond
-        incomplete_fill = PatternFill(start_color='CC0000', end_color='CC0000', fill_type='solid')  # Même rouge encore plus profond        # Vert plus profond pour COMPLET
-        complete_fill = PatternFill(start_color='66CC66', end_color='66CC66', fill_type='solid')  # Vert plus profond
-          # Style pour les en-têtes (gras)
-        from openpyxl.styles import Font
-        arial_font = Font(name='Arial', size=10)  # Police Arial par défaut
-        header_font = Font(name='Arial', bold=True, size=10)
-        
-        # Style pour la colonne Shopify (texte rouge)
-        shopify_font = Font(name='Arial', color='FF0000', bold=True, size=10)  # Rouge pour l'en-tête
-        shopify_content_font = Font(name='Arial', color='FF0000', size=10)  # Rouge pour le contenu
-        
-        # Colonnes où vérifier les données manquantes (exclure les colonnes numériques qui sont à 0)
-        important_columns = ['Réf. LMB', 'Date Facture', 'Etat', 'Client']
-        header_row = [cell.value for cell in ws[1]]
-        
-        # Appliquer le formatage gras aux en-têtes (première ligne)
-        for col_idx, cell in enumerate(ws[1]):
-            if col_idx < len(header_row) and header_row[col_idx] == 'Shopify':
-                # En-tête Shopify en rouge gras
-                cell.font = shopify_font
-            else:
-                # Autres en-têtes en gras normal
-                cell.font = header_font
-        
-        # Trouver l'index de la colonne Statut et Shopify
-        statut_col_idx = None
-        shopify_col_idx = None
-        for idx, col_name in enumerate(header_row):
-            if col_name == 'Statut':
-                statut_col_idx = idx
-            elif col_name == 'Shopify':
-                shopify_col_idx = idx        # Appliquer le formatage aux cellules
-        for row_idx, row in enumerate(ws.iter_rows(min_row=2, max_row=ws.max_row), start=0):
-            for col_idx, cell in enumerate(row):
-                # Appliquer la police Arial par défaut à toutes les cellules
-                cell.font = arial_font
-                
-                # 1. Formatage des cellules vides dans les colonnes importantes
-                if col_idx < len(header_row) and header_row[col_idx] in important_columns:
-                    # Vérifier si la cellule correspondante dans le DataFrame est vide/NaN
-                    df_value = df_result.iloc[row_idx, col_idx]
-                    
-                    # Appliquer le formatage si la valeur est NaN, None, ou chaîne vide
-                    if pd.isna(df_value) or df_value == '' or df_value is None:
-                        cell.fill = missing_fill
-                        # Laisser la cellule vide (pas de texte)
-                        cell.value = None                # 2. Formatage et formules dynamiques de la colonne Statut
-                elif col_idx == statut_col_idx and statut_col_idx is not None:
-                    # Calculer la ligne Excel (en commençant à 2 car ligne 1 = en-têtes)
-                    excel_row = row_idx + 2
-                    
-                    # Identifier les colonnes nécessaires pour la formule
-                    ref_lmb_col = None
-                    reste_col = None
-                    
-                    # Fonction pour convertir index en lettre(s) Excel
-                    def col_index_to_letter(index):
-                        """Convertit un index de colonne (0-based) en lettre(s) Excel"""
-                        letter = ""
-                        while index >= 0:
-                            letter = chr(index % 26 + 65) + letter
-                            index = index // 26 - 1
-                        return letter
-                    
-                    for i, col_name in enumerate(header_row):
-                        if col_name == 'Réf. LMB':
-                            ref_lmb_col = col_index_to_letter(i)
-                        elif col_name == 'reste':
-                            reste_col = col_index_to_letter(i)
-                    
-                    # Créer la formule Excel dynamique
-                    if ref_lmb_col and reste_col:
-                        # Formule: SI ET les conditions sont remplies, alors "COMPLET", sinon "INCOMPLET"
-                        # Conditions: Réf. LMB non vide ET reste = 0
-                        formula = f'=IF(AND({ref_lmb_col}{excel_row}<>"",{reste_col}{excel_row}=0),"COMPLET","INCOMPLET")'
-                        cell.value = formula
-                        print(f"DEBUG: Formule ajoutée ligne {excel_row}: {formula}")
-                        
-                        # Appliquer un formatage neutre car le formatage conditionnel sera géré par Excel
-                        cell.fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")  # Blanc
+
+        self.excel_path = excel_path
+        self.missing_highlight = missing_highlight or EXCEL_MISSING_HIGHLIGHT
+        self.missing_style = 'missing' if self.missing_highlight == 'fill' else 'default'
+        self.styles = build_excel_styles()
+        self.total_rows = total_rows
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Tableau Facturation")
+        self.columns = None
+        self.n_rows = 0
+
+    def _start(self, df_first):
+        """Colonnes spéciales, largeurs, volets figés et en-têtes, à partir du premier bloc"""
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+
+        ws = self.ws
+        columns = self.columns = list(df_first.columns)
+
+        # Colonnes spéciales et lettres Excel, calculées une seule fois
+        self.statut_col_idx = columns.index('Statut') if 'Statut' in columns else None
+        self.shopify_col_idx = columns.index('Shopify') if 'Shopify' in columns else None
+        self.ref_lmb_col = get_column_letter(columns.index('Réf. LMB') + 1) if 'Réf. LMB' in columns else None
+        self.reste_col = get_column_letter(columns.index('reste') + 1) if 'reste' in columns else None
+        self.has_statut_formula = self.ref_lmb_col is not None and self.reste_col is not None
+        self.missing_columns = [col_idx for col_idx, col_name in enumerate(columns) if col_name in EXCEL_IMPORTANT_COLUMNS]
+
+        # En mode write-only, largeurs et volets figés doivent être définis avant les lignes
+        n_rows = self.total_rows if self.total_rows is not None else len(df_first)
+        if self.has_statut_formula:
+            statut_width = len(build_statut_formula(self.ref_lmb_col, self.reste_col, n_rows + 1)) if n_rows else 0
+        else:
+            statut_width = len("INCOMPLET") if n_rows else 0
+        for column_letter, width in compute_excel_column_widths(df_first, statut_width).items():
+            ws.column_dimensions[column_letter].width = width
+        ws.freeze_panes = 'A2'
+
+        # En-têtes en gras (Shopify en rouge gras)
+        header_cells = []
+        for col_name in columns:
+            cell = WriteOnlyCell(ws, value=col_name)
+            cell.font = self.styles['shopify_header_font'] if col_name == 'Shopify' else self.styles['header_font']
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        self.cell_styles = build_excel_cell_styles(ws, self.styles)
+
+    def append(self, df_chunk):
+        """Écrit un bloc de lignes (mêmes colonnes que le premier bloc)"""
+        from openpyxl.cell import WriteOnlyCell
+
+        if self.columns is None:
+            self._start(df_chunk)
+        ws = self.ws
+        cell_styles = self.cell_styles
+        statut_col_idx = self.statut_col_idx
+        shopify_col_idx = self.shopify_col_idx
+
+        # Masques par colonne: cellules manquantes et montants Shopify non nuls
+        missing_masks = {}
+        for col_idx in self.missing_columns:
+            values = df_chunk.iloc[:, col_idx]
+            missing_masks[col_idx] = (values.isna() | values.eq('')).to_numpy()
+        shopify_red = None
+        if shopify_col_idx is not None:
+            shopify_values = df_chunk.iloc[:, shopify_col_idx]
+            shopify_red = (shopify_values.notna() & shopify_values.ne(0)).to_numpy()
+
+        for row_idx, row_values in enumerate(df_chunk.itertuples(index=False, name=None)):
+            excel_row = self.n_rows + row_idx + 2
+            row_cells = []
+            for col_idx, value in enumerate(row_values):
+                cell = WriteOnlyCell(ws)
+                style = 'default'
+
+                if col_idx in missing_masks:
+                    # Cellule manquante: laissée vide (rouge par remplissage ou par règle ISBLANK)
+                    if missing_masks[col_idx][row_idx]:
+                        style = self.missing_style
+                    else:
+                        cell.value = value
+                elif col_idx == statut_col_idx:
+                    if self.has_statut_formula:
+                        cell.value = build_statut_formula(self.ref_lmb_col, self.reste_col, excel_row)
+                        style = 'statut'
                     else:
-                        # Fallback si colonnes non trouvées
                         cell.value = "INCOMPLET"
-                        cell.fill = incomplete_fill
-                        print(f"DEBUG: Colonnes non trouvées pour formule, fallback ligne {excel_row}")
-                
-                # 3. Formatage de la colonne Shopify (texte rouge)
-                elif col_idx == shopify_col_idx and shopify_col_idx is not None:
-                    if cell.value is not None and cell.value != 0:
-                        cell.font = shopify_content_font
-          # Ajuster la largeur des colonnes
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if cell.value is not None and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)  # Max 50 caractères
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Appliquer le formatage conditionnel pour la colonne Statut
-        if statut_col_idx is not None:
-            from openpyxl.formatting.rule import CellIsRule
-            
-            # Convertir l'index de colonne en lettre Excel
-            def col_index_to_letter(index):
-                letter = ""
-                while index >= 0:
-                    letter = chr(index % 26 + 65) + letter
-                    index = index // 26 - 1
-                return letter
-            
-            statut_col_letter = col_index_to_letter(statut_col_idx)
-            
-            # Définir la plage de la colonne Statut (de ligne 2 à la dernière ligne)
-            statut_range = f"{statut_col_letter}2:{statut_col_letter}{ws.max_row}"
-            
-            # Règle pour "COMPLET" - fond vert
-            rule_complet = CellIsRule(operator='equal', formula=['"COMPLET"'], fill=complete_fill)
-            
-            # Règle pour "INCOMPLET" - fond rouge
-            rule_incomplet = CellIsRule(operator='equal', formula=['"INCOMPLET"'], fill=incomplete_fill)
-            
-            # Appliquer les règles de formatage conditionnel
-            ws.conditional_formatting.add(statut_range, rule_complet)
-            ws.conditional_formatting.add(statut_range, rule_incomplet)
-            
-            print(f"DEBUG: Formatage conditionnel appliqué à la plage {statut_range}")
-        
-        # Figer la première ligne (en-têtes de colonnes) pour qu'elle reste visible lors du défilement
-        ws.freeze_panes = 'A2'  # Fige tout ce qui est au-dessus de la ligne 2 (donc la ligne 1 avec les en-têtes)
+                        style = 'statut_fallback'
+                else:
+                    cell.value = value
+                    if col_idx == shopify_col_idx and shopify_red[row_idx]:
+                        style = 'shopify'
+
+                cell_styles[style](cell)
+
+                row_cells.append(cell)
+            ws.append(row_cells)
+        self.n_rows += len(df_chunk)
+
+    def close(self):
+        """Ajoute le formatage conditionnel (Statut et, selon le mode, cellules manquantes) et enregistre"""
+        if self.columns is None:
+            self._start(pd.DataFrame())
+        add_excel_conditional_formatting(self.ws, self.columns, self.n_rows, self.styles, self.missing_highlight)
+        self.wb.save(self.excel_path)
+        return self.excel_path
+
+def write_excel_streaming(df_result, excel_path, missing_highlight=None):
+    """
+    Écrit le tableau en Excel en mode write-only (flux), en un seul bloc (ExcelStreamWriter)
+    missing_highlight: 'fill' ou 'conditional' (voir EXCEL_MISSING_HIGHLIGHT)
+    """
+    writer = ExcelStreamWriter(excel_path, missing_highlight, total_rows=len(df_result))
+    writer.append(df_result)
+    return writer.close()
+
+def write_excel_in_memory(df_result, excel_path, missing_highlight=None):
+    """
+    Écrit le tableau en Excel avec un classeur complet en mémoire, puis applique
+    la mise en forme en un seul passage linéaire sur les cellules.
+    Les masques de valeurs manquantes et les lettres de colonnes sont calculés
+    une seule fois par colonne avant la boucle.
+    missing_highlight: 'fill' ou 'conditional' (voir EXCEL_MISSING_HIGHLIGHT)
+    """
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+    from openpyxl.utils.dataframe import dataframe_to_rows
+
+    missing_highlight = missing_highlight or EXCEL_MISSING_HIGHLIGHT
+    missing_style = 'missing' if missing_highlight == 'fill' else 'default'
+    styles = build_excel_styles()
+    columns = list(df_result.columns)
+    n_rows = len(df_result)
+
+    # Créer un nouveau classeur Excel
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Tableau Facturation"
+
+    # Ajouter les données du DataFrame
+    for r in dataframe_to_rows(df_result, index=False, header=True):
+        ws.append(r)
+
+    # Appliquer le formatage gras aux en-têtes (Shopify en rouge gras)
+    for col_name, cell in zip(columns, ws[1]):
+        cell.font = styles['shopify_header_font'] if col_name == 'Shopify' else styles['header_font']
+
+    # Colonnes spéciales et lettres Excel, calculées une seule fois
+    statut_col_idx = columns.index('Statut') if 'Statut' in columns else None
+    shopify_col_idx = columns.index('Shopify') if 'Shopify' in columns else None
+    ref_lmb_col = get_column_letter(columns.index('Réf. LMB') + 1) if 'Réf. LMB' in columns else None
+    reste_col = get_column_letter(columns.index('reste') + 1) if 'reste' in columns else None
+    has_statut_formula = ref_lmb_col is not None and reste_col is not None
+
+    # Masques des cellules vides/NaN dans les colonnes importantes
+    missing_masks = {}
+    for col_idx, col_name in enumerate(columns):
+        if col_name in EXCEL_IMPORTANT_COLUMNS:
+            values = df_result.iloc[:, col_idx]
+            missing_masks[col_idx] = (values.isna() | values.eq('')).to_numpy()
+
+    # Appliquer le formatage aux cellules (un seul passage)
+    cell_styles = build_excel_cell_styles(ws, styles)
+    for row_idx, row in enumerate(ws.iter_rows(min_row=2, max_row=n_rows + 1)):
+        excel_row = row_idx + 2
+        for col_idx, cell in enumerate(row):
+            # Police Arial par défaut pour toutes les cellules
+            style = 'default'
+
+            # 1. Cellules vides dans les colonnes importantes: pas de texte, fond rouge
+            #    (remplissage direct ou règle ISBLANK selon le mode)
+            if col_idx in missing_masks:
+                if missing_masks[col_idx][row_idx]:
+                    style = missing_style
+                    cell.value = None
+            # 2. Formules dynamiques de la colonne Statut
+            elif col_idx == statut_col_idx:
+                if has_statut_formula:
+                    cell.value = build_statut_formula(ref_lmb_col, reste_col, excel_row)
+                    # Formatage neutre: le formatage conditionnel est géré par Excel
+                    style = 'statut'
+                else:
+                    # Fallback si colonnes non trouvées
+                    cell.value = "INCOMPLET"
+                    style = 'statut_fallback'
+            # 3. Colonne Shopify: texte rouge pour les montants non nuls
+            elif col_idx == shopify_col_idx:
+                if cell.value is not None and cell.value != 0:
+                    style = 'shopify'
+
+            cell_styles[style](cell)
+
+    if statut_col_idx is not None:
+        if has_statut_formula:
+            logger.debug("Formules de statut ajoutées sur %s lignes", n_rows)
+        else:
+            logger.debug("Colonnes non trouvées pour formule, fallback INCOMPLET sur %s lignes", n_rows)
+
+    # Ajuster la largeur des colonnes (calculée depuis le DataFrame)
+    statut_width = None
+    if statut_col_idx is not None and n_rows:
+        statut_width = len(str(ws.cell(row=n_rows + 1, column=statut_col_idx + 1).value))
+    for column_letter, width in compute_excel_column_widths(df_result, statut_width).items():
+        ws.column_dimensions[column_letter].width = width
+
+    # Formatage conditionnel (Statut et, selon le mode, cellules manquantes)
+    add_excel_conditional_formatting(ws, columns, n_rows, styles, missing_highlight)
+
+    # Figer la première ligne (en-têtes de colonnes) pour qu'elle reste visible lors du défilement
+    ws.freeze_panes = 'A2'
+
+    wb.save(excel_path)
+    return excel_path
+
+def save_with_conditional_formatting(df_result, output_path, write_only=True, missing_highlight=None):
+    """
+    Sauvegarde le DataFrame en Excel avec formatage conditionnel rouge clair 
+    pour les cellules vides/manquantes
+    - write_only=True: écriture en flux (write_excel_streaming), mémoire bornée
+    - write_only=False: classeur complet construit en mémoire puis mis en forme
+    - missing_highlight: 'conditional' (règles ISBLANK) ou 'fill' (remplissage par cellule),
+      par défaut EXCEL_MISSING_HIGHLIGHT
+    """
+    try:
+        # Vérifier que openpyxl est disponible pour Excel
+        import openpyxl
         
         # Changer l'extension pour Excel
         excel_path = output_path.replace('.csv', '.xlsx')
         
-        # Sauvegarder le fichier Excel
-        wb.save(excel_path)
+        if write_only:
+            write_excel_streaming(df_result, excel_path, missing_highlight)
+            return excel_path, True
+        
+        write_excel_in_memory(df_result, excel_path, missing_highlight)
         
         return excel_path, True
         
     except ImportError:
         # Si openpyxl n'est pas disponible, sauvegarder en CSV normal
-        print("⚠️ openpyxl non disponible, sauvegarde en CSV")
+        logger.warning("⚠️ openpyxl non disponible, sauvegarde en CSV")
         df_result.to_csv(output_path, sep=';', decimal=',', index=False, encoding='utf-8-sig')
         return output_path, False
     except Exception as e:
         # En cas d'erreur avec Excel, fallback vers CSV
-        print(f"⚠️ Erreur lors de la création Excel : {e}")
+        logger.warning("⚠️ Erreur lors de la création Excel : %s", e)
         df_result.to_csv(output_path, sep=';', decimal=',', index=False, encoding='utf-8-sig')
         return output_path, False
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """État JSON d'une tâche: statut, étape en cours, progression et, à la fin, page de succès"""
+    state = get_job_state(job_id)
+    if state is None:
+        return {'error': 'Tâche inconnue', 'job_id': job_id}, 404
+
+    if state.get('status') == 'done':
+        state['redirect_url'] = url_for('success_page', filename=state['filename'])
+    return state
+
+@app.route('/ledger/export')
+def ledger_export():
+    """Rend le registre en Excel (paramètres ledger_start/ledger_end facultatifs) dans une tâche"""
+    ledger_range = parse_ledger_range(request.args)
+    if ledger_range is None:
+        if wants_json_response():
+            return {'error': 'Période invalide (format AAAA-MM-JJ)'}, 400
+        flash('Période invalide: les dates doivent être au format AAAA-MM-JJ.', 'error')
+        return redirect(url_for('index'))
+
+    job_id = uuid.uuid4().hex
+    submit_ledger_export_job(job_id, ledger_range)
+    logger.info("Tâche %s mise en file d'attente (rendu du registre, période: %s)", job_id, ledger_range)
+    if wants_json_response():
+        return {'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}, 202
+    return redirect(url_for('job_page', job_id=job_id))
+
+@app.route('/ledger/stats')
+def ledger_stats():
+    """Statistiques JSON du registre (lignes, période couverte, taille)"""
+    return BillingLedger(LEDGER_PATH).stats()
+
+@app.route('/metrics')
+def metrics():
+    """Mesures des étapes du pipeline et du cache au format texte Prometheus"""
+    return render_prometheus_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Statistiques JSON du cache des résultats (taux de succès, taille, évictions)"""
+    return result_cache.stats()
+
+@app.route('/processing/<job_id>')
+def job_page(job_id):
+    """Page d'attente: suit la progression de la tâche puis redirige vers la page de succès"""
+    if get_job_state(job_id) is None:
+        flash('Traitement introuvable.', 'error')
+        return redirect(url_for('index'))
+
+    return render_template('job.html', job_id=job_id, status_url=url_for('job_status', job_id=job_id))
+
 @app.route('/success/<filename>')
 def success_page(filename):
     """Page de succès qui gère le téléchargement automatique et le rechargement"""
@@ -2064,10 +4148,7 @@ def download_file(filename):
 @app.route('/test-post', methods=['POST', 'GET'])
 def test_post():
     """Route de test pour vérifier le fonctionnement des POST"""
-    print(f"\n{'='*60}")
-    print(f"ROUTE TEST-POST APPELÉE!")
-    print(f"Method: {request.method}")
-    print(f"{'='*60}\n")
+    logger.info("Route test-post appelée: %s", request.method)
     
     if request.method == 'POST':
         return "POST fonctionne!", 200
@@ -2079,13 +4160,15 @@ def test_post():
         '''
 
 if __name__ == '__main__':
+    # Nécessaire pour le pool de processus dans un exécutable Windows
+    multiprocessing.freeze_support()
     port = int(os.environ.get('PORT', 5000))
     debug_mode = os.environ.get('FLASK_ENV') == 'development'
     
-    print("=== DÉMARRAGE DE L'APPLICATION ===")
-    print("Application de génération de tableau de facturation LCDI")
-    print(f"Port: {port}")
-    print(f"Mode debug: {debug_mode}")
-    print("======================================")
+    logger.info("=== DÉMARRAGE DE L'APPLICATION ===")
+    logger.info("Application de génération de tableau de facturation LCDI")
+    logger.info("Port: %s", port)
+    logger.info("Mode debug: %s", debug_mode)
+    logger.info("======================================")
     
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
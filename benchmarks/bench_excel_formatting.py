@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la génération Excel formatée (save_with_conditional_formatting)
+
+Mesure le temps d'écriture + mise en forme du tableau final pour plusieurs
+tailles (10k, 100k et 500k lignes par défaut), en mode classeur en mémoire
+et en mode flux (write-only), avec surlignage des cellules manquantes par
+remplissage cellule par cellule ou par formatage conditionnel (ISBLANK).
+
+Usage:
+    python benchmarks/bench_excel_formatting.py
+    python benchmarks/bench_excel_formatting.py --rows 10000 50000 --modes streaming
+    python benchmarks/bench_excel_formatting.py --highlight conditional
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+DEFAULT_ROWS = [10_000, 100_000, 500_000]
+MODES = {
+    'memoire': app.write_excel_in_memory,
+    'streaming': app.write_excel_streaming,
+}
+HIGHLIGHTS = ['fill', 'conditional']
+
+def make_final_table(n_rows, seed=42):
+    """Génère un tableau final synthétique avec les colonnes de l'export réel"""
+    rng = np.random.default_rng(seed)
+    ttc = np.round(rng.uniform(5, 900, n_rows), 2)
+    ttc[rng.random(n_rows) < 0.05] = np.nan
+    ht = np.round(ttc / 1.2, 2)
+    missing = rng.random(n_rows) < 0.1
+
+    df = pd.DataFrame({
+        'Centre de profit': 'lcdi.fr',
+        'Réf.WEB': [f'#LCDI-{1000 + i}' for i in range(n_rows)],
+        'Réf. LMB': np.where(missing, '', [f'FAC-{i:06d}' for i in range(n_rows)]),
+        'Date Facture': np.where(rng.random(n_rows) < 0.05, None, '19/05/2025'),
+        'Etat': rng.choice(['payée', 'en attente', 'remboursée', ''], n_rows),
+        'Client': rng.choice(['Jean Dupont', 'Marie Curie', ''], n_rows),
+        'HT': ht,
+        'TVA': ttc - ht,
+        'TTC': ttc,
+        'reste': rng.choice([0.0, 12.5], n_rows, p=[0.9, 0.1]),
+        'Shopify': np.round(rng.uniform(0, 900, n_rows), 2),
+        'Frais de commission': np.round(rng.uniform(0, 20, n_rows), 2),
+    })
+    method = rng.integers(0, 6, n_rows)
+    for idx, category in enumerate(app.PAYMENT_CATEGORIES):
+        df[category] = np.where(method == idx, np.nan_to_num(ttc), 0.0)
+    df['Statut'] = ''
+    return df
+
+def run(rows_list, modes, highlights=HIGHLIGHTS):
+    # Les traces de l'application ne doivent pas se mêler aux mesures
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in rows_list:
+            df = make_final_table(n_rows)
+            for mode in modes:
+                for highlight in highlights:
+                    path = os.path.join(tmp_dir, f'bench_{mode}_{highlight}_{n_rows}.xlsx')
+                    start = time.perf_counter()
+                    MODES[mode](df, path, highlight)
+                    elapsed = time.perf_counter() - start
+                    size_kb = os.path.getsize(path) / 1024
+                    results.append({'rows': n_rows, 'mode': mode, 'highlight': highlight,
+                                    'seconds': elapsed, 'size_kb': size_kb})
+                    print(f"{n_rows:>9} lignes | {mode:<10} | {highlight:<11} | {elapsed:8.2f} s | {size_kb:10.0f} Ko")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de l'export Excel formaté")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=sorted(MODES))
+    parser.add_argument('--highlight', nargs='+', choices=HIGHLIGHTS, default=HIGHLIGHTS)
+    args = parser.parse_args()
+    run(args.rows, args.modes, args.highlight)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Benchmark du pipeline de consolidation sur des jeux synthétiques (benchmarks/generators.py)
+
+Pour chaque taille (1k, 10k et 100k commandes par défaut, jusqu'à 1M):
+- chaque étape du pipeline (BillingPipeline, sans cache d'étape) et l'export Excel,
+  mesurés avec le PipelineProfiler de l'application
+- le chemin complet /process: envoi des fichiers, traitement en arrière-plan et
+  interrogation de /jobs/<id> jusqu'à la fin (caches vides)
+
+Les résultats sont enregistrés en JSON dans benchmarks/results/ (un fichier par
+exécution, nommé d'après la date et le commit) pour comparer les commits entre eux.
+Le traitement s'exécute dans un dossier temporaire (uploads, output, cache, app.log)
+et la limite de taille des envois est levée pour les grands jeux.
+
+Usage:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --orders 1000 1000000 --skip-end-to-end
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/20250601-101500_ab12cd3.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from generators import JOURNAL_ENCODINGS, write_dataset
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DEFAULT_ORDERS = [1_000, 10_000, 100_000]
+REGRESSION_THRESHOLD = 1.2
+# Étapes trop courtes pour être comparées de façon fiable
+MIN_COMPARED_SECONDS = 0.05
+
+def git_revision():
+    """Commit courant (suffixe '-dirty' si des fichiers suivis sont modifiés)"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{revision}-dirty' if dirty else revision
+
+def bench_pipeline(app, paths, output_dir, repeat=1):
+    """Étapes du pipeline + export Excel; garde la plus rapide des répétitions"""
+    best = None
+    for _ in range(repeat):
+        profiler = app.PipelineProfiler('basic')
+        with profiler.activate():
+            df_final = app.BillingPipeline().run_from_files(paths['orders'], paths['transactions'], paths['journal'])
+            with profiler.stage('excel') as record:
+                app.save_with_conditional_formatting(df_final, os.path.join(output_dir, 'bench.xlsx'))
+                record['rows'] = {'final': len(df_final)}
+        metrics = profiler.to_dict()
+        if best is None or metrics['total_wall_s'] < best['total_wall_s']:
+            best = metrics
+    return best
+
+def bench_end_to_end(app, paths, timeout=3600):
+    """Chemin complet /process -> /jobs/<id> avec le client de test Flask"""
+    client = app.app.test_client()
+    headers = {'Accept': 'application/json'}
+    files = {key: open(paths[name], 'rb') for key, name in
+             [('orders_file', 'orders'), ('transactions_file', 'transactions'), ('journal_file', 'journal')]}
+    try:
+        start = time.perf_counter()
+        data = {'processing_mode': 'new'}
+        data.update({key: (handle, os.path.basename(handle.name)) for key, handle in files.items()})
+        response = client.post('/process', data=data, content_type='multipart/form-data', headers=headers)
+        submit_s = time.perf_counter() - start
+    finally:
+        for handle in files.values():
+            handle.close()
+    if response.status_code != 202:
+        raise RuntimeError(f"/process a répondu {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    status_url = response.get_json()['status_url']
+    while True:
+        job = client.get(status_url, headers=headers).get_json()
+        if job.get('status') in ('done', 'error'):
+            break
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(f"Tâche toujours en cours après {timeout} s")
+        time.sleep(0.05)
+    wall_s = time.perf_counter() - start
+    if job['status'] == 'error':
+        raise RuntimeError(f"Tâche en erreur: {job.get('error')}")
+
+    return {
+        'submit_s': round(submit_s, 6),
+        'wall_s': round(wall_s, 6),
+        'job_metrics': job.get('metrics'),
+    }
+
+def run(orders_list, seed=42, journal_encoding='windows-1252', repeat=1, end_to_end=True):
+    """Exécute le benchmark pour chaque taille; renvoie le rapport JSON"""
+    report = {
+        'commit': git_revision(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'journal_encoding': journal_encoding,
+        'runs': [],
+    }
+
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='lcdi_bench_') as work_dir:
+        # L'application crée uploads/, output/, cache/ et app.log dans le dossier courant
+        os.chdir(work_dir)
+        try:
+            os.environ.setdefault('LOG_LEVEL', 'WARNING')
+            sys.path.insert(0, REPO_DIR)
+            import app
+            app.app.config['MAX_CONTENT_LENGTH'] = None
+
+            for n_orders in orders_list:
+                data_dir = os.path.join(work_dir, f'data_{n_orders}')
+                start = time.perf_counter()
+                paths = write_dataset(data_dir, n_orders, seed, journal_encoding)
+                generate_s = time.perf_counter() - start
+
+                result = {
+                    'orders': n_orders,
+                    'input_bytes': {name: os.path.getsize(path) for name, path in paths.items()},
+                    'generate_s': round(generate_s, 6),
+                    'pipeline': bench_pipeline(app, paths, work_dir, repeat),
+                }
+                if end_to_end:
+                    result['end_to_end'] = bench_end_to_end(app, paths)
+                report['runs'].append(result)
+                print_run(result)
+        finally:
+            os.chdir(previous_cwd)
+    return report
+
+def print_run(result):
+    print(f"\n=== {result['orders']:,} commandes (génération {result['generate_s']:.1f} s) ===")
+    for stage in result['pipeline']['stages']:
+        rows = ', '.join(f'{name}={count}' for name, count in stage.get('rows', {}).items())
+        indent = '  ' * stage['depth']
+        print(f"  {indent + stage['name']:<40} {stage['wall_s']:9.3f} s  cpu {stage['cpu_s']:9.3f} s  {rows}")
+    print(f"  {'total pipeline + Excel':<40} {result['pipeline']['total_wall_s']:9.3f} s")
+    if 'end_to_end' in result:
+        print(f"  {'/process de bout en bout':<40} {result['end_to_end']['wall_s']:9.3f} s")
+
+def stage_timings(result):
+    """{nom d'étape: durée} d'une exécution, y compris le total et le bout en bout"""
+    timings = {stage['name']: stage['wall_s'] for stage in result['pipeline']['stages']}
+    timings['total'] = result['pipeline']['total_wall_s']
+    if 'end_to_end' in result:
+        timings['end_to_end'] = result['end_to_end']['wall_s']
+    return timings
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """Affiche les ratios par étape par rapport à un rapport précédent; renvoie le nombre de régressions"""
+    baseline_runs = {run['orders']: run for run in baseline['runs']}
+    regressions = 0
+    print(f"\n=== Comparaison avec {baseline['commit']} ({baseline['date']}) ===")
+    for result in report['runs']:
+        if result['orders'] not in baseline_runs:
+            continue
+        current, previous = stage_timings(result), stage_timings(baseline_runs[result['orders']])
+        print(f"  {result['orders']:,} commandes")
+        for name, seconds in current.items():
+            if not previous.get(name):
+                continue
+            ratio = seconds / previous[name]
+            flag = ''
+            if ratio > threshold and max(seconds, previous[name]) >= MIN_COMPARED_SECONDS:
+                flag = '  <- RÉGRESSION'
+                regressions += 1
+            print(f"    {name:<40} {previous[name]:9.3f} s -> {seconds:9.3f} s  x{ratio:5.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du pipeline de consolidation")
+    parser.add_argument('--orders', type=int, nargs='+', default=DEFAULT_ORDERS)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--journal-encoding', choices=JOURNAL_ENCODINGS, default='windows-1252')
+    parser.add_argument('--repeat', type=int, default=1, help='répétitions du pipeline (la plus rapide est gardée)')
+    parser.add_argument('--skip-end-to-end', action='store_true', help='ne pas mesurer le chemin /process')
+    parser.add_argument('--output', help=f'fichier JSON de résultats (défaut: {RESULTS_DIR}/<date>_<commit>.json)')
+    parser.add_argument('--compare', help='rapport JSON précédent à comparer')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='ratio au-delà duquel une étape est signalée comme régression')
+    args = parser.parse_args()
+
+    report = run(args.orders, args.seed, args.journal_encoding, args.repeat, not args.skip_end_to_end)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultats enregistrés dans {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
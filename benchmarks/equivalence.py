@@ -0,0 +1,602 @@
+#!/usr/bin/env python3
+"""
+Harnais d'équivalence: implémentation de référence contre implémentation candidate
+
+Les montants produits alimentent la comptabilité: une version optimisée de
+calculate_corrected_amounts, categorize_payment_method, improve_journal_matching ou
+du calcul des dates n'est adoptée que si elle produit le même tableau. Pour chaque
+cas, les deux versions reçoivent les mêmes entrées (jeux de benchmarks/generators.py
+passés dans le pipeline jusqu'à l'étape concernée), puis les résultats sont comparés
+cellule par cellule:
+- colonnes de montants: écart toléré d'un demi-centime (--tolerance, voir CASE_TOLERANCES),
+  montants au format français ou numériques comparés par valeur ('12,30' == 12.3)
+- autres colonnes: égalité stricte, les valeurs manquantes (NaN/None) étant égales entre elles
+Les premières lignes en écart sont affichées; le code de sortie vaut 1 en cas d'écart.
+
+Une version candidate externe se branche par --candidate cas=module:fonction (même
+signature que la fonction remplacée). Les sorties de référence peuvent être figées
+(--save-golden) puis servir de référence sur un autre commit (--golden); le tableau
+final complet (final_table) n'a pas d'autre référence et ne se compare qu'ainsi.
+
+Usage:
+    python benchmarks/equivalence.py
+    python benchmarks/equivalence.py --orders 20000 --seeds 1 2 3 --cases journal_matching
+    python benchmarks/equivalence.py --candidate corrected_amounts=fast_amounts:calculate_corrected_amounts
+    python benchmarks/equivalence.py --save-golden /tmp/golden    (puis --golden /tmp/golden)
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from generators import write_dataset
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_ORDERS = [2_000]
+DEFAULT_SEEDS = [42]
+MONEY_TOLERANCE = 0.005
+# Tolérances propres à un cas: la répartition des pièces multiples du candidat attribue
+# les centimes au plus fort reste (somme exacte), la référence arrondit chaque part: ±1 centime
+CASE_TOLERANCES = {'journal_matching': 0.01, 'journal_missing_order': 0.01}
+MAX_REPORTED_ROWS = 10
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, REPO_DIR)
+import app  # noqa: E402
+
+# Colonnes comparées avec la tolérance monétaire (en plus des colonnes numériques)
+MONEY_COLUMNS = (['HT', 'TVA', 'TTC', 'reste', 'Shopify', 'Frais de commission',
+                  'Total', 'Taxes', 'Tax 1 Value', 'Outstanding Balance',
+                  'Presentment Amount', 'Fee', 'Net']
+                 + app.PAYMENT_CATEGORIES + app.JOURNAL_AMOUNT_COLUMNS)
+
+def categorize_payments_reference(df_merged_final, ttc_amounts):
+    """Catégorisation d'origine: categorize_payment_method appliquée ligne par ligne"""
+    rows = [
+        app.categorize_payment_method(payment_orders, payment_transactions, ttc, fallback_amount=fallback)
+        for payment_orders, payment_transactions, ttc, fallback in zip(
+            df_merged_final.get('Payment Method', pd.Series(None, index=df_merged_final.index)),
+            df_merged_final.get('Payment Method Name', pd.Series(None, index=df_merged_final.index)),
+            ttc_amounts,
+            df_merged_final.get('Total', pd.Series(0, index=df_merged_final.index)),
+        )
+    ]
+    return pd.DataFrame(rows, index=df_merged_final.index, columns=app.PAYMENT_CATEGORIES)
+
+def categorize_payments_vectorized(df_merged_final, ttc_amounts):
+    """Catégorisation utilisée par le pipeline (même appel que stage_build_final_table)"""
+    return app.categorize_payment_methods_vectorized(
+        df_merged_final.get('Payment Method'),
+        df_merged_final.get('Payment Method Name'),
+        ttc_amounts,
+        fallback_amounts=df_merged_final.get('Total', 0),
+    )
+
+def format_dates_reference(values):
+    return values.apply(app.format_date_to_french)
+
+def improve_journal_matching_reference(df_orders, df_journal):
+    """
+    Implémentation d'origine (ligne par ligne) de improve_journal_matching,
+    conservée comme référence pour valider les versions optimisées (sans les traces)
+    """
+    # Copier les DataFrames pour éviter de modifier les originaux
+    df_orders_copy = df_orders.copy()
+    df_journal_copy = df_journal.copy()
+    
+    # Trouver la colonne de référence dans le journal (peut être 'Piece' après normalisation)
+    journal_ref_col = 'Piece'  # Nom standardisé après normalize_column_names
+    
+    if journal_ref_col not in df_journal_copy.columns:
+        return df_orders_copy  # Retourner les commandes sans fusion
+    
+    # Normaliser les références des commandes : toujours au format #LCDI-XXXX
+    df_orders_copy['Name_normalized'] = df_orders_copy['Name'].apply(
+        lambda x: x if str(x).startswith('#') else f"#{x}" if pd.notna(x) else None
+    )
+    
+    # Créer un dictionnaire de mapping : référence normalisée -> données journal
+    journal_mapping = {}
+    
+    # Pour chaque ligne du journal
+    for journal_idx, journal_row in df_journal_copy.iterrows():
+        journal_ref = journal_row[journal_ref_col]
+        if pd.isna(journal_ref):
+            continue
+            
+        journal_ref_str = str(journal_ref).strip()
+        
+        # Cas 1: Référence simple (ex: LCDI-1038 ou #LCDI-1038)
+        if ' ' not in journal_ref_str:
+            # Normaliser la référence
+            journal_normalized = journal_ref_str if journal_ref_str.startswith('#') else f"#{journal_ref_str}"
+            journal_mapping[journal_normalized] = journal_row          # Cas 2: Référence multiple (ex: LCDI-1020 LCDI-1021)
+        else:
+            import re
+            # Extraire tous les numéros de commandes
+            numbers = re.findall(r'LCDI-(\d+)', journal_ref_str)
+            
+            if numbers:
+                # Pour les références multiples, on doit répartir les montants
+                # Stratégie: calculer le poids de chaque commande et répartir proportionnellement
+                
+                # Récupérer les montants totaux des commandes concernées pour calculer les proportions
+                command_totals = {}
+                total_sum = 0
+                
+                for num in numbers:
+                    target_ref = f"#LCDI-{num}"
+                    # Trouver la commande correspondante dans df_orders_copy
+                    matching_orders = df_orders_copy[df_orders_copy['Name_normalized'] == target_ref]
+                    if not matching_orders.empty:
+                        order_total = pd.to_numeric(matching_orders.iloc[0]['Total'], errors='coerce')
+                        if pd.notna(order_total):
+                            command_totals[target_ref] = order_total
+                            total_sum += order_total
+                        else:
+                            command_totals[target_ref] = 0
+                    else:
+                        command_totals[target_ref] = 0
+
+                # Récupérer les montants du journal
+                journal_ttc = journal_row.get('Montant du document TTC', None)
+                journal_ht = journal_row.get('Montant du document HT', None)
+                journal_marge = journal_row.get('Montant marge HT', None)
+                
+                # Convertir les montants du journal au format numérique
+                if pd.notna(journal_ttc):
+                    try:
+                        journal_ttc_num = float(str(journal_ttc).replace(',', '.').replace(' ', ''))
+                    except:
+                        journal_ttc_num = None
+                else:
+                    journal_ttc_num = None
+                    
+                if pd.notna(journal_ht):
+                    try:
+                        journal_ht_num = float(str(journal_ht).replace(',', '.').replace(' ', ''))
+                    except:
+                        journal_ht_num = None
+                else:
+                    journal_ht_num = None
+                    
+                if pd.notna(journal_marge):
+                    try:
+                        journal_marge_num = float(str(journal_marge).replace(',', '.').replace(' ', ''))
+                    except:
+                        journal_marge_num = None
+                else:
+                    journal_marge_num = None
+
+                # Répartir les montants proportionnellement
+                for num in numbers:
+                    target_ref = f"#LCDI-{num}"
+                    
+                    # Créer une copie de la ligne journal pour cette commande
+                    proportional_journal_data = journal_row.copy()
+                    
+                    # Calculer la proportion de cette commande
+                    if total_sum > 0 and command_totals[target_ref] > 0:
+                        proportion = command_totals[target_ref] / total_sum
+                        
+                        # Répartir les montants
+                        if journal_ttc_num is not None:
+                            proportional_ttc = journal_ttc_num * proportion
+                            proportional_journal_data['Montant du document TTC'] = f"{proportional_ttc:.2f}".replace('.', ',')
+                        
+                        if journal_ht_num is not None:
+                            proportional_ht = journal_ht_num * proportion
+                            proportional_journal_data['Montant du document HT'] = f"{proportional_ht:.2f}".replace('.', ',')
+                        
+                        if journal_marge_num is not None:
+                            proportional_marge = journal_marge_num * proportion
+                            proportional_journal_data['Montant marge HT'] = f"{proportional_marge:.2f}".replace('.', ',')
+                            
+                    else:
+                        # Si pas de proportion calculable, distribuer équitablement
+                        equal_proportion = 1.0 / len(numbers)
+                        
+                        if journal_ttc_num is not None:
+                            equal_ttc = journal_ttc_num * equal_proportion
+                            proportional_journal_data['Montant du document TTC'] = f"{equal_ttc:.2f}".replace('.', ',')
+                        
+                        if journal_ht_num is not None:
+                            equal_ht = journal_ht_num * equal_proportion
+                            proportional_journal_data['Montant du document HT'] = f"{equal_ht:.2f}".replace('.', ',')
+                        
+                        if journal_marge_num is not None:
+                            equal_marge = journal_marge_num * equal_proportion
+                            proportional_journal_data['Montant marge HT'] = f"{equal_marge:.2f}".replace('.', ',')
+                    
+                    # Stocker le mapping
+                    journal_mapping[target_ref] = proportional_journal_data
+    
+    # Appliquer le mapping aux commandes
+    journal_data = []
+    for idx, row in df_orders_copy.iterrows():
+        order_ref = row['Name_normalized']
+        if order_ref in journal_mapping:
+            journal_data.append(journal_mapping[order_ref])
+        else:
+            # Créer une ligne vide avec les mêmes colonnes
+            empty_row = pd.Series(index=df_journal_copy.columns, dtype=object)
+            journal_data.append(empty_row)
+    
+    # Convertir en DataFrame
+    df_journal_mapped = pd.DataFrame(journal_data, index=df_orders_copy.index)
+    
+    # Concaténer horizontalement
+    return pd.concat([df_orders_copy, df_journal_mapped], axis=1)
+
+def calculate_invoice_dates_reference(df_merged_final):
+    """
+    Implémentation d'origine (boucles par ligne) de calculate_invoice_dates,
+    conservée comme référence pour valider la version vectorisée (sans les traces).
+    Calcule les dates de facture avec logique de priorité.
+    PRIORITÉ 1: Utilise "Date du document" du Journal si disponible
+    PRIORITÉ 2: Utilise "Fulfilled at" des commandes (date de livraison/expédition)
+    """
+    # Vérifier les colonnes disponibles
+    journal_date_available = 'Date du document' in df_merged_final.columns
+    fulfilled_date_available = 'Fulfilled at' in df_merged_final.columns
+    
+    # Initialiser la série des dates
+    invoice_dates = pd.Series([None] * len(df_merged_final))
+    
+    if journal_date_available:
+        # Convertir les dates du journal 
+        journal_dates = df_merged_final['Date du document'].copy()
+        
+        # Pour les lignes avec données Journal, utiliser la date du journal
+        mask_journal_available = journal_dates.notna() & (journal_dates != '') & (journal_dates != 'nan')
+        if mask_journal_available.any():
+            # Convertir format DD/MM/YYYY HH:MM:SS vers DD/MM/YYYY
+            for idx in journal_dates[mask_journal_available].index:
+                date_str = str(journal_dates[idx])
+                if ' ' in date_str:
+                    # Enlever la partie heure
+                    date_part = date_str.split(' ')[0]
+                    invoice_dates[idx] = date_part
+                else:
+                    invoice_dates[idx] = date_str
+    
+    if fulfilled_date_available:
+        # Pour les lignes sans date Journal, utiliser Fulfilled at
+        fulfilled_dates = df_merged_final['Fulfilled at'].copy()
+        
+        # Masque pour les lignes qui n'ont pas encore de date
+        mask_need_fulfilled = invoice_dates.isna() & fulfilled_dates.notna() & (fulfilled_dates != '') & (fulfilled_dates != 'nan')
+        
+        if mask_need_fulfilled.any():
+            # Convertir format ISO vers format MM/DD/YYYY
+            for idx in fulfilled_dates[mask_need_fulfilled].index:
+                date_str = str(fulfilled_dates[idx])
+                if 'T' in date_str or '+' in date_str:
+                    # Format: 2025-05-19 11:11:57 +0200 ou 2025-05-19T11:11:57+02:00
+                    try:
+                        # Enlever timezone et heure
+                        if '+' in date_str:
+                            date_str = date_str.split('+')[0]
+                        if 'T' in date_str:
+                            date_str = date_str.split('T')[0]
+                        elif ' ' in date_str:
+                            date_str = date_str.split(' ')[0]
+                          # Convertir YYYY-MM-DD vers DD/MM/YYYY (format français)
+                        from datetime import datetime
+                        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+                        invoice_dates[idx] = date_obj.strftime('%d/%m/%Y')
+                    except:
+                        # En cas d'erreur, garder la date originale
+                        invoice_dates[idx] = date_str
+                else:
+                    invoice_dates[idx] = date_str
+
+    return invoice_dates
+
+def _parse_amounts_reference(values):
+    """Conversion d'origine des montants du journal: texte, virgule -> point, espaces retirés"""
+    return pd.to_numeric(values.astype(str).str.replace(',', '.').str.replace(' ', ''), errors='coerce')
+
+def calculate_corrected_amounts_reference(df_merged_final):
+    """Calcul d'origine des montants HT, TVA, TTC (avant parse_french_amounts), sans les traces"""
+    df_merged_final = df_merged_final.loc[:, ~df_merged_final.columns.duplicated()]
+    ttc_amounts = pd.Series([None] * len(df_merged_final), dtype=float, index=df_merged_final.index)
+    ht_amounts = pd.Series([None] * len(df_merged_final), dtype=float, index=df_merged_final.index)
+    tva_amounts = pd.Series([None] * len(df_merged_final), dtype=float, index=df_merged_final.index)
+
+    if 'Montant du document TTC' in df_merged_final.columns:
+        ttc_amounts_journal = _parse_amounts_reference(df_merged_final['Montant du document TTC'])
+        mask_journal_ttc = ttc_amounts_journal.notna()
+        ttc_amounts.loc[mask_journal_ttc] = ttc_amounts_journal.loc[mask_journal_ttc]
+    if 'Montant du document HT' in df_merged_final.columns:
+        ht_amounts_journal = _parse_amounts_reference(df_merged_final['Montant du document HT'])
+        mask_journal_ht = ht_amounts_journal.notna()
+        ht_amounts.loc[mask_journal_ht] = ht_amounts_journal.loc[mask_journal_ht]
+        mask_both_journal = ttc_amounts.notna() & ht_amounts.notna()
+        tva_amounts.loc[mask_both_journal] = ttc_amounts.loc[mask_both_journal] - ht_amounts.loc[mask_both_journal]
+
+    mask_amounts_empty = ttc_amounts.isna() & ht_amounts.isna() & tva_amounts.isna()
+    if mask_amounts_empty.sum() > 0 and 'Total' in df_merged_final.columns:
+        total_from_orders = pd.to_numeric(df_merged_final['Total'], errors='coerce')
+        taxes_from_orders = pd.Series([None] * len(df_merged_final), dtype=float, index=df_merged_final.index)
+        if 'Taxes' in df_merged_final.columns:
+            taxes_from_orders = pd.to_numeric(df_merged_final['Taxes'], errors='coerce')
+        mask_fallback_ttc = mask_amounts_empty & total_from_orders.notna()
+        mask_fallback_tva = mask_amounts_empty & taxes_from_orders.notna()
+        ttc_amounts.loc[mask_fallback_ttc] = total_from_orders.loc[mask_fallback_ttc]
+        tva_amounts.loc[mask_fallback_tva] = taxes_from_orders.loc[mask_fallback_tva]
+        mask_fallback_ht = mask_amounts_empty & ttc_amounts.notna() & tva_amounts.notna()
+        ht_amounts.loc[mask_fallback_ht] = ttc_amounts.loc[mask_fallback_ht] - tva_amounts.loc[mask_fallback_ht]
+
+    return {'HT': ht_amounts, 'TVA': tva_amounts, 'TTC': ttc_amounts}
+
+def journal_citing_missing_order(state):
+    """
+    Journal du jeu complété d'une pièce multiple citant la dernière commande de l'export et une
+    commande absente (ex: commande d'un mois précédent): le montant entier revient à la commande
+    présente, comme dans l'implémentation d'origine
+    """
+    journal = state['journal']
+    present = str(state['merged_step1']['Name'].iloc[-1]).lstrip('#')
+    extra = journal.iloc[[0]].copy()
+    extra['Piece'] = f"{present} LCDI-99999999"
+    extra['Référence LMB'] = 'FAC-MANQUANTE'
+    for col, amount in zip(app.JOURNAL_AMOUNT_COLUMNS, [10.0, 8.33, 2.5]):
+        if col in extra.columns:
+            extra[col] = amount
+    return state['merged_step1'], pd.concat([journal, extra], ignore_index=True)
+
+# Cas comparés: (entrées tirées de l'état du pipeline, référence, candidate par défaut).
+# Une référence None n'existe que figée: le cas ne s'exécute qu'avec --golden (ou --save-golden,
+# qui fige alors la sortie du commit courant)
+CASES = {
+    'journal_matching': (
+        lambda state: (state['merged_step1'], state['journal']),
+        improve_journal_matching_reference,
+        app.improve_journal_matching,
+    ),
+    # Régression: pièce multiple dont une commande n'est pas dans l'export
+    'journal_missing_order': (
+        journal_citing_missing_order,
+        improve_journal_matching_reference,
+        app.improve_journal_matching,
+    ),
+    'corrected_amounts': (
+        lambda state: (state['merged_final'],),
+        calculate_corrected_amounts_reference,
+        app.calculate_corrected_amounts,
+    ),
+    'payment_categorization': (
+        lambda state: (state['merged_final'], app.calculate_corrected_amounts(state['merged_final'].copy())['TTC']),
+        categorize_payments_reference,
+        categorize_payments_vectorized,
+    ),
+    'invoice_dates': (
+        lambda state: (state['merged_final'],),
+        calculate_invoice_dates_reference,
+        app.calculate_invoice_dates,
+    ),
+    'date_formatting': (
+        lambda state: (state['loaded_orders']['Fulfilled at'],),
+        format_dates_reference,
+        app.format_dates_to_french,
+    ),
+    # Tableau final complet d'un autre commit (--golden) contre celui du commit courant
+    'final_table': (
+        lambda state: (state,),
+        None,
+        lambda state: state['final'],
+    ),
+}
+
+# Cas exécutés par défaut: ceux qui ont une référence calculable
+DEFAULT_CASES = [case for case, (_, reference_fn, _) in CASES.items() if reference_fn is not None]
+
+def load_function(spec):
+    """'module:fonction' -> fonction (le module est cherché aussi dans benchmarks/)"""
+    module_name, _, function_name = spec.partition(':')
+    if not function_name:
+        raise ValueError(f"Format attendu module:fonction, reçu '{spec}'")
+    return getattr(importlib.import_module(module_name), function_name)
+
+# Résultats intermédiaires conservés, tels qu'à la sortie de l'étape qui les produit
+PIPELINE_SNAPSHOTS = {
+    'normalize_columns': {'loaded_orders': 'orders'},
+    'clean_data': {'journal': 'journal'},
+    'merge_transactions': {'merged_step1': 'merged_step1'},
+    'merge_journal': {'merged_final': 'merged_final'},
+    'finalize': {'final': 'final'},
+}
+
+def build_pipeline_state(paths):
+    """Exécute toutes les étapes du pipeline en conservant une copie des résultats intermédiaires"""
+    # Ingestion séquentielle: les résultats doivent être pris entre normalisation et nettoyage
+    app.INGEST_WORKERS = 1
+    pipeline = app.BillingPipeline()
+    state = {
+        'orders_file': paths['orders'],
+        'transactions_file': paths['transactions'],
+        'journal_file': paths['journal'],
+        'restored': set(),
+    }
+    snapshots = {}
+    for stage in ['load_files'] + pipeline.STAGES:
+        getattr(pipeline, f'stage_{stage}')(state)
+        for snapshot, name in PIPELINE_SNAPSHOTS.get(stage, {}).items():
+            snapshots[snapshot] = state[name].copy()
+    return snapshots
+
+def copy_inputs(inputs):
+    return tuple(value.copy() if isinstance(value, (pd.DataFrame, pd.Series)) else value for value in inputs)
+
+def as_frame(result):
+    """Résultat d'une implémentation -> DataFrame (dict de séries, série ou DataFrame)"""
+    if isinstance(result, pd.DataFrame):
+        return result
+    if isinstance(result, pd.Series):
+        return result.to_frame(result.name if result.name is not None else 'valeur')
+    if isinstance(result, dict):
+        return pd.DataFrame(result)
+    raise TypeError(f"Résultat non comparable: {type(result).__name__}")
+
+def _missing(values):
+    return pd.isna(values).to_numpy() if hasattr(values, 'to_numpy') else pd.isna(values)
+
+def column_mismatches(reference, candidate, money, tolerance=MONEY_TOLERANCE):
+    """Masque booléen des cellules en écart pour une colonne"""
+    ref_missing, cand_missing = _missing(reference), _missing(candidate)
+    mismatch = ref_missing != cand_missing
+    both_present = ~ref_missing & ~cand_missing
+
+    if money:
+        # Montants au format français ou numériques: '12,30' et 12.3 sont égaux
+        ref_numbers = app.parse_french_amounts(reference).to_numpy(dtype=float)
+        cand_numbers = app.parse_french_amounts(candidate).to_numpy(dtype=float)
+        numeric = both_present & ~pd.isna(ref_numbers) & ~pd.isna(cand_numbers)
+        mismatch |= numeric & (abs(ref_numbers - cand_numbers) > tolerance + 1e-9)
+        # Valeurs présentes mais non numériques (ex: chaîne vide): égalité stricte
+        both_present &= ~numeric
+
+    mismatch |= both_present & (reference.astype(object).to_numpy() != candidate.astype(object).to_numpy())
+    return mismatch
+
+def compare_frames(reference, candidate, tolerance=MONEY_TOLERANCE):
+    """
+    Compare deux DataFrames cellule par cellule. Renvoie (problèmes de structure,
+    DataFrame des écarts: ligne, colonne, référence, candidate), écarts dans l'ordre des lignes
+    """
+    problems = []
+    if list(reference.columns) != list(candidate.columns):
+        missing = [col for col in reference.columns if col not in candidate.columns]
+        extra = [col for col in candidate.columns if col not in reference.columns]
+        problems.append(f"colonnes différentes (manquantes: {missing}, en trop: {extra})"
+                        if missing or extra else "ordre des colonnes différent")
+    if len(reference) != len(candidate):
+        problems.append(f"nombre de lignes différent: {len(reference)} contre {len(candidate)}")
+        return problems, pd.DataFrame()
+    if not reference.index.equals(candidate.index):
+        problems.append("index différent (comparaison par position)")
+
+    mismatches = []
+    for col in [col for col in reference.columns if col in candidate.columns]:
+        ref_values, cand_values = reference[col], candidate[col]
+        money = col in MONEY_COLUMNS or (pd.api.types.is_numeric_dtype(ref_values)
+                                         and pd.api.types.is_numeric_dtype(cand_values))
+        mask = column_mismatches(ref_values.reset_index(drop=True), cand_values.reset_index(drop=True),
+                                 money, tolerance)
+        for position in mask.nonzero()[0]:
+            mismatches.append({'position': position, 'ligne': reference.index[position], 'colonne': col,
+                               'référence': ref_values.iloc[position], 'candidate': cand_values.iloc[position]})
+    diff = pd.DataFrame(mismatches, columns=['position', 'ligne', 'colonne', 'référence', 'candidate'])
+    return problems, diff.sort_values('position', kind='stable').drop(columns='position')
+
+def row_label(frame, position):
+    """Référence de commande de la ligne, pour retrouver la commande en écart"""
+    for col in ('Réf.WEB', 'Name'):
+        if col in frame.columns:
+            return frame[col].iloc[position]
+    return ''
+
+def report_case(name, reference, problems, diff, max_rows=MAX_REPORTED_ROWS):
+    if not problems and diff.empty:
+        return True
+    print(f"  ✗ {name}: {len(diff)} cellules en écart sur {diff['ligne'].nunique() if len(diff) else 0} lignes")
+    for problem in problems:
+        print(f"    - {problem}")
+    first_rows = list(dict.fromkeys(diff['ligne']))[:max_rows]
+    for row in first_rows:
+        position = reference.index.get_loc(row)
+        print(f"    ligne {row} {row_label(reference, position)}")
+        for _, cell in diff[diff['ligne'] == row].iterrows():
+            print(f"      {cell['colonne']:<28} référence={cell['référence']!r:<24} candidate={cell['candidate']!r}")
+    return False
+
+def golden_path(golden_dir, case, n_orders, seed):
+    return os.path.join(golden_dir, f'{case}_{n_orders}_{seed}.pkl')
+
+def run(cases, orders_list, seeds, candidates=None, tolerance=None,
+        golden_dir=None, save_golden_dir=None, max_rows=MAX_REPORTED_ROWS):
+    """Exécute les cas demandés pour chaque jeu; renvoie le nombre de cas en écart"""
+    candidates = candidates or {}
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='lcdi_equivalence_') as work_dir:
+        for n_orders in orders_list:
+            for seed in seeds:
+                paths = write_dataset(os.path.join(work_dir, f'data_{n_orders}_{seed}'), n_orders, seed)
+                state = build_pipeline_state(paths)
+                print(f"\n=== {n_orders:,} commandes, graine {seed} ===")
+
+                for case in cases:
+                    build_inputs, reference_fn, candidate_fn = CASES[case]
+                    candidate_fn = candidates.get(case, candidate_fn)
+                    inputs = build_inputs(state)
+
+                    start = time.perf_counter()
+                    if golden_dir:
+                        reference = pd.read_pickle(golden_path(golden_dir, case, n_orders, seed))
+                    else:
+                        reference = as_frame((reference_fn or candidate_fn)(*copy_inputs(inputs)))
+                    reference_s = time.perf_counter() - start
+                    if save_golden_dir:
+                        os.makedirs(save_golden_dir, exist_ok=True)
+                        reference.to_pickle(golden_path(save_golden_dir, case, n_orders, seed))
+
+                    start = time.perf_counter()
+                    candidate = as_frame(candidate_fn(*copy_inputs(inputs)))
+                    candidate_s = time.perf_counter() - start
+
+                    case_tolerance = tolerance if tolerance is not None else CASE_TOLERANCES.get(case, MONEY_TOLERANCE)
+                    problems, diff = compare_frames(reference, candidate, case_tolerance)
+                    if report_case(case, reference, problems, diff, max_rows):
+                        print(f"  ✓ {case:<24} {len(reference)} lignes x {len(reference.columns)} colonnes identiques"
+                              f"  (référence {reference_s:.3f} s, candidate {candidate_s:.3f} s)")
+                    else:
+                        failures += 1
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Équivalence des implémentations de référence et candidates")
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES),
+                        help='cas à comparer (défaut: tous, final_table seulement avec --golden)')
+    parser.add_argument('--orders', type=int, nargs='+', default=DEFAULT_ORDERS)
+    parser.add_argument('--seeds', type=int, nargs='+', default=DEFAULT_SEEDS)
+    parser.add_argument('--candidate', action='append', default=[], metavar='CAS=MODULE:FONCTION',
+                        help='implémentation candidate à comparer à la référence du cas')
+    parser.add_argument('--tolerance', type=float,
+                        help='écart toléré sur les montants pour tous les cas (défaut: un demi-centime, '
+                             'un centime pour journal_matching)')
+    parser.add_argument('--max-rows', type=int, default=MAX_REPORTED_ROWS,
+                        help='nombre de lignes en écart affichées par cas')
+    golden = parser.add_mutually_exclusive_group()
+    golden.add_argument('--golden', help='dossier des sorties de référence figées à utiliser')
+    golden.add_argument('--save-golden', help='dossier où figer les sorties de référence')
+    args = parser.parse_args()
+    if args.cases is None:
+        args.cases = list(CASES) if args.golden or args.save_golden else DEFAULT_CASES
+    golden_only = [case for case in args.cases if CASES[case][1] is None]
+    if golden_only and not (args.golden or args.save_golden):
+        parser.error(f"{', '.join(golden_only)}: sans référence calculable, à comparer avec --golden")
+
+    sys.path.insert(0, BENCH_DIR)
+    candidates = {}
+    for option in args.candidate:
+        case, _, spec = option.partition('=')
+        if case not in CASES:
+            parser.error(f"cas inconnu '{case}' (choix: {', '.join(CASES)})")
+        candidates[case] = load_function(spec)
+
+    failures = run(args.cases, args.orders, args.seeds, candidates, args.tolerance,
+                   args.golden, args.save_golden, args.max_rows)
+    if failures:
+        print(f"\n{failures} cas en écart")
+        sys.exit(1)
+    print("\nToutes les implémentations sont équivalentes")
+
+if __name__ == '__main__':
+    main()
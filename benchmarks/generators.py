@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Générateurs de données synthétiques pour les benchmarks (reproductibles via une graine)
+
+- Export des commandes Shopify: plusieurs lignes par commande (une par article), seules
+  les premières lignes portant les informations de la commande, comme l'export réel
+- Export des transactions Shopify: zéro, une ou deux transactions par commande
+- Journal LMB: séparateur point-virgule, décimales à virgule, références aux formats
+  'LCDI-XXXX' et '#LCDI-XXXX', pièces à références multiples ('LCDI-1020 LCDI-1021')
+  et encodage configurable (windows-1252 par défaut, comme les exports LMB)
+
+Entièrement vectorisé (numpy/pandas): 1M commandes (environ 400 Mo de CSV) en une minute.
+
+Usage:
+    python benchmarks/generators.py 10000 /tmp/jeu_10k
+    python benchmarks/generators.py 1000000 /tmp/jeu_1M --seed 7 --journal-encoding utf-8-sig
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+ORDER_NUMBER_START = 1000
+JOURNAL_ENCODINGS = ['windows-1252', 'latin-1', 'utf-8', 'utf-8-sig']
+
+# Méthodes de paiement (commandes) et libellés correspondants côté transactions
+PAYMENT_METHODS = [
+    ('Shopify Payments', 'card', 0.45),
+    ('PayPal Express Checkout', 'paypal', 0.2),
+    ('Alma', 'alma', 0.08),
+    ('Younited Pay', 'younited', 0.04),
+    ('Virement bancaire', 'bank_transfer', 0.08),
+    ('Bank Deposit', 'manual', 0.03),
+    ('custom', 'Carte', 0.04),
+    ('gift_card', 'gift_card', 0.03),
+    ('', '', 0.05),
+]
+FINANCIAL_STATUSES = [('paid', 0.75), ('pending', 0.08), ('refunded', 0.05),
+                      ('partially_paid', 0.05), ('authorized', 0.04), ('voided', 0.03)]
+BILLING_NAMES = ['Jean Dupont', 'Marie Curie', 'Élodie Gâté', 'François Lefèvre',
+                 'Chloé Bérénice', 'Søren Kierkegaard', 'Zoë Ægir', '']
+PRODUCTS = ['Câble USB-C 2 m', 'Écran 27" réparé', 'Batterie reconditionnée',
+            'Clavier AZERTY', 'Souris sans fil', 'Disque SSD 1 To']
+JOURNAL_LABELS = ['Facture client', 'Facture réglée', 'Avoir émis', 'Règlement différé']
+
+ORDERS_COLUMNS = ['Name', 'Email', 'Financial Status', 'Paid at', 'Fulfillment Status',
+                  'Fulfilled at', 'Currency', 'Subtotal', 'Shipping', 'Taxes', 'Total',
+                  'Discount Amount', 'Lineitem quantity', 'Lineitem name', 'Lineitem price',
+                  'Billing Name', 'Payment Method', 'Outstanding Balance', 'Tax 1 Name',
+                  'Tax 1 Value']
+TRANSACTIONS_COLUMNS = ['Transaction Date', 'Type', 'Order', 'Card Brand', 'Payout Status',
+                        'Payout Date', 'Amount', 'Fee', 'Net', 'Payment Method Name',
+                        'Presentment Amount', 'Presentment Currency', 'Currency']
+JOURNAL_COLUMNS = ['Piece', 'Référence LMB', 'Date du document', 'Libellé',
+                   'Montant du document TTC', 'Montant du document HT', 'Montant marge HT']
+
+def _choice(rng, weighted, size):
+    """Tirage pondéré dans une liste de tuples (valeur(s)..., poids); renvoie les indices"""
+    weights = np.array([item[-1] for item in weighted], dtype=float)
+    return rng.choice(len(weighted), size=size, p=weights / weights.sum())
+
+def _french_decimal(values):
+    """Montants au format du journal LMB: deux décimales, virgule, vide si absent"""
+    text = pd.Series(values).map('{:.2f}'.format).str.replace('.', ',', regex=False)
+    return text.where(pd.notna(values), '')
+
+def _timestamps(rng, size, start='2025-05-01'):
+    """Dates aléatoires sur deux mois"""
+    seconds = rng.integers(0, 61 * 24 * 3600, size)
+    return pd.Timestamp(start) + pd.to_timedelta(seconds, unit='s')
+
+def generate_orders(n_orders, seed=42):
+    """
+    Export des commandes: une ligne par article, de 1 à 4 lignes par commande.
+    Renvoie (DataFrame des lignes, DataFrame d'une ligne par commande) : le second
+    sert à générer des transactions et un journal cohérents avec les commandes.
+    """
+    rng = np.random.default_rng(seed)
+    numbers = np.arange(ORDER_NUMBER_START, ORDER_NUMBER_START + n_orders)
+    totals = np.round(rng.uniform(5, 1500, n_orders), 2)
+    taxes = np.round(totals - totals / 1.2, 2)
+    method_idx = _choice(rng, PAYMENT_METHODS, n_orders)
+    fulfilled_at = pd.Series(_timestamps(rng, n_orders)).dt.strftime('%Y-%m-%d %H:%M:%S +0200')
+    fulfilled_at = fulfilled_at.where(rng.random(n_orders) >= 0.1, '')
+
+    orders = pd.DataFrame({
+        'number': numbers,
+        'Name': '#LCDI-' + pd.Series(numbers).astype(str),
+        'Financial Status': np.array([s for s, _ in FINANCIAL_STATUSES])[_choice(rng, FINANCIAL_STATUSES, n_orders)],
+        'Fulfilled at': fulfilled_at,
+        'Total': totals,
+        'Taxes': taxes,
+        'Billing Name': np.array(BILLING_NAMES)[rng.integers(0, len(BILLING_NAMES), n_orders)],
+        'Payment Method': np.array([m for m, _, _ in PAYMENT_METHODS])[method_idx],
+        'Transaction Method': np.array([t for _, t, _ in PAYMENT_METHODS])[method_idx],
+        'Outstanding Balance': np.where(rng.random(n_orders) < 0.05, np.round(totals / 3, 2), 0.0),
+    })
+
+    # Une ligne par article; les lignes suivantes n'ont que les colonnes d'article
+    line_counts = rng.choice([1, 2, 3, 4], size=n_orders, p=[0.6, 0.25, 0.1, 0.05])
+    order_pos = np.repeat(np.arange(n_orders), line_counts)
+    first_line = np.r_[True, order_pos[1:] != order_pos[:-1]]
+    lines = orders.iloc[order_pos].reset_index(drop=True)
+    n_lines = len(lines)
+
+    df = pd.DataFrame({
+        'Name': lines['Name'],
+        'Email': 'client' + (lines['number'] % 5000).astype(str) + '@example.fr',
+        'Financial Status': lines['Financial Status'],
+        'Paid at': lines['Fulfilled at'],
+        'Fulfillment Status': np.where(lines['Fulfilled at'] == '', 'unfulfilled', 'fulfilled'),
+        'Fulfilled at': lines['Fulfilled at'],
+        'Currency': 'EUR',
+        'Subtotal': np.round(lines['Total'] - 4.9, 2),
+        'Shipping': 4.9,
+        'Taxes': lines['Taxes'],
+        'Total': lines['Total'],
+        'Discount Amount': 0.0,
+        'Lineitem quantity': rng.integers(1, 4, n_lines),
+        'Lineitem name': np.array(PRODUCTS)[rng.integers(0, len(PRODUCTS), n_lines)],
+        'Lineitem price': np.round(rng.uniform(2, 500, n_lines), 2),
+        'Billing Name': lines['Billing Name'],
+        'Payment Method': lines['Payment Method'],
+        'Outstanding Balance': lines['Outstanding Balance'],
+        'Tax 1 Name': 'FR TVA 20%',
+        'Tax 1 Value': lines['Taxes'],
+    }, columns=ORDERS_COLUMNS)
+    order_level = [col for col in ORDERS_COLUMNS
+                   if col not in ('Name', 'Lineitem quantity', 'Lineitem name', 'Lineitem price')]
+    df[order_level] = df[order_level].astype(object).where(pd.Series(first_line), '', axis=0)
+    return df, orders
+
+def generate_transactions(orders, seed=42):
+    """
+    Export des transactions Shopify Payments: 10% des commandes sans transaction,
+    10% réglées en deux paiements
+    """
+    rng = np.random.default_rng(seed + 1)
+    n_orders = len(orders)
+    counts = rng.choice([0, 1, 2], size=n_orders, p=[0.1, 0.8, 0.1])
+    order_pos = np.repeat(np.arange(n_orders), counts)
+    tx = orders.iloc[order_pos].reset_index(drop=True)
+
+    # Paiement en deux fois: chaque transaction porte la moitié du montant
+    share = np.where(counts[order_pos] == 2, 0.5, 1.0)
+    amounts = np.round(tx['Total'].to_numpy() * share, 2)
+    fees = np.round(amounts * 0.014 + 0.25, 2)
+    created_at = pd.Series(_timestamps(rng, len(tx)))
+    method_names = tx['Transaction Method'].to_numpy().copy()
+    method_names[rng.random(len(tx)) < 0.02] = 'Carte bancaire'
+
+    return pd.DataFrame({
+        'Transaction Date': created_at.dt.strftime('%Y-%m-%d %H:%M:%S +0200'),
+        'Type': 'charge',
+        'Order': tx['Name'],
+        'Card Brand': np.where(method_names == 'card', 'visa', ''),
+        'Payout Status': 'paid',
+        'Payout Date': (created_at + pd.Timedelta(days=3)).dt.strftime('%Y-%m-%d'),
+        'Amount': amounts,
+        'Fee': fees,
+        'Net': np.round(amounts - fees, 2),
+        'Payment Method Name': method_names,
+        'Presentment Amount': amounts,
+        'Presentment Currency': 'EUR',
+        'Currency': 'EUR',
+    }, columns=TRANSACTIONS_COLUMNS)
+
+def generate_journal(orders, seed=42, multi_reference_rate=0.05):
+    """
+    Journal LMB: 85% des commandes facturées, références avec ou sans '#', et une part
+    de pièces regroupant deux commandes consécutives ('LCDI-1020 LCDI-1021') dont les
+    montants couvrent les deux commandes (répartis ensuite au prorata par l'application)
+    """
+    rng = np.random.default_rng(seed + 2)
+    n_orders = len(orders)
+    numbers = orders['number'].to_numpy()
+    totals = orders['Total'].to_numpy()
+
+    # Début des pièces multiples: commande paire de rang i suivie de i + 1
+    starts_multi = (rng.random(n_orders) < multi_reference_rate) & (np.arange(n_orders) % 2 == 0)
+    starts_multi[-1] = False
+    covered = np.r_[False, starts_multi[:-1]]
+    invoiced = (rng.random(n_orders) < 0.85) & ~covered
+
+    pos = np.flatnonzero(invoiced)
+    multi = starts_multi[pos]
+    ref_numbers = pd.Series(numbers[pos]).astype(str)
+    next_numbers = pd.Series(numbers[pos] + 1).astype(str)
+    prefix = pd.Series(np.where(rng.random(len(pos)) < 0.5, '#', ''))
+    pieces = (prefix + 'LCDI-' + ref_numbers).where(~multi, 'LCDI-' + ref_numbers + ' LCDI-' + next_numbers)
+
+    ttc = totals[pos] + np.where(multi, np.r_[totals, 0.0][np.minimum(pos + 1, n_orders)], 0.0)
+    ttc = np.round(ttc, 2)
+    ht = np.round(ttc / 1.2, 2)
+    ttc_values = pd.Series(ttc).where(rng.random(len(pos)) > 0.03)
+    dates = pd.Series(_timestamps(rng, len(pos))).dt.strftime('%d/%m/%Y %H:%M:%S')
+    dates = dates.where(rng.random(len(pos)) >= 0.05, '')
+
+    return pd.DataFrame({
+        'Piece': pieces,
+        'Référence LMB': 'FAC-' + pd.Series(np.arange(1, len(pos) + 1)).astype(str).str.zfill(7),
+        'Date du document': dates,
+        'Libellé': np.array(JOURNAL_LABELS)[rng.integers(0, len(JOURNAL_LABELS), len(pos))],
+        'Montant du document TTC': _french_decimal(ttc_values),
+        'Montant du document HT': _french_decimal(pd.Series(ht).where(ttc_values.notna())),
+        'Montant marge HT': _french_decimal(np.round(ht * 0.3, 2)),
+    }, columns=JOURNAL_COLUMNS)
+
+def generate_dataset(n_orders, seed=42):
+    """Les trois fichiers d'entrée cohérents entre eux, sous forme de DataFrames"""
+    df_orders, orders = generate_orders(n_orders, seed)
+    return {
+        'orders': df_orders,
+        'transactions': generate_transactions(orders, seed),
+        'journal': generate_journal(orders, seed),
+    }
+
+def write_dataset(directory, n_orders, seed=42, journal_encoding='windows-1252'):
+    """
+    Écrit orders.csv, transactions.csv (UTF-8, virgule) et journal.csv (point-virgule,
+    encodage journal_encoding) dans directory; renvoie {type: chemin}
+    """
+    os.makedirs(directory, exist_ok=True)
+    dataset = generate_dataset(n_orders, seed)
+    paths = {name: os.path.join(directory, f'{name}.csv') for name in dataset}
+    dataset['orders'].to_csv(paths['orders'], index=False, encoding='utf-8')
+    dataset['transactions'].to_csv(paths['transactions'], index=False, encoding='utf-8')
+    dataset['journal'].to_csv(paths['journal'], index=False, sep=';', encoding=journal_encoding)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère un jeu de fichiers d'entrée synthétique")
+    parser.add_argument('orders', type=int, help='nombre de commandes')
+    parser.add_argument('directory')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--journal-encoding', choices=JOURNAL_ENCODINGS, default='windows-1252')
+    args = parser.parse_args()
+    paths = write_dataset(args.directory, args.orders, args.seed, args.journal_encoding)
+    for name, path in paths.items():
+        print(f"{name:<13} {os.path.getsize(path) / 1024:10.0f} Ko  {path}")
+
+if __name__ == '__main__':
+    main()